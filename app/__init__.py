@@ -1,7 +1,9 @@
 from flask import Flask
-from app.routes import auth_routes, transactions_routes
 
 def create_app():
+    # imported here so that importing a submodule (app.cli, app.utils...) does not load the routes
+    from app.routes import auth_routes, transactions_routes
+
     app = Flask(__name__)
     app.secret_key = 'your_secret_key_here'
     
@@ -9,4 +11,4 @@ def create_app():
     app.register_blueprint(auth_routes.bp)
     app.register_blueprint(transactions_routes.bp)
     
-    return app
\ No newline at end of file
+    return app
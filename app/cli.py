@@ -0,0 +1,157 @@
+"""
+Maintenance commands, run with `python -m app.cli <command>`.
+"""
+import argparse
+import sys
+import time
+
+
+def backfill_monthly_spend_command(args):
+    from app.services.mongo_service import MongoService
+
+    count = MongoService().rebuild_monthly_spend(args.user_id)
+    print(f"monthly_spend rebuilt: {count} rollups")
+
+
+def reconcile_monthly_spend_command(args):
+    from app.services.mongo_service import MongoService
+
+    count = MongoService().reconcile_monthly_spend(args.older_than)
+    print(f"monthly_spend reconciled: {count} users repaired")
+
+
+def backfill_device_users_command(args):
+    from app.services.mongo_service import MongoService
+
+    count = MongoService().rebuild_device_users()
+    print(f"device_users rebuilt: {count} devices")
+
+
+def ensure_indexes_command(args):
+    from app.models.mongo_indexes import ensure_indexes
+
+    for collection, names in ensure_indexes().items():
+        print(f"{collection}: {', '.join(names)}")
+
+
+def check_indexes_command(args):
+    from app.models.mongo_indexes import ensure_indexes, check_query_plans
+
+    if args.ensure:
+        ensure_indexes()
+    failures = check_query_plans()
+    for description, stages in failures:
+        print(f"NOT INDEXED: {description} ({' > '.join(stages)})")
+    if failures:
+        sys.exit(1)
+    print("All service queries use an index scan")
+
+
+def graph_stats_command(args):
+    from app.services.transaction_graph import rebuild_transaction_graph
+
+    start = time.perf_counter()
+    stats = rebuild_transaction_graph().stats()
+    print(f"transaction graph loaded in {time.perf_counter() - start:.2f}s")
+    for key in ("users", "edges", "max_edges", "array_bytes", "object_bytes", "total_bytes"):
+        print(f"{key}: {stats[key]}")
+
+
+def import_command(args):
+    from app.services.import_service import run_import
+
+    def progress(stats):
+        print(f"{stats['records']} records, {stats['imported']} imported, "
+              f"{stats['invalid']} invalid, {stats['per_second']:.0f} records/s")
+
+    stats = run_import(args.kind, args.path, args.chunk_size, args.checkpoint, args.restart, progress)
+    print(f"{args.kind} imported: {stats['imported']} of {stats['records']} records "
+          f"({stats['skipped']} skipped from checkpoint, {stats['invalid']} invalid) "
+          f"in {stats['seconds']:.1f}s")
+
+
+def scoring_worker_command(args):
+    import signal
+    import threading
+    from app.services import deferred_scoring  # registers the event handlers
+    from app.services.scoring_pipeline import ScoringWorker
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    worker = ScoringWorker(worker_id=args.worker_id)
+    print(f"Scoring worker {worker.worker_id} consuming {worker.partitions} partitions, Ctrl+C to stop")
+    try:
+        worker.run(stop)
+    except KeyboardInterrupt:
+        pass
+    print(f"Scoring worker stopped: {worker.stats}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.cli")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser(
+        "backfill-monthly-spend",
+        help="Build the monthly_spend rollups from the verified transactions history",
+    )
+    cmd.add_argument("--user-id", help="Only rebuild the rollups of this user")
+    cmd.set_defaults(func=backfill_monthly_spend_command)
+
+    cmd = commands.add_parser(
+        "reconcile-monthly-spend",
+        help="Rebuild the monthly_spend rollups of the transactions whose rollup update was interrupted",
+    )
+    cmd.add_argument("--older-than", type=int, default=60,
+                     help="Only the updates started this many seconds ago or more")
+    cmd.set_defaults(func=reconcile_monthly_spend_command)
+
+    cmd = commands.add_parser(
+        "backfill-device-users",
+        help="Build the device_users cardinality index from the device logs history",
+    )
+    cmd.set_defaults(func=backfill_device_users_command)
+
+    cmd = commands.add_parser("ensure-indexes", help="Create the declared MongoDB indexes")
+    cmd.set_defaults(func=ensure_indexes_command)
+
+    cmd = commands.add_parser(
+        "check-indexes",
+        help="Explain the service queries and fail if one of them is not an index scan",
+    )
+    cmd.add_argument("--ensure", action="store_true", help="Create the indexes before checking")
+    cmd.set_defaults(func=check_indexes_command)
+
+    cmd = commands.add_parser(
+        "graph-stats",
+        help="Load the in-process transaction graph from Neo4j and print its size",
+    )
+    cmd.set_defaults(func=graph_stats_command)
+
+    cmd = commands.add_parser(
+        "import",
+        help="Bulk import users, device logs or transactions from a JSONL or CSV file",
+    )
+    cmd.add_argument("kind", choices=["users", "devices", "transactions"])
+    cmd.add_argument("path", help="JSONL file, or CSV file (.csv) with dotted columns for nested fields")
+    cmd.add_argument("--chunk-size", type=int, default=5000)
+    cmd.add_argument("--checkpoint", help="Checkpoint file (default: <path>.checkpoint)")
+    cmd.add_argument("--restart", action="store_true", help="Ignore the checkpoint and import from the start")
+    cmd.set_defaults(func=import_command)
+
+    cmd = commands.add_parser(
+        "scoring-worker",
+        help="Consume the scoring events of the Redis Streams (SCORING_MODE=stream, or DEFERRED_BACKEND=stream)",
+    )
+    cmd.add_argument("--worker-id", help="Consumer name (default: host-pid-random)")
+    cmd.set_defaults(func=scoring_worker_command)
+
+    args = parser.parse_args(argv)
+    from app.utils.logs import configure_logging
+
+    configure_logging()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+The database models and services of the process, selected by DB_BACKEND:
+the MongoDB, Redis and Neo4j implementations, or their in-process stand-ins
+of app/memory (DB_BACKEND=memory).
+
+The routes and services import them from here, e.g.
+`from app.db.backend import MongoService`. The implementation module is
+only imported on first access: the stand-ins extend the real classes, so
+the real modules must not import them back.
+"""
+from typing import Optional
+from app.utils.config import Config
+import importlib
+
+
+# name: (live implementation, in-memory stand-in), as "module:attribute"
+IMPLEMENTATIONS = {
+    "MongoUserModel": ("app.models.mongo_model:MongoUserModel", "app.memory.mongo:MemoryUserModel"),
+    "MongoTransactionModel": ("app.models.mongo_model:MongoTransactionModel", "app.memory.mongo:MemoryTransactionModel"),
+    "DeviceLogModel": ("app.models.mongo_model:DeviceLogModel", "app.memory.mongo:MemoryDeviceLogModel"),
+    "DeviceUsersModel": ("app.models.mongo_model:DeviceUsersModel", "app.memory.mongo:MemoryDeviceUsersModel"),
+    "MonthlySpendModel": ("app.models.mongo_model:MonthlySpendModel", "app.memory.mongo:MemoryMonthlySpendModel"),
+    "CounterModel": ("app.models.mongo_model:CounterModel", "app.memory.mongo:MemoryCounterModel"),
+    "RedisTrustScoreModel": ("app.models.redis_model:RedisTrustScoreModel", "app.memory.redis:MemoryTrustScoreModel"),
+    "RedisTrustWindowModel": ("app.models.redis_model:RedisTrustWindowModel", "app.memory.redis:MemoryTrustWindowModel"),
+    "Neo4jUserModel": ("app.models.neo4j_model:Neo4jUserModel", "app.memory.neo4j:MemoryNeo4jUserModel"),
+    "MongoService": ("app.services.mongo_service:MongoService", "app.memory.mongo_service:MemoryMongoService"),
+    "Neo4jService": ("app.services.neo4j_service:Neo4jService", "app.memory.neo4j_service:MemoryNeo4jService"),
+}
+
+
+def is_memory(backend: Optional[str] = None) -> bool:
+    return (backend or Config.DB_BACKEND) == "memory"
+
+
+def implementation(name: str, backend: Optional[str] = None):
+    """The class `name` of `backend` (DB_BACKEND by default)."""
+    live, memory = IMPLEMENTATIONS[name]
+    module, attribute = (memory if is_memory(backend) else live).split(":")
+    return getattr(importlib.import_module(module), attribute)
+
+
+def __getattr__(name):
+    if name in IMPLEMENTATIONS:
+        return implementation(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
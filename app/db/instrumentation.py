@@ -0,0 +1,247 @@
+"""
+Instrumentation of the database clients, installed by the client factories
+when METRICS_ENABLED or TRACING_ENABLED is set. Each round trip is counted
+and timed (app/utils/metrics), and recorded as a span of the request trace
+and in the slow query log (app/utils/tracing):
+
+- MongoDB: each command the driver sends, through a command listener;
+- Redis: each command, script call (EVALSHA) and pipeline execution;
+- Neo4j: each query, from its run to the consumption of its result,
+  named after the service method or unit of work running it, with the
+  timings of the result summary (and the db hits and rows with
+  NEO4J_PROFILE).
+"""
+from pymongo import monitoring
+from app.utils.config import Config
+from app.utils.metrics import observe_datastore
+from app.utils.tracing import record_span
+import functools
+import sys
+import threading
+import time
+
+
+def record_round_trip(datastore: str, operation: str, start: float, duration: float, failed: bool = False,
+                      statement=None, parameters=None, detail=None):
+    if Config.METRICS_ENABLED:
+        observe_datastore(datastore, operation, duration, failed)
+    if Config.TRACING_ENABLED:
+        record_span(datastore, operation, start, duration, failed, statement, parameters, detail)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    # session and cluster metadata added by the driver, left out of the logs
+    METADATA = ("lsid", "txnNumber", "$db", "$clusterTime", "$readPreference")
+
+    def __init__(self):
+        # the events of a command are published in the thread running it
+        self._started = threading.local()
+
+    def started(self, event):
+        self._started.command = event.command
+
+    def succeeded(self, event):
+        self._record(event, failed=False)
+
+    def failed(self, event):
+        self._record(event, failed=True)
+
+    def _record(self, event, failed):
+        command, self._started.command = getattr(self._started, "command", None), None
+        duration = event.duration_micros / 1e6
+        collection = command.get(event.command_name) if command else None
+        record_round_trip(
+            "mongodb", event.command_name, time.perf_counter() - duration, duration, failed,
+            statement=f"{event.command_name} {collection}" if isinstance(collection, str) else event.command_name,
+            parameters={
+                key: value for key, value in command.items()
+                if key != event.command_name and key not in self.METADATA
+            } if command else None,
+        )
+
+
+def instrument_redis(client):
+    """Times the commands and the pipelines of a redis-py client."""
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    def timed_execute_command(*args, **options):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = execute_command(*args, **options)
+            failed = False
+            return result
+        finally:
+            record_round_trip("redis", str(args[0]).upper(), start, time.perf_counter() - start, failed,
+                              statement=str(args[0]), parameters=args[1:])
+
+    def timed_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        def timed_execute(*args, **kwargs):
+            commands = [command for command, _ in pipe.command_stack]
+            start = time.perf_counter()
+            failed = True
+            try:
+                result = execute(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                record_round_trip("redis", "PIPELINE", start, time.perf_counter() - start, failed,
+                                  statement=f"PIPELINE of {len(commands)}", parameters=commands)
+
+        pipe.execute = timed_execute
+        return pipe
+
+    # the commands, scripts and locks of the client all go through execute_command
+    client.execute_command = timed_execute_command
+    client.pipeline = timed_pipeline
+    return client
+
+
+# schema commands cannot be profiled
+_NOT_PROFILED = ("CREATE CONSTRAINT", "CREATE INDEX", "DROP", "SHOW")
+
+
+def _text(query) -> str:
+    # a str, or a neo4j.Query carrying a timeout
+    return getattr(query, "text", query)
+
+
+def _profiled(query):
+    text = _text(query)
+    if not Config.NEO4J_PROFILE or text.lstrip().upper().startswith(_NOT_PROFILED):
+        return query
+    if text is query:
+        return "PROFILE " + text
+    from neo4j import Query
+
+    return Query("PROFILE " + text, metadata=query.metadata, timeout=query.timeout)
+
+
+def _db_hits(plan: dict) -> int:
+    return plan.get("dbHits", 0) + sum(_db_hits(child) for child in plan.get("children", ()))
+
+
+def _summary_detail(summary) -> dict:
+    detail = {
+        "available_after_ms": summary.result_available_after,
+        "consumed_after_ms": summary.result_consumed_after,
+    }
+    if summary.profile:
+        detail["db_hits"] = _db_hits(summary.profile)
+        detail["rows"] = summary.profile.get("rows")
+    return detail
+
+
+class QueryTimer:
+    """
+    Times the queries run through a session or a transaction: a query ends
+    when its result is consumed, on the next query or on finish().
+    """
+
+    def __init__(self):
+        self._running = None
+
+    def run(self, operation: str, run, query, parameters=None, **kwargs):
+        self.finish()
+        start = time.perf_counter()
+        try:
+            result = run(_profiled(query), parameters, **kwargs)
+        except Exception:
+            record_round_trip("neo4j", operation, start, time.perf_counter() - start, True,
+                              statement=_text(query), parameters=parameters or kwargs)
+            raise
+        self._running = (operation, _text(query), parameters or kwargs, result, start)
+        return result
+
+    def finish(self, failed: bool = False):
+        if self._running is None:
+            return
+        operation, query, parameters, result, start = self._running
+        self._running = None
+        detail = None
+        try:
+            detail = _summary_detail(result.consume())
+        except Exception:
+            failed = True
+        record_round_trip("neo4j", operation, start, time.perf_counter() - start, failed,
+                          statement=query, parameters=parameters, detail=detail)
+
+
+class InstrumentedTransaction:
+    def __init__(self, tx, operation: str):
+        self._tx = tx
+        self._operation = operation
+        self._queries = QueryTimer()
+
+    def run(self, query, parameters=None, **kwargs):
+        return self._queries.run(self._operation, self._tx.run, query, parameters, **kwargs)
+
+    def finish(self, failed: bool = False):
+        self._queries.finish(failed)
+
+    def __getattr__(self, name):
+        return getattr(self._tx, name)
+
+
+def _instrumented_unit(transaction_function):
+    @functools.wraps(transaction_function)
+    def unit(tx, *args, **kwargs):
+        tx = InstrumentedTransaction(tx, transaction_function.__name__)
+        failed = True
+        try:
+            result = transaction_function(tx, *args, **kwargs)
+            failed = False
+            return result
+        finally:
+            tx.finish(failed)
+    return unit
+
+
+class InstrumentedSession:
+    def __init__(self, session):
+        self._session = session
+        self._queries = QueryTimer()
+
+    def __enter__(self):
+        self._session.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._queries.finish(failed=exc_type is not None)
+        return self._session.__exit__(exc_type, exc, tb)
+
+    def run(self, query, parameters=None, **kwargs):
+        operation = sys._getframe(1).f_code.co_name
+        return self._queries.run(operation, self._session.run, query, parameters, **kwargs)
+
+    def execute_read(self, transaction_function, *args, **kwargs):
+        self._queries.finish()
+        return self._session.execute_read(_instrumented_unit(transaction_function), *args, **kwargs)
+
+    def execute_write(self, transaction_function, *args, **kwargs):
+        self._queries.finish()
+        return self._session.execute_write(_instrumented_unit(transaction_function), *args, **kwargs)
+
+    def close(self):
+        self._queries.finish()
+        return self._session.close()
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+
+class InstrumentedDriver:
+    """Neo4j driver whose queries are timed, see InstrumentedSession."""
+
+    def __init__(self, driver):
+        self._driver = driver
+
+    def session(self, *args, **kwargs):
+        return InstrumentedSession(self._driver.session(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._driver, name)
@@ -1,10 +1,31 @@
-from pymongo import MongoClient
 from app.utils.config import Config
+from .registry import registry, LazyClient
 
-client = MongoClient(Config.MONGO_URI)
-db = client.get_database("antiscamdb") 
-try:
-    client.admin.command('ping')
-    print("MongoDB connection established.")
-except Exception as e:
-    print("MongoDB connection failed:", e)
\ No newline at end of file
+
+def _create_client():
+    from pymongo import MongoClient
+
+    listeners = []
+    if Config.METRICS_ENABLED or Config.TRACING_ENABLED:
+        from .instrumentation import MongoCommandListener
+
+        listeners.append(MongoCommandListener())
+    return MongoClient(
+        Config.MONGO_URI,
+        maxPoolSize=Config.MONGO_MAX_POOL_SIZE,
+        connectTimeoutMS=int(Config.DB_CONNECT_TIMEOUT * 1000),
+        event_listeners=listeners,
+    )
+
+registry.register("mongo", _create_client)
+
+client = LazyClient(lambda: registry.get("mongo"))
+db = LazyClient(lambda: registry.get("mongo").get_database("antiscamdb"))
+
+
+def ping(timeout=None):
+    """Fails after `timeout` seconds, server selection included."""
+    import pymongo
+
+    with pymongo.timeout(timeout):
+        client.admin.command('ping')
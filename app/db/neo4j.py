@@ -1,13 +1,30 @@
-from neo4j import GraphDatabase
 from app.utils.config import Config
+from .registry import registry, LazyClient
 
-try:
-    neo4j_driver = GraphDatabase.driver(
+
+def _create_driver():
+    from neo4j import GraphDatabase
+
+    driver = GraphDatabase.driver(
         Config.NEO4J_URI,
-        auth=(Config.NEO4J_USERNAME, Config.NEO4J_PASSWORD)
+        auth=(Config.NEO4J_USERNAME, Config.NEO4J_PASSWORD),
+        max_connection_pool_size=Config.NEO4J_MAX_POOL_SIZE,
+        connection_timeout=Config.DB_CONNECT_TIMEOUT,
     )
+    if Config.METRICS_ENABLED or Config.TRACING_ENABLED:
+        from .instrumentation import InstrumentedDriver
+
+        driver = InstrumentedDriver(driver)
+    return driver
+
+registry.register("neo4j", _create_driver)
+
+neo4j_driver = LazyClient(lambda: registry.get("neo4j"))
+
+
+def ping(timeout=None):
+    """Runs a query aborted by the server after `timeout` seconds."""
+    from neo4j import Query
+
     with neo4j_driver.session() as session:
-        session.run("RETURN 1")
-    print("Neo4j connection established.")
-except Exception as e:
-    print("Neo4j connection failed:", e)
\ No newline at end of file
+        session.run(Query("RETURN 1", timeout=timeout)).consume()
@@ -1,10 +1,48 @@
 # app/db/redis.py
-import redis
 from app.utils.config import Config
+from .registry import registry, LazyClient
 
-try:
-    redis_client = redis.from_url(Config.REDIS_URI)
-    redis_client.ping()
-    print("Redis connection established.")
-except redis.RedisError as e:
-    print("Redis connection failed:", e)
\ No newline at end of file
+
+def _create_client():
+    import redis
+
+    # threads wait for a free connection instead of failing when the pool is exhausted
+    pool = redis.BlockingConnectionPool.from_url(
+        Config.REDIS_URI,
+        max_connections=Config.REDIS_MAX_CONNECTIONS,
+        timeout=Config.REDIS_POOL_TIMEOUT,
+        socket_connect_timeout=Config.DB_CONNECT_TIMEOUT,
+    )
+    client = redis.Redis(connection_pool=pool)
+    if Config.METRICS_ENABLED or Config.TRACING_ENABLED:
+        from .instrumentation import instrument_redis
+
+        client = instrument_redis(client)
+    return client
+
+registry.register("redis", _create_client)
+
+redis_client = LazyClient(lambda: registry.get("redis"))
+
+
+def ping(timeout=None):
+    """
+    PING on a pooled connection, failing after `timeout` seconds without an
+    answer: the connections have no socket timeout, the stream reads block.
+    """
+    if timeout is None:
+        redis_client.ping()
+        return
+    pool = redis_client.connection_pool
+    connection = pool.get_connection("PING")
+    try:
+        connection.send_command("PING")
+        if not connection.can_read(timeout=timeout):
+            raise TimeoutError(f"no answer to PING within {timeout}s")
+        connection.read_response()
+    except BaseException:
+        # a late answer must not be read by the next command of the connection
+        connection.disconnect()
+        raise
+    finally:
+        pool.release(connection)
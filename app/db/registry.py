@@ -0,0 +1,76 @@
+import logging
+import os
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionRegistry:
+    """
+    Per-process database clients, created on first use.
+
+    Nothing connects at import time, and the clients created before a fork
+    (e.g. by a preloading master process) are dropped in the child, which
+    creates its own on first use: pymongo, redis-py and neo4j clients hold
+    sockets and background threads that must not be shared across processes.
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._closers = {}
+        self._clients = {}
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def register(self, name, factory, closer=None):
+        self._factories[name] = factory
+        self._closers[name] = closer or (lambda client: client.close())
+
+    def get(self, name):
+        if self._pid != os.getpid():
+            self.reset()
+        client = self._clients.get(name)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(name)
+                if client is None:
+                    client = self._factories[name]()
+                    self._clients[name] = client
+                    logger.info("%s client created (pid %d)", name, os.getpid())
+        return client
+
+    def reset(self):
+        """Forgets the clients inherited from the parent process, without closing them."""
+        self._clients = {}
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def close(self):
+        """Closes the clients of this process, e.g. on worker shutdown."""
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for name, client in clients.items():
+            try:
+                self._closers[name](client)
+            except Exception as e:
+                logger.warning("Failed to close %s client: %s", name, e)
+
+
+class LazyClient:
+    """Stands for the client returned by `resolve`, looked up on each access."""
+
+    def __init__(self, resolve):
+        self._resolve = resolve
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __getitem__(self, key):
+        return self._resolve()[key]
+
+
+registry = ConnectionRegistry()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=registry.reset)
@@ -0,0 +1,26 @@
+"""
+In-process stand-ins of the databases, selected with DB_BACKEND=memory.
+
+They implement the interfaces of the MongoDB models and MongoService, of
+RedisTrustScoreModel and RedisTrustWindowModel (RedisTrustScoreService runs
+unchanged on top), and of the Neo4j user model and Neo4jService, so that the
+routes and services run without any database, e.g. to measure their CPU
+cost in isolation (benchmarks/bench_offline.py). The routes and services
+get them instead of the real classes from app/db/backend.py.
+
+Nothing is persisted and each process has its own data. The scoring streams
+(SCORING_MODE=stream) and the maintenance commands still need the databases.
+"""
+
+
+def reset():
+    """Drops all the in-memory data, e.g. between two benchmark runs."""
+    from app.models.mongo_model import reset_id_allocators
+    from .mongo import collections
+    from .neo4j import store
+    from .redis import keyspace
+
+    collections.clear()
+    store.clear()
+    keyspace.clear()
+    reset_id_allocators()
@@ -0,0 +1,275 @@
+"""
+In-memory stand-ins of the MongoDB models (DB_BACKEND=memory).
+
+The documents live in dicts of the process, indexed by the keys the models
+and MongoService read them by. Reads return copies, as the driver returns
+freshly decoded documents, and go through the request identity map like the
+real models. Writes check the unique keys the MongoDB indexes enforce.
+"""
+from enum import Enum
+from app.models.identity_map import cached_load, invalidate
+from app.models.mongo_model import MongoUserModel, User, Transaction, DeviceLog
+import threading
+
+
+class MemoryCollections:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.users = {}  # user_id -> document
+        self.user_emails = {}  # email -> user_id
+        self.transactions = {}  # transaction_id -> document
+        self.sent = {}  # sender user_id -> [transaction_id]
+        self.received = {}  # recipient user_id -> [transaction_id]
+        self.device_logs = {}  # device_id -> [document]
+        self.device_users = {}  # device_id -> {user_id}
+        self.user_devices = {}  # user_id -> {device_id}
+        self.monthly_spend = {}  # user_id -> {(year, month): document}
+        self.counters = {}  # counter name -> last id
+        self.import_keys = {}  # (collection, import_key) -> transaction_id of the transactions
+
+    def clear(self):
+        with self.lock:
+            self.__init__()
+
+
+collections = MemoryCollections()
+
+
+def _duplicate_key_error(message: str):
+    from pymongo.errors import DuplicateKeyError
+
+    return DuplicateKeyError(message, 11000)
+
+
+def _encode(value):
+    """The document as stored by the driver: enums as their values, nested documents copied."""
+    if isinstance(value, dict):
+        return {key: _encode(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    if isinstance(value, Enum):
+        return value.value
+    return value
+
+
+def copy_document(doc: dict, exclude=()) -> dict:
+    return {key: _encode(value) for key, value in doc.items() if key not in exclude}
+
+
+def reserve_range(name: str, count: int) -> range:
+    with collections.lock:
+        seq = collections.counters.get(name, 0) + count
+        collections.counters[name] = seq
+    return range(seq - count + 1, seq + 1)
+
+
+def get_next_id(name: str) -> str:
+    return str(reserve_range(name, 1)[0]).zfill(3)
+
+
+class MemoryCounterModel:
+    @staticmethod
+    def reserve_range(name: str, count: int) -> range:
+        return reserve_range(name, count)
+
+    @staticmethod
+    def advance(name: str, seq: int):
+        with collections.lock:
+            collections.counters[name] = max(collections.counters.get(name, 0), seq)
+
+
+class MemoryUserModel:
+    PROJECTION = MongoUserModel.PROJECTION
+    KEYS = MongoUserModel.KEYS
+    NAME = "users"
+
+    @staticmethod
+    def _insert(doc: dict) -> bool:
+        with collections.lock:
+            if doc["user_id"] in collections.users or doc["email"] in collections.user_emails:
+                return False
+            collections.users[doc["user_id"]] = doc
+            collections.user_emails[doc["email"]] = doc["user_id"]
+            return True
+
+    def create(self, user: User):
+        if not user.user_id:
+            user.user_id = get_next_id("user_id")
+        if not self._insert(copy_document(user.dict())):
+            raise _duplicate_key_error(f"Duplicate user {user.user_id} / {user.email}")
+        return user
+
+    def create_many(self, users: list[User]):
+        """Inserts a batch of users, duplicates skipped as by insert_many."""
+        for user in users:
+            if not user.user_id:
+                user.user_id = get_next_id("user_id")
+        return [user for user in users if self._insert(copy_document(user.dict()))]
+
+    @staticmethod
+    def _find(user_id, exclude=tuple(PROJECTION)):
+        with collections.lock:
+            doc = collections.users.get(user_id)
+            return copy_document(doc, exclude) if doc is not None else None
+
+    def read(self, user_id: str):
+        return cached_load(self.NAME, "user_id", user_id, self.KEYS, lambda: self._find(user_id))
+
+    def read_by_email(self, email: str):
+        return cached_load(self.NAME, "email", email, self.KEYS,
+                           lambda: self._find(collections.user_emails.get(email)))
+
+    def read_credentials(self, email: str):
+        return self._find(collections.user_emails.get(email), exclude=())
+
+    def invalidate(self, user_id: str):
+        invalidate(self.NAME, "user_id", user_id)
+
+    def update(self, user_id: str, user: User):
+        with collections.lock:
+            doc = collections.users.get(user_id)
+            if doc is not None:
+                doc.update(copy_document(user.dict(exclude_unset=True)))
+                doc = copy_document(doc)
+        self.invalidate(user_id)
+        return doc
+
+    def append_deductions(self, user_id: str, rules: list[str]):
+        with collections.lock:
+            doc = collections.users.get(user_id)
+            if doc is not None:
+                applied = doc.get("score_deductions_applied")
+                if not isinstance(applied, list):
+                    applied = doc["score_deductions_applied"] = []
+                applied += [rule for rule in dict.fromkeys(rules) if rule not in applied]
+        self.invalidate(user_id)
+
+
+class MemoryTransactionModel:
+    NAME = "transactions"
+
+    @staticmethod
+    def _insert(doc: dict) -> bool:
+        with collections.lock:
+            if doc["transaction_id"] in collections.transactions:
+                return False
+            if "import_key" in doc:
+                if (MemoryTransactionModel.NAME, doc["import_key"]) in collections.import_keys:
+                    return False
+                collections.import_keys[(MemoryTransactionModel.NAME, doc["import_key"])] = doc["transaction_id"]
+            collections.transactions[doc["transaction_id"]] = doc
+            collections.sent.setdefault(doc["sender"]["user_id"], []).append(doc["transaction_id"])
+            collections.received.setdefault(doc["recipient"]["user_id"], []).append(doc["transaction_id"])
+            return True
+
+    def create(self, txn: Transaction):
+        if not txn.transaction_id:
+            txn.transaction_id = get_next_id("transaction_id")
+        if not self._insert(copy_document(txn.dict())):
+            raise _duplicate_key_error(f"Duplicate transaction {txn.transaction_id}")
+        return txn
+
+    def create_many(self, txns: list[Transaction]):
+        """Inserts a batch of transactions, duplicates skipped as by insert_many."""
+        for txn in txns:
+            if not txn.transaction_id:
+                txn.transaction_id = get_next_id("transaction_id")
+        return [txn for txn in txns if self._insert(copy_document(txn.dict()))]
+
+    def ids_by_import_key(self, import_keys: list[str]) -> dict:
+        with collections.lock:
+            return {
+                key: collections.import_keys[(self.NAME, key)]
+                for key in import_keys
+                if (self.NAME, key) in collections.import_keys
+            }
+
+    @staticmethod
+    def _find(transaction_id):
+        with collections.lock:
+            doc = collections.transactions.get(transaction_id)
+            return copy_document(doc) if doc is not None else None
+
+    def read(self, transaction_id: str):
+        return cached_load(self.NAME, "transaction_id", transaction_id, ("transaction_id",),
+                           lambda: self._find(transaction_id))
+
+    def invalidate(self, transaction_id: str):
+        invalidate(self.NAME, "transaction_id", transaction_id)
+
+
+class MemoryDeviceLogModel:
+    def __init__(self):
+        self.device_users_model = MemoryDeviceUsersModel()
+
+    def create(self, device_log: DeviceLog):
+        device_log_dict = copy_document(device_log.dict())
+        mac = device_log_dict.get("mac_address")
+        if mac:
+            device_log_dict["device_id"] = mac.upper().replace(":", "")
+        with collections.lock:
+            collections.device_logs.setdefault(device_log_dict["device_id"], []).append(device_log_dict)
+        if device_log_dict.get("device_id"):
+            self.device_users_model.add_user(device_log_dict["device_id"], device_log_dict["user_id"])
+        return device_log_dict
+
+    def create_many(self, device_logs: list[DeviceLog]):
+        """Inserts a batch of device logs, replayed imported logs skipped as by insert_many."""
+        inserted = []
+        for device_log in device_logs:
+            import_key = getattr(device_log, "import_key", None)
+            if import_key is not None:
+                with collections.lock:
+                    if ("device_logs", import_key) in collections.import_keys:
+                        continue
+                    collections.import_keys[("device_logs", import_key)] = None
+            self.create(device_log)
+            inserted.append(device_log)
+        return inserted
+
+    def read(self, device_id: str):
+        device_id = device_id.upper().replace(":", "")
+        with collections.lock:
+            logs = collections.device_logs.get(device_id)
+            return copy_document(logs[0]) if logs else None
+
+
+class MemoryDeviceUsersModel:
+    def add_user(self, device_id: str, user_id: str):
+        with collections.lock:
+            collections.device_users.setdefault(device_id, set()).add(user_id)
+            collections.user_devices.setdefault(user_id, set()).add(device_id)
+
+    def add_users(self, pairs):
+        for device_id, user_id in pairs:
+            self.add_user(device_id, user_id)
+
+    def count_devices(self, user_id: str) -> int:
+        with collections.lock:
+            return len(collections.user_devices.get(user_id, ()))
+
+    def has_shared_device(self, user_id: str, max_users: int) -> bool:
+        with collections.lock:
+            return any(
+                len(collections.device_users[device_id]) > max_users
+                for device_id in collections.user_devices.get(user_id, ())
+            )
+
+
+class MemoryMonthlySpendModel:
+    def increment(self, user_id: str, year: int, month: int, amount: float, count: int = 1):
+        with collections.lock:
+            doc = collections.monthly_spend.setdefault(user_id, {}).setdefault(
+                (year, month),
+                {"user_id": user_id, "year": year, "month": month, "total_spent": 0, "txn_count": 0},
+            )
+            doc["total_spent"] += amount
+            doc["txn_count"] += count
+
+    def increment_many(self, totals):
+        for (user_id, year, month), (amount, count) in totals.items():
+            self.increment(user_id, year, month, amount, count)
+
+    def read_by_user(self, user_id: str):
+        with collections.lock:
+            return [dict(doc) for doc in collections.monthly_spend.get(user_id, {}).values()]
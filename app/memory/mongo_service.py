@@ -0,0 +1,196 @@
+"""
+In-memory stand-in of MongoService (DB_BACKEND=memory): the aggregation
+pipelines and the updates of MongoService computed over the collections of
+app/memory/mongo.
+"""
+from datetime import datetime
+from app.models.mongo_model import TransactionStatus
+from app.services.mongo_service import MongoService
+from .mongo import (
+    MemoryDeviceLogModel,
+    MemoryDeviceUsersModel,
+    MemoryMonthlySpendModel,
+    MemoryTransactionModel,
+    MemoryUserModel,
+    collections,
+    copy_document,
+)
+
+
+class MemoryMongoService(MongoService):
+    def __init__(self):
+        self.user_model = MemoryUserModel()
+        self.transaction_model = MemoryTransactionModel()
+        self.device_log_model = MemoryDeviceLogModel()
+        self.monthly_spend_model = MemoryMonthlySpendModel()
+        self.device_users_model = MemoryDeviceUsersModel()
+
+    # User
+    def get_users_by_device(self, device_id):
+        with collections.lock:
+            return list({log["user_id"] for log in collections.device_logs.get(device_id, ())})
+
+    def get_detection_features(self, user_id):
+        features = {
+            "user_id": user_id,
+            "new_user": None,
+            "monthly_spending": {},
+            "txn_count": 0,
+            "devices": {},
+        }
+        with collections.lock:
+            user = collections.users.get(user_id)
+            if user is None:
+                return features
+            features["new_user"] = user.get("new_user", True)
+            features["monthly_spending"] = {
+                month: doc["total_spent"]
+                for month, doc in collections.monthly_spend.get(user_id, {}).items()
+                if doc["txn_count"] > 0
+            }
+            features["txn_count"] = min(3, len(collections.sent.get(user_id, ())))
+            features["devices"] = {
+                device_id: len(collections.device_users[device_id])
+                for device_id in collections.user_devices.get(user_id, ())
+            }
+        return features
+
+    def mark_user_not_new(self, user_id):
+        with collections.lock:
+            user = collections.users.get(user_id)
+            modified = user is not None and user.get("new_user") is not False
+            if modified:
+                user["new_user"] = False
+        self.user_model.invalidate(user_id)
+        return modified
+
+    def get_scores(self, user_ids=(), emails=()):
+        with collections.lock:
+            found = dict.fromkeys(list(user_ids) + [collections.user_emails.get(email) for email in emails])
+            return [
+                {"user_id": user["user_id"], "email": user["email"], "score": user["score"]}
+                for user in (collections.users.get(user_id) for user_id in found if user_id)
+                if user is not None
+            ]
+
+    def update_score(self, user_id, score=100):
+        with collections.lock:
+            user = collections.users.get(user_id)
+            if user is not None:
+                user["score"] = score
+                user = copy_document(user, tuple(self.user_model.PROJECTION))
+        self.user_model.invalidate(user_id)
+        return user
+
+    def update_scores(self, scores: dict):
+        matched = 0
+        with collections.lock:
+            for user_id, score in scores.items():
+                user = collections.users.get(user_id)
+                if user is not None:
+                    user["score"] = score
+                    matched += 1
+        for user_id in scores:
+            self.user_model.invalidate(user_id)
+        return matched
+
+    # Transactions
+    def _transactions(self, transaction_ids):
+        with collections.lock:
+            return [copy_document(collections.transactions[txn_id]) for txn_id in transaction_ids]
+
+    def get_transactions_by_sender(self, user_id):
+        return self._transactions(collections.sent.get(user_id, ()))
+
+    def get_transactions_by_recipient(self, user_id):
+        return self._transactions(collections.received.get(user_id, ()))
+
+    def verify_transaction(self, transaction_id):
+        with collections.lock:
+            txn = collections.transactions.get(transaction_id)
+            verified = txn is not None and txn["status"] != TransactionStatus.VERIFIED.value
+            if verified:
+                txn["status"] = TransactionStatus.VERIFIED.value
+                timestamp = txn["timestamp"]
+                self.monthly_spend_model.increment(
+                    txn["sender"]["user_id"], timestamp.year, timestamp.month, txn["amount"]
+                )
+        self.transaction_model.invalidate(transaction_id)
+        return verified
+
+    def flag_transaction(self, transaction_id, reason):
+        with collections.lock:
+            txn = collections.transactions.get(transaction_id)
+            if txn is None or txn["status"] == TransactionStatus.SUSPICIOUS.value:
+                previous = None
+            else:
+                previous = txn["status"]
+                txn["status"] = TransactionStatus.SUSPICIOUS.value
+                txn["flag_reason"] = reason
+                if previous == TransactionStatus.VERIFIED.value:
+                    timestamp = txn["timestamp"]
+                    self.monthly_spend_model.increment(
+                        txn["sender"]["user_id"], timestamp.year, timestamp.month, -txn["amount"], count=-1
+                    )
+        self.transaction_model.invalidate(transaction_id)
+        return previous
+
+    def reconcile_monthly_spend(self, older_than_seconds=60):
+        return 0  # the status and the rollup change under the same lock
+
+    def set_transaction_checks(self, transaction_id, checks, rules=None):
+        with collections.lock:
+            txn = collections.transactions.get(transaction_id)
+            if txn is not None:
+                txn["checks"] = checks
+                if rules is not None:
+                    txn["checks_rules"] = sorted(rules)
+        self.transaction_model.invalidate(transaction_id)
+
+    def rebuild_monthly_spend(self, user_id=None):
+        with collections.lock:
+            if user_id:
+                collections.monthly_spend.pop(user_id, None)
+            else:
+                collections.monthly_spend.clear()
+            for txn in collections.transactions.values():
+                sender_id = txn["sender"]["user_id"]
+                if txn["status"] == TransactionStatus.VERIFIED.value and user_id in (None, sender_id):
+                    timestamp = txn["timestamp"]
+                    self.monthly_spend_model.increment(sender_id, timestamp.year, timestamp.month, txn["amount"])
+            if user_id:
+                return len(collections.monthly_spend.get(user_id, ()))
+            return sum(len(months) for months in collections.monthly_spend.values())
+
+    def get_verified_spending_by_day(self, user_id, since, thresholds=()):
+        days = {}
+        with collections.lock:
+            for txn_id in collections.sent.get(user_id, ()):
+                txn = collections.transactions[txn_id]
+                if txn["status"] != TransactionStatus.VERIFIED.value or txn["timestamp"] < since:
+                    continue
+                day = days.setdefault(datetime.strftime(txn["timestamp"], "%Y-%m-%d"), {
+                    "amount": 0, "count": 0, "high": dict.fromkeys(thresholds, 0)
+                })
+                day["amount"] += txn["amount"]
+                day["count"] += 1
+                for threshold in thresholds:
+                    if txn["amount"] >= threshold:
+                        day["high"][threshold] += 1
+        return [dict(totals, day=day) for day, totals in days.items()]
+
+    # Device Logs
+    def get_devices_by_user(self, user_id):
+        with collections.lock:
+            return list(collections.user_devices.get(user_id, ()))
+
+    def rebuild_device_users(self):
+        with collections.lock:
+            collections.device_users.clear()
+            collections.user_devices.clear()
+            for device_id, logs in collections.device_logs.items():
+                if device_id is None:
+                    continue
+                for log in logs:
+                    self.device_users_model.add_user(device_id, log["user_id"])
+            return len(collections.device_users)
@@ -0,0 +1,57 @@
+"""
+In-memory stand-in of the Neo4j user model (DB_BACKEND=memory): the nodes
+live in dicts of the process and the User -[:MADE]-> Transaction -[:TO]->
+User edges in a TransactionGraph, see app/memory/neo4j_service.
+"""
+from app.models.neo4j_model import UserSchema
+from app.utils.config import Config
+import threading
+
+
+class MemoryGraphStore:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.users = {}  # user_id -> properties
+        self.node_ids = {}  # user_id -> node id
+        self.transactions = {}  # transaction_id -> properties
+        self.devices = {}  # user_id -> {device_id}
+        self._graph = None
+
+    @property
+    def graph(self):
+        """The edges, allocated on first use (GRAPH_MAX_EDGES slots)."""
+        with self.lock:
+            if self._graph is None:
+                from app.services.transaction_graph import TransactionGraph
+
+                self._graph = TransactionGraph(Config.GRAPH_MAX_EDGES)
+                self._graph.ready = True
+            return self._graph
+
+    def clear(self):
+        with self.lock:
+            self.__init__()
+
+
+store = MemoryGraphStore()
+
+
+class MemoryNeo4jUserModel:
+    def create(self, user: UserSchema):
+        with store.lock:
+            if user.user_id not in store.users:  # MERGE
+                store.users[user.user_id] = user.dict()
+                store.node_ids[user.user_id] = len(store.node_ids)
+                store.graph.add_user(user.user_id, user.score)
+            return store.node_ids[user.user_id]
+
+    def create_many(self, users: list[UserSchema]):
+        for user in users:
+            self.create(user)
+        return len(users)
+
+    def read(self, user_id=None):
+        with store.lock:
+            if user_id:
+                return store.users.get(user_id)
+            return list(store.users.values())
@@ -0,0 +1,72 @@
+"""
+In-memory stand-in of Neo4jService (DB_BACKEND=memory), over the nodes of
+app/memory/neo4j. The graph detectors are answered by its TransactionGraph,
+as with GRAPH_ENGINE=true.
+"""
+from app.services.neo4j_service import Neo4jService
+from .neo4j import store
+
+
+class MemoryNeo4jService(Neo4jService):
+    driver = None
+
+    @staticmethod
+    def setup_constraints():
+        pass
+
+    def connect_user_transaction_user(self, tx_data):
+        with store.lock:
+            txn = store.transactions.get(tx_data["transaction_id"])
+            if txn is None:
+                return None
+            return self._record(txn, tx_data["sender_id"], tx_data["receiver_id"])
+
+    def record_transactions(self, rows):
+        records = []
+        with store.lock:
+            for row in rows:
+                txn = store.transactions.setdefault(row["transaction_id"], {
+                    "transaction_id": row["transaction_id"],
+                    "amount": row["amount"],
+                    "timestamp": row["timestamp"],
+                    "status": row["status"],
+                })
+                record = self._record(txn, row["sender_id"], row["receiver_id"])
+                if record is not None:
+                    records.append(record)
+        return records
+
+    @staticmethod
+    def _record(txn, sender_id, receiver_id):
+        sender, receiver = store.users.get(sender_id), store.users.get(receiver_id)
+        if sender is None or receiver is None:
+            return None
+        txn.setdefault("sender_id", sender_id)
+        store.graph.add_transaction(sender_id, receiver_id, txn["transaction_id"], txn["timestamp"], txn["amount"])
+        return {"sender": sender, "txn": txn, "receiver": receiver}
+
+    def connect_user_device(self, tx_data):
+        with store.lock:
+            user = store.users.get(tx_data["user_id"])
+            if user is None:
+                return None
+            store.devices.setdefault(tx_data["user_id"], set()).add(tx_data["device_id"])
+            return {"user": user, "device": {"device_id": tx_data["device_id"]}}
+
+    def get_user_transactions_connections(self, tx_data):
+        with store.lock:
+            return [txn for txn in store.transactions.values() if txn.get("sender_id") == tx_data["user_id"]]
+
+    def get_user_user_connections(self, tx_data, timeout=None):
+        return store.graph.get_user_user_connections(tx_data["user_id"])
+
+    def get_user_device_connections(self, tx_data):
+        with store.lock:
+            devices = [{"device_id": device_id} for device_id in store.devices.get(tx_data["user_id"], ())]
+        return [{"devices": devices, "total_devices": len(devices)}]
+
+    def detect_circular_transaction(self, tx_data, timeout=None):
+        try:
+            return store.graph.detect_circular_transaction(tx_data)
+        except KeyError:
+            return None  # unknown transaction, or dropped from the graph
@@ -0,0 +1,328 @@
+"""
+In-memory stand-ins of the Redis models (DB_BACKEND=memory).
+
+Keys live in a dict of the process with their expiry, and the Lua scripts
+of app/models/redis_model are ported to Python, each running under the
+lock of the keyspace as the script runs atomically in Redis. Values are
+returned as str where Redis returns bytes. The scoring streams have no
+stand-in: SCORING_MODE=stream and DEFERRED_BACKEND=stream need Redis.
+"""
+from typing import Optional
+import re
+import threading
+import time
+import uuid
+
+
+class MemoryKeyspace:
+    """Keys of the process: strings, hashes (dicts) and sets, with their expiry."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._values = {}
+        self._expires = {}
+
+    def clear(self):
+        with self.lock:
+            self._values.clear()
+            self._expires.clear()
+
+    def value(self, key):
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self.delete(key)
+        return self._values.get(key)
+
+    def set(self, key, value, ttl_ms: Optional[int] = None):
+        self._values[key] = value
+        if ttl_ms is None:
+            self._expires.pop(key, None)
+        else:
+            self._expires[key] = time.monotonic() + int(ttl_ms) / 1000
+        return True
+
+    def expire(self, key, ttl_ms: int) -> bool:
+        if self.value(key) is None:
+            return False
+        self._expires[key] = time.monotonic() + int(ttl_ms) / 1000
+        return True
+
+    def pttl(self, key) -> int:
+        if self.value(key) is None:
+            return -2
+        expires = self._expires.get(key)
+        if expires is None:
+            return -1
+        return max(0, int((expires - time.monotonic()) * 1000))
+
+    def incr(self, key) -> int:
+        """INCR, keeping the expiry of an existing key."""
+        value = int(self.value(key) or 0) + 1
+        self._values[key] = str(value)
+        return value
+
+    def delete(self, *keys) -> int:
+        deleted = 0
+        for key in keys:
+            self._expires.pop(key, None)
+            if self._values.pop(key, None) is not None:
+                deleted += 1
+        return deleted
+
+    def hash(self, key) -> dict:
+        """The hash of `key`, created (without expiry) if missing."""
+        fields = self.value(key)
+        if fields is None:
+            fields = self._values[key] = {}
+        return fields
+
+
+keyspace = MemoryKeyspace()
+
+
+def _str(value) -> str:
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+class MemoryLock:
+    """Stand-in of the redis-py lock: a key holding a random token."""
+
+    def __init__(self, name: str, timeout: float):
+        self.name = name
+        self.timeout = timeout
+        self.token = uuid.uuid4().hex
+
+    def acquire(self, blocking: bool = True) -> bool:
+        while True:
+            with keyspace.lock:
+                if keyspace.value(self.name) is None:
+                    return keyspace.set(self.name, self.token, self.timeout * 1000)
+            if not blocking:
+                return False
+            time.sleep(0.01)
+
+    def release(self):
+        with keyspace.lock:
+            if keyspace.value(self.name) == self.token:
+                keyspace.delete(self.name)
+
+
+class MemoryTrustScoreModel:
+    """Stand-in of RedisTrustScoreModel."""
+
+    @staticmethod
+    def get(key: str) -> Optional[str]:
+        with keyspace.lock:
+            return keyspace.value(key)
+
+    @staticmethod
+    def get_many(keys: list) -> list:
+        with keyspace.lock:
+            return [keyspace.value(key) for key in keys]
+
+    @staticmethod
+    def set(key: str, value: str, expire_seconds: int = 3600) -> bool:
+        with keyspace.lock:
+            return keyspace.set(key, _str(value), expire_seconds * 1000)
+
+    @staticmethod
+    def set_if_missing(key: str, value: str, expire_seconds: int = 3600) -> bool:
+        with keyspace.lock:
+            if keyspace.value(key) is not None:
+                return False
+            return keyspace.set(key, _str(value), expire_seconds * 1000)
+
+    @staticmethod
+    def exists(key: str) -> bool:
+        with keyspace.lock:
+            return keyspace.value(key) is not None
+
+    @staticmethod
+    def delete(key: str) -> bool:
+        with keyspace.lock:
+            return keyspace.delete(key) == 1
+
+    @staticmethod
+    def read(key: str, reads_key: str, window_ms: int) -> tuple:
+        # READ_SCRIPT
+        with keyspace.lock:
+            score, ttl = keyspace.value(key), keyspace.pttl(key)
+            reads = keyspace.incr(reads_key)
+            if reads == 1:
+                keyspace.expire(reads_key, window_ms)
+            return score, ttl, reads
+
+    @staticmethod
+    def refresh(key: str, read_value: str, read_ttl_ms: int, value: str, expire_ms: int) -> bool:
+        # REFRESH_SCRIPT
+        with keyspace.lock:
+            score = keyspace.value(key)
+            if score is not None:
+                if score != _str(read_value) or keyspace.pttl(key) > int(read_ttl_ms):
+                    return False
+            return keyspace.set(key, _str(value), expire_ms)
+
+    @staticmethod
+    def lock(key: str, timeout: float):
+        return MemoryLock(key, timeout)
+
+    @staticmethod
+    def deduct(score_key: str, rules_key: str, args: list, dirty_key: Optional[str] = None):
+        # DEDUCT_SCRIPT
+        with keyspace.lock:
+            score, rules = keyspace.value(score_key), keyspace.value(rules_key)
+            if score is None or rules is None:
+                return None, []
+            operation = _str(args[1])
+            if operation:
+                if f"op:{operation}" in rules:
+                    return int(score), []
+                rules.add(f"op:{operation}")
+            score = previous = int(score)
+            applied = []
+            for i in range(2, len(args), 3):
+                rule, delta = _str(args[i]), int(args[i + 1])
+                if _str(args[i + 2]) == "1":
+                    score += delta
+                elif score > 0 and rule not in rules:
+                    rules.add(rule)
+                    score += delta
+                    applied.append(rule)
+            keyspace.expire(rules_key, int(args[0]) * 1000)
+            if score != previous:
+                score_ttl = keyspace.pttl(score_key)
+                keyspace.set(score_key, str(score), score_ttl if score_ttl > 0 else None)
+                if dirty_key:
+                    keyspace.hash(dirty_key)[score_key] = str(score)
+            return score, applied
+
+    @staticmethod
+    def load_rules(rules_key: str, rules: list, expire_seconds: int) -> bool:
+        # LOAD_RULES_SCRIPT
+        with keyspace.lock:
+            if keyspace.value(rules_key) is not None:
+                return False
+            return keyspace.set(rules_key, {_str(rule) for rule in rules} | {"loaded"}, expire_seconds * 1000)
+
+    @staticmethod
+    def get_dirty(dirty_key: str, limit: int) -> dict:
+        with keyspace.lock:
+            fields = keyspace.value(dirty_key) or {}
+            return {user_id: int(score) for user_id, score in list(fields.items())[:limit]}
+
+    @staticmethod
+    def get_dirty_one(dirty_key: str, user_id: str) -> Optional[int]:
+        with keyspace.lock:
+            score = (keyspace.value(dirty_key) or {}).get(user_id)
+            return int(score) if score is not None else None
+
+    @staticmethod
+    def clear_dirty(dirty_key: str, scores: dict) -> int:
+        # CLEAR_DIRTY_SCRIPT
+        with keyspace.lock:
+            fields = keyspace.value(dirty_key) or {}
+            cleared = 0
+            for user_id, score in scores.items():
+                if fields.get(user_id) == str(score):
+                    del fields[user_id]
+                    cleared += 1
+            if not fields:
+                keyspace.delete(dirty_key)
+            return cleared
+
+    @staticmethod
+    def set_many(values: dict, expire_seconds: int = 3600):
+        with keyspace.lock:
+            return [
+                keyspace.value(key) is None and keyspace.set(key, _str(value), expire_seconds * 1000)
+                for key, value in values.items()
+            ]
+
+
+# window fields `<kind>:<day>`
+_DAY_FIELD = re.compile(r"^([^:]+):(\d+)$")
+
+
+class MemoryTrustWindowModel:
+    """Stand-in of RedisTrustWindowModel."""
+
+    @staticmethod
+    def reserve(key: str, args: list) -> tuple:
+        # RESERVE_SCRIPT
+        with keyspace.lock:
+            fields = keyspace.value(key)
+            if fields is None:
+                return -1, 0.0
+            window_start, month_start, day = int(args[0]), int(args[1]), int(args[2])
+            amount = float(args[3])
+            high_field = _str(args[7])
+
+            total, month_count, month_high = 0.0, 0.0, 0.0
+            for field in list(fields):
+                match = _DAY_FIELD.match(field)
+                if not match:
+                    continue
+                kind, d = match.group(1), int(match.group(2))
+                if d < window_start:
+                    del fields[field]
+                    continue
+                value = float(fields[field])
+                if kind == "a":
+                    total += value
+                elif d >= month_start and kind == "c":
+                    month_count += value
+                elif d >= month_start and kind == high_field:
+                    month_high += value
+
+            total_limit = float(args[5])
+            if total_limit >= 0 and total + amount > total_limit:
+                return 1, total
+            max_high = float(args[6])
+            if max_high >= 0 and month_high >= max_high:
+                return 2, month_high
+            max_month = float(args[8])
+            if max_month >= 0:
+                if month_count >= max_month:
+                    return 3, month_count
+                max_amount = float(args[9])
+                if max_amount >= 0 and amount > max_amount:
+                    return 4, amount
+
+            if day >= window_start:
+                fields[f"a:{day}"] = float(fields.get(f"a:{day}", 0)) + amount
+                fields[f"c:{day}"] = int(fields.get(f"c:{day}", 0)) + 1
+                for i in range(10, len(args), 2):
+                    if amount >= float(args[i + 1]):
+                        field = f"{_str(args[i])}:{day}"
+                        fields[field] = int(fields.get(field, 0)) + 1
+            keyspace.expire(key, int(args[4]) * 1000)
+            return 0, 0.0
+
+    @staticmethod
+    def release(key: str, args: list) -> bool:
+        # RELEASE_SCRIPT
+        with keyspace.lock:
+            fields = keyspace.value(key)
+            if fields is None:
+                return False
+            day, amount = args[0], float(args[1])
+            fields[f"a:{day}"] = float(fields.get(f"a:{day}", 0)) - amount
+            fields[f"c:{day}"] = int(fields.get(f"c:{day}", 0)) - 1
+            for i in range(2, len(args), 2):
+                if amount >= float(args[i + 1]):
+                    field = f"{_str(args[i])}:{day}"
+                    fields[field] = int(fields.get(field, 0)) - 1
+            return True
+
+    @staticmethod
+    def delete_many(keys: list) -> int:
+        with keyspace.lock:
+            return keyspace.delete(*keys)
+
+    @staticmethod
+    def load(key: str, fields: dict, expire_seconds: int) -> bool:
+        # LOAD_SCRIPT
+        with keyspace.lock:
+            if keyspace.value(key) is not None:
+                return False
+            return keyspace.set(key, dict(fields, loaded=1), expire_seconds * 1000)
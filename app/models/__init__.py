@@ -1,7 +1,6 @@
 # Export models for easier imports
 from .mongo_model import User, Transaction, DeviceLog
-from .redis_model import RedisTrustScoreModel
-from .neo4j_model import Neo4jUserModel, Neo4jTransactionModel, Neo4jDeviceModel
+from .neo4j_model import Neo4jTransactionModel, Neo4jDeviceModel
 
 __all__ = [
     "User",
@@ -12,3 +11,11 @@ __all__ = [
     "Neo4jTransactionModel",
     "Neo4jDeviceModel",
 ]
+
+
+def __getattr__(name):
+    # the models of the DB_BACKEND, see app/db/backend.py
+    if name in ("RedisTrustScoreModel", "Neo4jUserModel"):
+        from app.db import backend
+        return getattr(backend, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,125 @@
+"""
+Request-scoped identity map of the MongoDB user and transaction documents.
+
+Within a request, repeated reads of the same document by one of its keys
+(user_id or email for users, transaction_id for transactions) return the
+document read first instead of querying MongoDB again. Writes through the
+models invalidate the documents they change. Outside a request (CLI, tests,
+background threads without a copied context) reads go to MongoDB as before.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from app.utils.metrics import IDENTITY_MAP_READS
+import threading
+
+
+class IdentityMap:
+    def __init__(self):
+        # (collection, key field, value) -> document, every key of a
+        # document pointing to the same dict
+        self._docs = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, collection: str, field: str, value):
+        with self._lock:
+            doc = self._docs.get((collection, field, value))
+            if doc is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return doc
+
+    def put(self, collection: str, doc: dict, fields: tuple):
+        with self._lock:
+            for field in fields:
+                if doc.get(field) is not None:
+                    self._docs[(collection, field, doc[field])] = doc
+
+    def invalidate(self, collection: str, field: str, value):
+        """Drops the document under all of its keys."""
+        with self._lock:
+            doc = self._docs.get((collection, field, value))
+            if doc is None:
+                return
+            for key in [key for key, cached in self._docs.items() if cached is doc]:
+                del self._docs[key]
+
+
+_current: ContextVar[Optional[IdentityMap]] = ContextVar("identity_map", default=None)
+
+_totals = {"requests": 0, "hits": 0, "misses": 0}
+_totals_lock = threading.Lock()
+_hit_reads = IDENTITY_MAP_READS.labels("hit")
+_missed_reads = IDENTITY_MAP_READS.labels("miss")
+
+
+def current_identity_map() -> Optional[IdentityMap]:
+    return _current.get()
+
+
+def start_identity_map():
+    """Starts the identity map of a request, returns the token to end it."""
+    return _current.set(IdentityMap())
+
+
+def end_identity_map(token) -> Optional[IdentityMap]:
+    """Ends the identity map started with `token` and returns it."""
+    identity_map = _current.get()
+    _current.reset(token)
+    if identity_map is not None:
+        with _totals_lock:
+            _totals["requests"] += 1
+            _totals["hits"] += identity_map.hits
+            _totals["misses"] += identity_map.misses
+        if identity_map.hits:
+            _hit_reads.inc(identity_map.hits)
+        if identity_map.misses:
+            _missed_reads.inc(identity_map.misses)
+    return identity_map
+
+
+@contextmanager
+def identity_map_scope():
+    token = start_identity_map()
+    try:
+        yield _current.get()
+    finally:
+        end_identity_map(token)
+
+
+def identity_map_stats() -> dict:
+    """Reads served from the identity maps (round trips saved) since the process started."""
+    with _totals_lock:
+        return dict(_totals)
+
+
+def cached_load(collection_name: str, field: str, value, fields: tuple, load):
+    """
+    Document of `collection_name` whose `field` is `value`, from the current
+    identity map if any, otherwise returned by load() and cached under its
+    `fields` keys.
+    """
+    identity_map = _current.get()
+    if identity_map is not None:
+        doc = identity_map.get(collection_name, field, value)
+        if doc is not None:
+            return doc
+    doc = load()
+    if doc is not None and identity_map is not None:
+        identity_map.put(collection_name, doc, fields)
+    return doc
+
+
+def cached_find_one(collection, field: str, value, fields: tuple, projection=None):
+    """find_one({field: value}) through the current identity map, see cached_load."""
+    return cached_load(collection.name, field, value, fields,
+                       lambda: collection.find_one({field: value}, projection))
+
+
+def invalidate(collection_name: str, field: str, value):
+    identity_map = _current.get()
+    if identity_map is not None:
+        identity_map.invalidate(collection_name, field, value)
@@ -0,0 +1,197 @@
+import logging
+from datetime import datetime
+from app.db.mongo import db
+
+
+logger = logging.getLogger(__name__)
+
+ASCENDING = 1  # pymongo.ASCENDING, pymongo is imported on first use
+
+
+# Indexes of every collection (pymongo IndexModel arguments), applied
+# idempotently by ensure_indexes.
+# Unique indexes back the fields the code looks documents up by and assumes
+# to be unique.
+INDEXES = {
+    "users": [
+        dict(keys=[("email", ASCENDING)], name="email_unique", unique=True),
+        dict(keys=[("user_id", ASCENDING)], name="user_id_unique", unique=True),
+    ],
+    "transactions": [
+        dict(keys=[("transaction_id", ASCENDING)], name="transaction_id_unique", unique=True),
+        # equality on sender and status first, range on timestamp last
+        dict(
+            keys=[("sender.user_id", ASCENDING), ("status", ASCENDING), ("timestamp", ASCENDING)],
+            name="sender_status_timestamp",
+        ),
+        dict(keys=[("recipient.user_id", ASCENDING)], name="recipient_user_id"),
+        # only the transactions whose rollup update is in flight
+        dict(keys=[("spend_pending", ASCENDING)], name="spend_pending", sparse=True),
+        # only the imported transactions, a replayed import record is rejected
+        dict(keys=[("import_key", ASCENDING)], name="import_key_unique", unique=True, sparse=True),
+    ],
+    "device_logs": [
+        dict(keys=[("user_id", ASCENDING), ("device_id", ASCENDING)], name="user_id_device_id"),
+        dict(keys=[("device_id", ASCENDING), ("user_id", ASCENDING)], name="device_id_user_id"),
+        dict(keys=[("import_key", ASCENDING)], name="import_key_unique", unique=True, sparse=True),
+    ],
+    "device_users": [
+        # multikey: devices of a user, and the shared ones first
+        dict(keys=[("user_ids", ASCENDING), ("user_count", ASCENDING)], name="user_ids_user_count"),
+    ],
+    "monthly_spend": [
+        dict(
+            keys=[("user_id", ASCENDING), ("year", ASCENDING), ("month", ASCENDING)],
+            name="user_id_year_month_unique",
+            unique=True,
+        ),
+    ],
+}
+
+
+# Filters of the find() service queries, with sample values, that must be
+# answered by an index. The aggregations are checked from their pipelines,
+# see _service_pipelines.
+QUERY_PLANS = [
+    ("users by email", "users", {"email": "user@example.com"}),
+    ("users by user_id", "users", {"user_id": "001"}),
+    ("transactions by transaction_id", "transactions", {"transaction_id": "001"}),
+    ("transactions by sender", "transactions", {"sender.user_id": "001"}),
+    ("transactions by recipient", "transactions", {"recipient.user_id": "001"}),
+    ("trust window rebuild", "transactions", {
+        "sender.user_id": "001",
+        "status": "verified",
+        "timestamp": {"$gte": datetime(2000, 1, 1)},
+    }),
+    ("pending rollup updates", "transactions", {"spend_pending": {"$lte": datetime(2000, 1, 1)}}),
+    ("transactions by import_key", "transactions", {"import_key": {"$in": ["0" * 40]}}),
+    ("device logs by user", "device_logs", {"user_id": "001"}),
+    ("device logs by device", "device_logs", {"device_id": "AABBCCDDEEFF"}),
+    ("devices of a user", "device_users", {"user_ids": "001"}),
+    ("shared devices of a user", "device_users", {"user_ids": "001", "user_count": {"$gt": 5}}),
+    ("monthly spend by user", "monthly_spend", {"user_id": "001"}),
+]
+
+
+def ensure_indexes(collections=None):
+    """
+    Creates the declared indexes of `collections` (all by default). Creating
+    an index that already exists with the same definition is a no-op, so it
+    is safe to run on every startup.
+    """
+    from pymongo import IndexModel
+    from pymongo.errors import OperationFailure
+
+    created = {}
+    for name, indexes in INDEXES.items():
+        if collections and name not in collections:
+            continue
+        try:
+            created[name] = db[name].create_indexes([IndexModel(**index) for index in indexes])
+        except OperationFailure as e:
+            # e.g. duplicates preventing a unique index, or a changed definition
+            logger.error("Failed to create indexes on %s: %s", name, e)
+            raise
+    return created
+
+
+def _plan_stages(plan):
+    stages = [plan["stage"]]
+    children = list(plan.get("inputStages", []))
+    if "inputStage" in plan:
+        children.append(plan["inputStage"])
+    for child in children:
+        stages += _plan_stages(child)
+    return stages
+
+
+def _winning_stages(query_planner) -> list:
+    winning_plan = query_planner["winningPlan"]
+    # MongoDB 7+ nests the plan when the slot based engine is used
+    return _plan_stages(winning_plan.get("queryPlan", winning_plan))
+
+
+def _aggregate_query_planner(explain):
+    """The plan of the documents read by an aggregation, pushed down or in its $cursor stage."""
+    if "queryPlanner" in explain:
+        return explain["queryPlanner"]
+    for stage in explain.get("stages", ()):
+        if "$cursor" in stage:
+            return stage["$cursor"]["queryPlanner"]
+    return None
+
+
+def _lookup_query(lookup: dict, sample: str):
+    """
+    The query a $lookup runs on its foreign collection for each document:
+    equality on foreignField, or on the field compared to a variable in the
+    $expr $eq of its pipeline. None without a join condition.
+    """
+    if "foreignField" in lookup:
+        return {lookup["foreignField"]: sample}
+    for stage in lookup.get("pipeline", ()):
+        operands = stage.get("$match", {}).get("$expr", {}).get("$eq", ())
+        fields = [o for o in operands if isinstance(o, str) and o.startswith("$") and not o.startswith("$$")]
+        if fields and len(fields) < len(operands):
+            return {fields[0][1:]: sample}
+    return None
+
+
+def _service_pipelines():
+    """(description, collection, pipeline) of the aggregations run by MongoService."""
+    from app.services.mongo_service import MongoService
+
+    service = MongoService()
+    return [
+        ("detection features", service.user_model.collection.name,
+         service.detection_features_pipeline("001")),
+        ("verified spending by day", service.transaction_model.collection.name,
+         service.verified_spending_by_day_pipeline("001", datetime(2000, 1, 1), (1000,))),
+    ]
+
+
+def _service_queries():
+    from app.services.mongo_service import MongoService
+
+    return QUERY_PLANS + [
+        ("scores by user_id and email", "users", MongoService.scores_query(["001"], ["user@example.com"])),
+    ]
+
+
+def _not_indexed(stages) -> bool:
+    return "COLLSCAN" in stages or "IXSCAN" not in stages
+
+
+def check_query_plans():
+    """
+    Runs explain() on each service query and returns the (description,
+    stages) of those whose winning plan is not an index scan. For the
+    aggregations, the documents they read and each of their $lookup joins
+    (the query on the foreign collection) are checked.
+    """
+    failures = []
+    for description, collection, query in _service_queries():
+        stages = _winning_stages(db[collection].find(query).explain()["queryPlanner"])
+        if _not_indexed(stages):
+            failures.append((description, stages))
+
+    for description, collection, pipeline in _service_pipelines():
+        explain = db.command("aggregate", collection, pipeline=pipeline, explain=True)
+        query_planner = _aggregate_query_planner(explain)
+        stages = _winning_stages(query_planner) if query_planner else ["no plan"]
+        if _not_indexed(stages):
+            failures.append((description, stages))
+
+        for stage in pipeline:
+            lookup = stage.get("$lookup")
+            if lookup is None:
+                continue
+            join = f"{description}: $lookup {lookup['as']}"
+            query = _lookup_query(lookup, "001")
+            if query is None:
+                failures.append((join, ["no join condition"]))
+                continue
+            stages = _winning_stages(db[lookup["from"]].find(query).explain()["queryPlanner"])
+            if _not_indexed(stages):
+                failures.append((join, stages))
+    return failures
@@ -1,9 +1,16 @@
 from pydantic import BaseModel, EmailStr, Field
-from pymongo import ReturnDocument
 from app.db.mongo import db
+from app.models.identity_map import cached_find_one, invalidate
+from app.utils.config import Config
 from typing import Optional
 from datetime import datetime
 from enum import Enum
+import logging
+import os
+import threading
+
+
+logger = logging.getLogger(__name__)
 
 class TransactionStatus(str, Enum):
     VERIFIED = "verified"
@@ -44,10 +51,21 @@ class DeviceLog(BaseModel):
     ip_address: str = Field(..., description="Device IP address")
     timestamp: datetime = Field(default_factory=datetime.now, description="Log timestamp")
     location: str = Field(..., description="Device location")
+
+class ImportedTransaction(Transaction):
+    import_key: str = Field(..., description="Hash of the imported record, unique")
+
+class ImportedDeviceLog(DeviceLog):
+    import_key: str = Field(..., description="Hash of the imported record, unique")
     
 class MongoUserModel:
-    def __init__(self):
-        self.collection = db.users
+    # the password hash is only read by the login
+    PROJECTION = {"password": 0}
+    KEYS = ("user_id", "email")
+
+    @property
+    def collection(self):
+        return db.users
 
     def create(self, user: User):
         if not user.user_id:
@@ -55,19 +73,37 @@ class MongoUserModel:
         self.collection.insert_one(user.dict())
         return user
 
+    def create_many(self, users: list[User]):
+        """Inserts a batch of users, returns those actually inserted."""
+        missing = [user for user in users if not user.user_id]
+        for user, user_id in zip(missing, reserve_ids("user_id", len(missing))):
+            user.user_id = user_id
+        return insert_many(self.collection, users)
+
     def read(self, user_id: str):
-        return self.collection.find_one({"user_id": user_id})
+        return cached_find_one(self.collection, "user_id", user_id, self.KEYS, self.PROJECTION)
     
     def read_by_email(self, email: str):
+        return cached_find_one(self.collection, "email", email, self.KEYS, self.PROJECTION)
+
+    def read_credentials(self, email: str):
+        """The user with the password hash, for the login only (not cached)."""
         return self.collection.find_one({"email": email})
 
+    def invalidate(self, user_id: str):
+        """Drops the user from the request identity map after a write."""
+        invalidate(self.collection.name, "user_id", user_id)
+
     def update(self, user_id: str, user: User):
+        from pymongo import ReturnDocument
+
         update_data = user.dict(exclude_unset=True)
         result = self.collection.find_one_and_update(
             {"user_id": user_id},
             {"$set": update_data},
             return_document=ReturnDocument.AFTER
         )
+        self.invalidate(user_id)
         return result if result else None
     
     def append_deductions(self, user_id: str, rules: list[str]):
@@ -81,11 +117,13 @@ class MongoUserModel:
             {"user_id": user_id},
             {"$addToSet": {"score_deductions_applied": {"$each": rules}}}
         )
+        self.invalidate(user_id)
 
             
 class MongoTransactionModel:
-    def __init__(self):
-        self.collection = db.transactions
+    @property
+    def collection(self):
+        return db.transactions
 
     def create(self, txn: Transaction):
         if not txn.transaction_id:
@@ -94,13 +132,35 @@ class MongoTransactionModel:
         self.collection.insert_one(txn.dict())
         return txn
 
+    def create_many(self, txns: list[Transaction]):
+        """Inserts a batch of transactions, returns those actually inserted."""
+        missing = [txn for txn in txns if not txn.transaction_id]
+        for txn, transaction_id in zip(missing, reserve_ids("transaction_id", len(missing))):
+            txn.transaction_id = transaction_id
+        return insert_many(self.collection, txns)
+
+    def ids_by_import_key(self, import_keys: list[str]) -> dict:
+        """The transaction_id of the imported transactions, by import_key."""
+        if not import_keys:
+            return {}
+        txns = self.collection.find({"import_key": {"$in": import_keys}}, {"import_key": 1, "transaction_id": 1})
+        return {txn["import_key"]: txn["transaction_id"] for txn in txns}
+
     def read(self, transaction_id: str):
-        return self.collection.find_one({"transaction_id": transaction_id})
+        return cached_find_one(self.collection, "transaction_id", transaction_id, ("transaction_id",))
+
+    def invalidate(self, transaction_id: str):
+        """Drops the transaction from the request identity map after a write."""
+        invalidate(self.collection.name, "transaction_id", transaction_id)
     
     
 class DeviceLogModel:
     def __init__(self):
-        self.collection = db.device_logs
+        self.device_users_model = DeviceUsersModel()
+
+    @property
+    def collection(self):
+        return db.device_logs
 
     def create(self, device_log: DeviceLog):
         device_log_dict = device_log.dict()
@@ -113,17 +173,256 @@ class DeviceLogModel:
             self.collection.insert_one(device_log_dict)
         except Exception as e:
             raise e
+
+        if device_log_dict.get("device_id"):
+            self.device_users_model.add_user(device_log_dict["device_id"], device_log_dict["user_id"])
         return device_log_dict
 
+    def create_many(self, device_logs: list[DeviceLog]):
+        """Inserts a batch of device logs, returns those actually inserted."""
+        for device_log in device_logs:
+            if device_log.mac_address:
+                device_log.device_id = device_log.mac_address.upper().replace(":", "")
+        inserted = insert_many(self.collection, device_logs)
+        self.device_users_model.add_users(
+            [(log.device_id, log.user_id) for log in inserted if log.device_id]
+        )
+        return inserted
+
     def read(self, device_id: str):
         device_id = device_id.upper().replace(":", "")
         return self.collection.find_one({"device_id": device_id})
+
+
+class DeviceUsersModel:
+    """
+    Device to users cardinality index: one document per device with the
+    distinct users that logged in with it, maintained on each device log.
+    """
+    @property
+    def collection(self):
+        return db.device_users
+
+    def add_user(self, device_id: str, user_id: str):
+        # pipeline update so that the user set and its size change atomically
+        self.collection.update_one(
+            {"_id": device_id},
+            [
+                {"$set": {"user_ids": {"$setUnion": [{"$ifNull": ["$user_ids", []]}, [user_id]]}}},
+                {"$set": {"user_count": {"$size": "$user_ids"}}}
+            ],
+            upsert=True
+        )
+
+    def add_users(self, pairs):
+        """Batched add_user for (device_id, user_id) pairs."""
+        from pymongo import UpdateOne
+
+        users_by_device = {}
+        for device_id, user_id in pairs:
+            users_by_device.setdefault(device_id, set()).add(user_id)
+        if not users_by_device:
+            return
+        self.collection.bulk_write([
+            UpdateOne(
+                {"_id": device_id},
+                [
+                    {"$set": {"user_ids": {"$setUnion": [{"$ifNull": ["$user_ids", []]}, sorted(user_ids)]}}},
+                    {"$set": {"user_count": {"$size": "$user_ids"}}}
+                ],
+                upsert=True
+            )
+            for device_id, user_ids in users_by_device.items()
+        ], ordered=False)
+
+    def count_devices(self, user_id: str) -> int:
+        return self.collection.count_documents({"user_ids": user_id})
+
+    def has_shared_device(self, user_id: str, max_users: int) -> bool:
+        return self.collection.find_one(
+            {"user_ids": user_id, "user_count": {"$gt": max_users}},
+            {"_id": 1}
+        ) is not None
+
+
+class MonthlySpendModel:
+    """
+    Rollup of verified spending keyed by (user_id, year, month), maintained
+    incrementally when a transaction is verified.
+    """
+    @property
+    def collection(self):
+        return db.monthly_spend
+
+    def increment(self, user_id: str, year: int, month: int, amount: float, count: int = 1):
+        self.collection.update_one(
+            {"user_id": user_id, "year": year, "month": month},
+            {"$inc": {"total_spent": amount, "txn_count": count}},
+            upsert=True
+        )
+
+    def increment_many(self, totals):
+        """Batched increment: totals maps (user_id, year, month) to (amount, count)."""
+        from pymongo import UpdateOne
+
+        if not totals:
+            return
+        self.collection.bulk_write([
+            UpdateOne(
+                {"user_id": user_id, "year": year, "month": month},
+                {"$inc": {"total_spent": amount, "txn_count": count}},
+                upsert=True
+            )
+            for (user_id, year, month), (amount, count) in totals.items()
+        ], ordered=False)
+
+    def read_by_user(self, user_id: str):
+        return list(self.collection.find({"user_id": user_id}, {"_id": 0}))
     
+class CounterModel:
+    @property
+    def collection(self):
+        return db.counters
+
+    def reserve_range(self, name: str, count: int) -> range:
+        """Increments the counter `name` by `count`, returns the ids reserved."""
+        from pymongo import ReturnDocument
+
+        counter = self.collection.find_one_and_update(
+            {"_id": name},
+            {"$inc": {"seq": count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return range(counter["seq"] - count + 1, counter["seq"] + 1)
+
+    def advance(self, name: str, seq: int):
+        """Raises the counter `name` to at least `seq`."""
+        self.collection.update_one({"_id": name}, {"$max": {"seq": seq}}, upsert=True)
+
+
+def _reserve_range(name: str, count: int) -> range:
+    # the counters of the DB_BACKEND, see app/db/backend.py
+    from app.db.backend import CounterModel
+
+    return CounterModel().reserve_range(name, count)
+
+
+class IdBlockAllocator:
+    """
+    Hi/lo id allocator: reserves blocks of `block_size` ids from the
+    counters collection and hands them out from memory, so that only one
+    request in `block_size` updates the counter document.
+
+    Ids are unique across processes and increasing within a process, but
+    not dense: the unused rest of a block is lost when the process exits.
+    The next block is reserved in the background once `refill_ratio` of the
+    current one is left; a caller running out of ids meanwhile waits for it
+    rather than reserving another block, which could be handed out first.
+    """
+
+    def __init__(self, name: str, block_size: int, refill_ratio: float = 0.1):
+        self.name = name
+        self.block_size = block_size
+        self.refill_threshold = int(block_size * refill_ratio)
+        self._lock = threading.Lock()
+        self._refilled = threading.Condition(self._lock)
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._ids = iter(())
+        self._left = 0
+        self._next_block = None
+        self._refilling = False
+
+    def next_id(self) -> str:
+        with self._lock:
+            if self._pid != os.getpid():
+                # the parent process may still hand out the ids of its block
+                self._reset()
+            if self._left == 0:
+                while self._refilling:
+                    self._refilled.wait()
+                block = self._next_block or _reserve_range(self.name, self.block_size)
+                self._next_block = None
+                self._ids, self._left = iter(block), len(block)
+            seq = next(self._ids)
+            self._left -= 1
+            if self._left <= self.refill_threshold and self._next_block is None and not self._refilling:
+                self._refilling = True
+                threading.Thread(target=self._refill, name=f"id-refill-{self.name}", daemon=True).start()
+        return str(seq).zfill(3)
+
+    def _refill(self):
+        try:
+            block = _reserve_range(self.name, self.block_size)
+        except Exception as e:
+            # the block is reserved synchronously once the current one runs out
+            logger.warning("Failed to reserve %s ids: %s", self.name, e)
+            block = None
+        with self._lock:
+            self._refilling = False
+            if self._pid == os.getpid():
+                self._next_block = block
+            self._refilled.notify_all()
+
+
+_allocators = {}
+_allocators_lock = threading.Lock()
+
 def get_next_id(name: str) -> str:
-    counter = db.counters.find_one_and_update(
-        {"_id": name},
-        {"$inc": {"seq": 1}},
-        upsert=True,
-        return_document=ReturnDocument.AFTER
-    )
-    return str(counter["seq"]).zfill(3) 
\ No newline at end of file
+    if Config.ID_BLOCK_SIZE <= 1:
+        return str(_reserve_range(name, 1)[0]).zfill(3)
+    allocator = _allocators.get(name)
+    if allocator is None:
+        with _allocators_lock:
+            allocator = _allocators.setdefault(name, IdBlockAllocator(name, Config.ID_BLOCK_SIZE))
+    return allocator.next_id()
+
+def reset_id_allocators():
+    """Drops the reserved blocks, e.g. after the counters were reset."""
+    with _allocators_lock:
+        _allocators.clear()
+
+def advance_ids(name: str, ids: list) -> None:
+    """
+    Moves the counter `name` past the numeric ids of `ids`, given explicitly
+    rather than reserved (e.g. imported), and drops the block of this
+    process, which may overlap them. The blocks already reserved by other
+    processes are not affected.
+    """
+    seqs = [int(id_) for id_ in ids if id_ and str(id_).isdigit()]
+    if not seqs:
+        return
+    from app.db.backend import CounterModel
+
+    CounterModel().advance(name, max(seqs))
+    with _allocators_lock:
+        _allocators.pop(name, None)
+
+def reserve_ids(name: str, count: int) -> list[str]:
+    """Reserves a block of `count` consecutive ids with one counter update."""
+    if count <= 0:
+        return []
+    return [str(seq).zfill(3) for seq in _reserve_range(name, count)]
+
+def insert_many(collection, documents: list):
+    """
+    Unordered insert_many of pydantic models. Documents rejected as
+    duplicates (a replayed import chunk) are skipped, any other write error
+    is raised. Returns the models actually inserted.
+    """
+    from pymongo.errors import BulkWriteError
+
+    if not documents:
+        return []
+    try:
+        collection.insert_many([document.dict() for document in documents], ordered=False)
+        return documents
+    except BulkWriteError as e:
+        errors = e.details["writeErrors"]
+        if any(error["code"] != 11000 for error in errors):
+            raise
+        rejected = {error["index"] for error in errors}
+        return [document for i, document in enumerate(documents) if i not in rejected]
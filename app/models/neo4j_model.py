@@ -1,6 +1,11 @@
 from app.db.neo4j import neo4j_driver
 from pydantic import BaseModel, Field
 from .mongo_model import TransactionStatus
+import logging
+
+
+logger = logging.getLogger(__name__)
+
 
 class Neo4jBaseModel:
     driver = neo4j_driver
@@ -34,9 +39,13 @@ class Neo4jUserModel(Neo4jBaseModel):
 
     def create(self, user: UserSchema):
         with self.driver.session() as session:
-            print(f"[DEBUG] Creating user: {user.user_id}")
+            logger.debug("Creating user node %s", user.user_id)
             return session.execute_write(self._create_user_node, user.dict())
 
+    def create_many(self, users: list[UserSchema]):
+        with self.driver.session() as session:
+            return session.execute_write(self._create_user_nodes, [user.dict() for user in users])
+
     def read(self, user_id=None):
         with self.driver.session() as session:
             if user_id:
@@ -63,6 +72,19 @@ class Neo4jUserModel(Neo4jBaseModel):
         result = tx.run(query, **data)
         return result.single()["node_id"]
 
+    @staticmethod
+    def _create_user_nodes(tx, rows):
+        query = """
+        UNWIND $rows AS row
+        MERGE (u:User {user_id: row.user_id})
+        ON CREATE SET u.fname = row.fname,
+                    u.lname = row.lname,
+                    u.score = row.score
+        RETURN count(u) AS count
+        """
+        result = tx.run(query, rows=rows)
+        return result.single()["count"]
+
 
     @staticmethod
     def _get_user_by_id(tx, user_id):
@@ -108,11 +130,13 @@ class Neo4jTransactionModel(Neo4jBaseModel):
         REQUIRE t.transaction_id IS UNIQUE
         """
         tx.run(query)
+        # range reads of the transactions created recently (TransactionGraph syncs)
+        tx.run("CREATE INDEX transaction_created_at IF NOT EXISTS FOR (t:Transaction) ON (t.created_at)")
 
     
     def create(self, txn: TransactionSchema):
         with self.driver.session() as session:
-            print(f"[DEBUG] Creating txn: {txn.transaction_id}")
+            logger.debug("Creating transaction node %s", txn.transaction_id)
             return session.execute_write(self._create_transaction_node, txn.dict())
         
     def read(self, transaction_id=None):
@@ -136,7 +160,8 @@ class Neo4jTransactionModel(Neo4jBaseModel):
         MERGE (t:Transaction {transaction_id: $transaction_id})
         ON CREATE SET t.amount = $amount,
                     t.timestamp = $timestamp,
-                    t.status = $status
+                    t.status = $status,
+                    t.created_at = timestamp()
         RETURN id(t) AS node_id
         """
         result = tx.run(query, **data)
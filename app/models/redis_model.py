@@ -1,15 +1,410 @@
 from typing import Optional
 from app.db.redis import redis_client
 
+_scripts = {}
+
+def _script(source: str):
+    # bound to the lazy client, so that each process runs it with its own connections
+    script = _scripts.get(source)
+    if script is None:
+        from redis.commands.core import Script
+
+        script = _scripts[source] = Script(redis_client, source)
+    return script
+
+
 class RedisTrustScoreModel:
     @staticmethod
     def get(key: str) -> Optional[str]:
         return redis_client.get(key)
 
+    @staticmethod
+    def get_many(keys: list) -> list:
+        return redis_client.mget(keys)
+
     @staticmethod
     def set(key: str, value: str, expire_seconds: int = 3600) -> bool:
         return redis_client.set(key, value, ex=expire_seconds)
 
+    @staticmethod
+    def set_if_missing(key: str, value: str, expire_seconds: int = 3600) -> bool:
+        return bool(redis_client.set(key, value, ex=expire_seconds, nx=True))
+
     @staticmethod
     def exists(key: str) -> bool:
         return redis_client.exists(key) == 1
+
+    # KEYS[1] score, KEYS[2] read counter of the activity window
+    # ARGV activity window in ms
+    # Returns {score or nil, remaining ttl in ms, reads in the window}
+    READ_SCRIPT = """
+    local score = redis.call('GET', KEYS[1])
+    local ttl = redis.call('PTTL', KEYS[1])
+    local reads = redis.call('INCR', KEYS[2])
+    if reads == 1 then
+        redis.call('PEXPIRE', KEYS[2], ARGV[1])
+    end
+    return {score, ttl, reads}
+    """
+
+    # KEYS[1] score; ARGV score read, its remaining ttl in ms, new score, new ttl in ms
+    # Only replaces the score read if nothing wrote it since: a deduction
+    # changes the score, a set resets the ttl above the one read. Sets it if
+    # expired.
+    REFRESH_SCRIPT = """
+    local score = redis.call('GET', KEYS[1])
+    if score then
+        if score ~= ARGV[1] or redis.call('PTTL', KEYS[1]) > tonumber(ARGV[2]) then
+            return 0
+        end
+    end
+    redis.call('SET', KEYS[1], ARGV[3], 'PX', ARGV[4])
+    return 1
+    """
+
+    @staticmethod
+    def read(key: str, reads_key: str, window_ms: int) -> tuple:
+        score, ttl, reads = _script(RedisTrustScoreModel.READ_SCRIPT)(keys=[key, reads_key], args=[window_ms])
+        return score, int(ttl), int(reads)
+
+    @staticmethod
+    def refresh(key: str, read_value: str, read_ttl_ms: int, value: str, expire_ms: int) -> bool:
+        args = [read_value, read_ttl_ms, value, expire_ms]
+        return _script(RedisTrustScoreModel.REFRESH_SCRIPT)(keys=[key], args=args) == 1
+
+    @staticmethod
+    def lock(key: str, timeout: float):
+        # not thread-local: a refresh lock is released by the refresh thread
+        return redis_client.lock(key, timeout=timeout, thread_local=False)
+
+    # KEYS[1] score, KEYS[2] set of the one-time rules already applied,
+    # optional KEYS[3] hash of the scores not persisted yet
+    # ARGV ttl of the rules set, operation id ('' for none), then (rule,
+    # delta, repeatable) triples in rules order
+    # Returns {} if the score or the rules set is missing, otherwise
+    # {new score, rules applied for the first time...}. Repeatable rules
+    # always apply, the others once per user and while the score is > 0.
+    # An operation is applied once: its id is kept in the rules set (as
+    # `op:<id>`), and a replay only returns the score.
+    # The score keeps its ttl, set by the reads (adaptive ttl), and is only
+    # written, and marked dirty, when it changed.
+    DEDUCT_SCRIPT = """
+    local score = redis.call('GET', KEYS[1])
+    if not score or redis.call('EXISTS', KEYS[2]) == 0 then
+        return {}
+    end
+    if ARGV[2] ~= '' and redis.call('SADD', KEYS[2], 'op:' .. ARGV[2]) == 0 then
+        return {tonumber(score)}
+    end
+    local score_ttl = redis.call('PTTL', KEYS[1])
+    score = tonumber(score)
+    local previous = score
+    local result = {0}
+    for i = 3, #ARGV, 3 do
+        local rule, delta = ARGV[i], tonumber(ARGV[i + 1])
+        if ARGV[i + 2] == '1' then
+            score = score + delta
+        elseif score > 0 and redis.call('SADD', KEYS[2], rule) == 1 then
+            score = score + delta
+            table.insert(result, rule)
+        end
+    end
+    redis.call('EXPIRE', KEYS[2], tonumber(ARGV[1]))
+    if score ~= previous then
+        if score_ttl > 0 then
+            redis.call('SET', KEYS[1], score, 'PX', score_ttl)
+        else
+            redis.call('SET', KEYS[1], score)
+        end
+        if KEYS[3] then
+            -- until persisted to MongoDB, by the flusher or after the transaction
+            redis.call('HSET', KEYS[3], KEYS[1], score)
+        end
+    end
+    result[1] = score
+    return result
+    """
+
+    # KEYS[1] rules set; ARGV ttl, rules. A `loaded` member marks the set as
+    # loaded even when no rule was applied yet. Kept if already loaded.
+    LOAD_RULES_SCRIPT = """
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        return 0
+    end
+    for i = 2, #ARGV do
+        redis.call('SADD', KEYS[1], ARGV[i])
+    end
+    redis.call('SADD', KEYS[1], 'loaded')
+    redis.call('EXPIRE', KEYS[1], tonumber(ARGV[1]))
+    return 1
+    """
+
+    # KEYS[1] dirty scores hash; ARGV (user_id, score) pairs that were
+    # persisted. Removes them unless the score changed in the meantime.
+    CLEAR_DIRTY_SCRIPT = """
+    local cleared = 0
+    for i = 1, #ARGV, 2 do
+        if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+            cleared = cleared + redis.call('HDEL', KEYS[1], ARGV[i])
+        end
+    end
+    return cleared
+    """
+
+    @staticmethod
+    def deduct(score_key: str, rules_key: str, args: list, dirty_key: Optional[str] = None):
+        keys = [score_key, rules_key] + ([dirty_key] if dirty_key else [])
+        result = _script(RedisTrustScoreModel.DEDUCT_SCRIPT)(keys=keys, args=args)
+        if not result:
+            return None, []
+        return int(result[0]), [rule.decode() if isinstance(rule, bytes) else rule for rule in result[1:]]
+
+    @staticmethod
+    def load_rules(rules_key: str, rules: list, expire_seconds: int) -> bool:
+        args = [expire_seconds] + list(rules)
+        return _script(RedisTrustScoreModel.LOAD_RULES_SCRIPT)(keys=[rules_key], args=args) == 1
+
+    @staticmethod
+    def get_dirty(dirty_key: str, limit: int) -> dict:
+        scores = {}
+        for user_id, score in redis_client.hscan_iter(dirty_key, count=limit):
+            scores[user_id.decode()] = int(score)
+            if len(scores) >= limit:
+                break
+        return scores
+
+    @staticmethod
+    def get_dirty_one(dirty_key: str, user_id: str) -> Optional[int]:
+        score = redis_client.hget(dirty_key, user_id)
+        return int(score) if score is not None else None
+
+    @staticmethod
+    def clear_dirty(dirty_key: str, scores: dict) -> int:
+        args = []
+        for user_id, score in scores.items():
+            args += [user_id, str(score)]
+        return _script(RedisTrustScoreModel.CLEAR_DIRTY_SCRIPT)(keys=[dirty_key], args=args)
+
+    @staticmethod
+    def set_many(values: dict, expire_seconds: int = 3600):
+        pipe = redis_client.pipeline(transaction=False)
+        for key, value in values.items():
+            # like set_if_missing, never overwrite a score deducted meanwhile
+            pipe.set(key, value, ex=expire_seconds, nx=True)
+        return pipe.execute()
+
+
+class RedisTrustWindowModel:
+    """
+    Rolling window of a user's verified transactions, kept in one hash with
+    per-day fields: `a:<day>` total amount, `c:<day>` number of transactions
+    and `h<threshold>:<day>` number of transactions >= threshold, where <day>
+    is the proleptic ordinal of the transaction date.
+    """
+
+    # KEYS[1] window hash
+    # ARGV window_start, month_start, day, amount, ttl,
+    #      total_amount_limit, max_high_value_txns, high_field,
+    #      max_txns_per_month, max_txn_amount (-1 when not restricted),
+    #      then (high_field, threshold) pairs to record the transaction with
+    # Returns {-1} if the window is missing, {0} once the transaction is
+    # recorded, or {1..4, value} for the violated limit (nothing recorded).
+    RESERVE_SCRIPT = """
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return {-1, '0'}
+    end
+    local window_start = tonumber(ARGV[1])
+    local month_start = tonumber(ARGV[2])
+    local day = tonumber(ARGV[3])
+    local amount = tonumber(ARGV[4])
+    local high_field = ARGV[8]
+
+    local total, month_count, month_high = 0, 0, 0
+    local stale = {}
+    local fields = redis.call('HGETALL', KEYS[1])
+    for i = 1, #fields, 2 do
+        local kind, d = string.match(fields[i], '^([^:]+):(%d+)$')
+        if d then
+            d = tonumber(d)
+            if d < window_start then
+                table.insert(stale, fields[i])
+            else
+                local value = tonumber(fields[i + 1])
+                if kind == 'a' then
+                    total = total + value
+                elseif d >= month_start and kind == 'c' then
+                    month_count = month_count + value
+                elseif d >= month_start and kind == high_field then
+                    month_high = month_high + value
+                end
+            end
+        end
+    end
+    if #stale > 0 then
+        redis.call('HDEL', KEYS[1], unpack(stale))
+    end
+
+    local total_limit = tonumber(ARGV[6])
+    if total_limit >= 0 and total + amount > total_limit then
+        return {1, tostring(total)}
+    end
+    local max_high = tonumber(ARGV[7])
+    if max_high >= 0 and month_high >= max_high then
+        return {2, tostring(month_high)}
+    end
+    local max_month = tonumber(ARGV[9])
+    if max_month >= 0 then
+        if month_count >= max_month then
+            return {3, tostring(month_count)}
+        end
+        local max_amount = tonumber(ARGV[10])
+        if max_amount >= 0 and amount > max_amount then
+            return {4, tostring(amount)}
+        end
+    end
+
+    if day >= window_start then
+        redis.call('HINCRBYFLOAT', KEYS[1], 'a:' .. day, amount)
+        redis.call('HINCRBY', KEYS[1], 'c:' .. day, 1)
+        for i = 11, #ARGV, 2 do
+            if amount >= tonumber(ARGV[i + 1]) then
+                redis.call('HINCRBY', KEYS[1], ARGV[i] .. ':' .. day, 1)
+            end
+        end
+    end
+    redis.call('EXPIRE', KEYS[1], tonumber(ARGV[5]))
+    return {0, '0'}
+    """
+
+    # KEYS[1] window hash
+    # ARGV day, amount, then (high_field, threshold) pairs
+    RELEASE_SCRIPT = """
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return 0
+    end
+    local day = ARGV[1]
+    local amount = tonumber(ARGV[2])
+    redis.call('HINCRBYFLOAT', KEYS[1], 'a:' .. day, -amount)
+    redis.call('HINCRBY', KEYS[1], 'c:' .. day, -1)
+    for i = 3, #ARGV, 2 do
+        if amount >= tonumber(ARGV[i + 1]) then
+            redis.call('HINCRBY', KEYS[1], ARGV[i] .. ':' .. day, -1)
+        end
+    end
+    return 1
+    """
+
+    # KEYS[1] window hash
+    # ARGV ttl, then field/value pairs
+    # Only loads the window if it does not exist yet, so that a concurrent
+    # rebuild never overwrites reservations made in the meantime.
+    LOAD_SCRIPT = """
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        return 0
+    end
+    redis.call('HSET', KEYS[1], 'loaded', 1)
+    for i = 2, #ARGV, 2 do
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+    redis.call('EXPIRE', KEYS[1], tonumber(ARGV[1]))
+    return 1
+    """
+
+    @staticmethod
+    def reserve(key: str, args: list) -> tuple:
+        code, value = _script(RedisTrustWindowModel.RESERVE_SCRIPT)(keys=[key], args=args)
+        return int(code), float(value)
+
+    @staticmethod
+    def release(key: str, args: list) -> bool:
+        return _script(RedisTrustWindowModel.RELEASE_SCRIPT)(keys=[key], args=args) == 1
+
+    @staticmethod
+    def delete_many(keys: list) -> int:
+        if not keys:
+            return 0
+        return redis_client.delete(*keys)
+
+    @staticmethod
+    def load(key: str, fields: dict, expire_seconds: int) -> bool:
+        args = [expire_seconds]
+        for field, value in fields.items():
+            args += [field, value]
+        return _script(RedisTrustWindowModel.LOAD_SCRIPT)(keys=[key], args=args) == 1
+
+
+class RedisStreamModel:
+    """Redis Streams with consumer groups, and leases held by a worker."""
+
+    @staticmethod
+    def add(stream: str, fields: dict, maxlen: int) -> str:
+        return redis_client.xadd(stream, fields, maxlen=maxlen, approximate=True)
+
+    @staticmethod
+    def ensure_group(stream: str, group: str):
+        from redis.exceptions import ResponseError
+
+        try:
+            redis_client.xgroup_create(stream, group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    @staticmethod
+    def read(streams: dict, group: str, consumer: str, count: int, block_ms: int) -> list:
+        return redis_client.xreadgroup(group, consumer, streams, count=count, block=block_ms) or []
+
+    @staticmethod
+    def claim_pending(stream: str, group: str, consumer: str, start_id: str, count: int):
+        """Takes over the pending entries of the group (e.g. of a dead worker)."""
+        next_id, entries = redis_client.xautoclaim(stream, group, consumer, 0, start_id, count=count)[:2]
+        return next_id, entries
+
+    @staticmethod
+    def ack(stream: str, group: str, entry_id) -> int:
+        return redis_client.xack(stream, group, entry_id)
+
+    @staticmethod
+    def length(stream: str) -> int:
+        return redis_client.xlen(stream)
+
+    # KEYS[1] lease; ARGV owner, ttl in ms. Extends the lease if still owned.
+    RENEW_LEASE_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    end
+    return 0
+    """
+
+    # KEYS[1] lease; ARGV owner. Releases the lease if still owned.
+    RELEASE_LEASE_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    @staticmethod
+    def acquire_lease(key: str, owner: str, ttl_ms: int) -> bool:
+        return bool(redis_client.set(key, owner, px=ttl_ms, nx=True))
+
+    @staticmethod
+    def renew_lease(key: str, owner: str, ttl_ms: int) -> bool:
+        return _script(RedisStreamModel.RENEW_LEASE_SCRIPT)(keys=[key], args=[owner, ttl_ms]) == 1
+
+    @staticmethod
+    def release_lease(key: str, owner: str) -> bool:
+        return _script(RedisStreamModel.RELEASE_LEASE_SCRIPT)(keys=[key], args=[owner]) == 1
+
+    @staticmethod
+    def heartbeat(key: str, member: str, now: float, expire_before: float) -> int:
+        """Registers a live member and returns the number of live members."""
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.zadd(key, {member: now})
+        pipe.zremrangebyscore(key, "-inf", expire_before)
+        pipe.zcard(key)
+        return pipe.execute()[2]
+
+    @staticmethod
+    def leave(key: str, member: str):
+        return redis_client.zrem(key, member)
@@ -1,16 +1,16 @@
-from fastapi import HTTPException
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, abort
 from app.services.redis_service import RedisTrustScoreService
-from app.models.mongo_model import MongoUserModel, DeviceLogModel, User, DeviceLog
-from app.services.mongo_service import MongoService
-from app.models.neo4j_model import Neo4jUserModel, UserSchema
-from app.services.mongo_service import MongoService
-from app.services.trust_service import enforce_trust_policy
-from app.services.score_service import get_score, get_flag_and_warning
+from app.db.backend import MongoUserModel, DeviceLogModel, Neo4jUserModel, MongoService
+from app.models.mongo_model import User, DeviceLog
+from app.models.neo4j_model import UserSchema
+from app.services.trust_service import enforce_trust_policy, TrustPolicyError
+from app.services.score_service import get_score, get_scores, get_flag_and_warning
 from app.services.score_service import calculate_score, update_score_mongo
-from app.utils.trust_score import SCORE
+from app.services.deferred_scoring import is_streamed, queue_login
+from app.utils.trust_score import SCORE_BANDS
+from app.utils.config import Config
+from app.utils.security import hash_password, verify_password
 from flask import request, jsonify, Blueprint
-import hashlib
 
 
 user_bp = Blueprint('users', __name__)
@@ -21,20 +21,12 @@ mongo_user_model = MongoUserModel()
 node = Neo4jUserModel()
 
 
-def hash_password(password):
-    """Hash a password using SHA-256"""
-    return hashlib.sha256(password.encode()).hexdigest()
-
-def verify_password(stored_password_hash, provided_password):
-    return stored_password_hash == hash_password(provided_password)
-
-
 @user_bp.route('/register', methods=['POST'])
 def register():
     user_data = User(**request.json)
     user_data.password = hash_password(user_data.password)
 
-    user = MongoUserModel().collection.find_one({"email": user_data.email})
+    user = mongo_user_model.read_by_email(user_data.email)
     if user:
         return jsonify({"error": "User with this email already exists"}), 400
 
@@ -69,7 +61,7 @@ def login():
     if not email or not password:
         return jsonify({"error": "Email and password are required"}), 400
 
-    user = MongoUserModel().collection.find_one({"email": email})
+    user = mongo_user_model.read_credentials(email)
     if not user or not verify_password(user["password"], password):
         return jsonify({"error": "Invalid credentials"}), 401
 
@@ -79,7 +71,10 @@ def login():
     flag, warning = get_flag_and_warning(score)
 
     if score is not None:
-        enforce_trust_policy(user_id, action="login", score=score)
+        try:
+            enforce_trust_policy(user_id, action="login", score=score)
+        except TrustPolicyError as e:
+            return jsonify({"error": str(e)}), 403
 
 
     if device_log:
@@ -88,7 +83,11 @@ def login():
             DeviceLogModel().create(DeviceLog(**device_log))
         except Exception as e:
             return jsonify({"error": "Failed to log device information", "details": str(e)}), 500
-        
+
+    # stream scoring: the account detectors run again in a scoring worker
+    if is_streamed():
+        queue_login(user_id)
+
     return jsonify({
         "message": "Login successful",
         "user_email": email,
@@ -107,16 +106,47 @@ def get_user_score():
     user_id = user["user_id"]
     new_score = get_score(user_id)
     if new_score is None:
-        raise HTTPException(status_code=404, detail="User not found")
-    for score in SCORE:
-        if score["min"] <= new_score <= score["max"]:
-            return {
-                "email": email, 
-                "score": new_score, 
-                "flag": score["flag"], 
-                "message": score["warning"]
-                }
-    return None
+        abort(404, description="User not found")
+    score = SCORE_BANDS.lookup(new_score)
+    if score is None:
+        return None
+    return {
+        "email": email, 
+        "score": new_score, 
+        "flag": score["flag"], 
+        "message": score["warning"]
+        }
+
+
+@user_bp.route('/score/batch', methods=['POST'])
+def get_user_scores():
+    data = request.json or {}
+    emails = data.get("emails") or []
+    user_ids = data.get("user_ids") or []
+    if not isinstance(emails, list) or not isinstance(user_ids, list):
+        return {"error": "emails and user_ids must be lists"}, 400
+    if len(emails) + len(user_ids) > Config.SCORE_BATCH_MAX_SIZE:
+        return {"error": f"At most {Config.SCORE_BATCH_MAX_SIZE} users per request"}, 400
+
+    users = get_scores(user_ids=user_ids, emails=emails)
+    users_by_email = {user["email"]: user for user in users.values() if user["email"]}
+
+    # in the order of the request, emails first
+    scores, not_found = [], []
+    for key, user in [(email, users_by_email.get(email)) for email in emails] + \
+            [(user_id, users.get(user_id)) for user_id in user_ids]:
+        if user is None:
+            not_found.append(key)
+            continue
+        flag, warning = get_flag_and_warning(user["score"])
+        scores.append({
+            "email": user["email"],
+            "user_id": user["user_id"],
+            "score": user["score"],
+            "flag": flag,
+            "message": warning,
+        })
+    return {"scores": scores, "not_found": not_found}
 
 
 @user_bp.route('/score/calculate', methods=['POST'])
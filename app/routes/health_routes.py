@@ -0,0 +1,68 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from flask import Blueprint
+from app.utils.config import Config
+import os
+import threading
+
+
+health_bp = Blueprint('health', __name__)
+
+# one executor per process for the readiness checks, and the future of each
+# check still running: a hanging check is not started again until it returns
+_executor = None
+_running = {}
+_lock = threading.Lock()
+
+
+def _reset():
+    """Forgets the executor inherited from the parent process, its threads are not."""
+    global _executor, _running, _lock
+    _executor, _running, _lock = None, {}, threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset)
+
+
+def _checks():
+    from app.db import mongo, redis, neo4j
+
+    return {"mongodb": mongo.ping, "redis": redis.ping, "neo4j": neo4j.ping}
+
+
+def _submit(checks: dict) -> dict:
+    global _executor
+    futures = {}
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="health")
+        for name, check in checks.items():
+            future = _running.get(name)
+            if future is None or future.done():
+                future = _running[name] = _executor.submit(check, Config.HEALTH_TIMEOUT)
+            futures[name] = future
+    return futures
+
+
+@health_bp.route("/health")
+@health_bp.route("/health/live")
+def live():
+    """The process is up and serving, without touching the databases."""
+    return {"status": "UP"}
+
+
+@health_bp.route("/health/ready")
+def ready():
+    """The databases answer within HEALTH_TIMEOUT seconds (creating the clients if needed)."""
+    checks = {}
+    futures = _submit(_checks())
+    wait(futures.values(), timeout=Config.HEALTH_TIMEOUT)
+    for name, future in futures.items():
+        if not future.done():
+            checks[name] = "timeout"
+        elif future.exception():
+            checks[name] = f"error: {future.exception()}"
+        else:
+            checks[name] = "UP"
+
+    status = "UP" if all(check == "UP" for check in checks.values()) else "DOWN"
+    return {"status": status, "checks": checks}, 200 if status == "UP" else 503
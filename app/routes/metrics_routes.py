@@ -0,0 +1,15 @@
+from flask import Blueprint, abort
+from app.utils.config import Config
+from app.utils.metrics import render_metrics
+
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route("/metrics")
+def metrics():
+    """Prometheus exposition of the metrics (app/utils/metrics.py)."""
+    if not Config.METRICS_ENABLED:
+        abort(404)
+    body, content_type = render_metrics()
+    return body, 200, {"Content-Type": content_type}
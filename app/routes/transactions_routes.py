@@ -1,29 +1,36 @@
-from fastapi import HTTPException
-from flask import Blueprint, request
+from flask import Blueprint, request, abort
 from app.services.redis_service import RedisTrustScoreService
-from app.services.neo4j_service import Neo4jService
-from app.models.mongo_model import MongoTransactionModel, Transaction, get_next_id, MongoUserModel
-from app.services.neo4j_service import Neo4jService
-from app.models.neo4j_model import Neo4jTransactionModel, TransactionSchema
-from app.services.mongo_service import MongoService
-from app.services.trust_service import enforce_trust_policy
-from app.services.score_service import calculate_score, update_score_mongo
+from app.db.backend import MongoTransactionModel, MongoUserModel, MongoService, Neo4jService
+from app.models.mongo_model import Transaction, get_next_id
+from app.models.neo4j_model import TransactionSchema
+from app.services.trust_service import enforce_trust_policy, TrustPolicyError
+from app.services.deferred_scoring import (
+    is_tiered,
+    is_streamed,
+    inline_rules,
+    defer_checks,
+    score_transaction,
+    queue_transaction,
+    CHECKS_PENDING,
+    CHECKS_DONE,
+)
 from pydantic import ValidationError
+import logging
 
 
+logger = logging.getLogger(__name__)
+
 redis = RedisTrustScoreService()
 txn_bp = Blueprint('transactions', __name__, url_prefix='/transactions')
 
 mongo_txn_model = MongoTransactionModel()
 mongo_user_model = MongoUserModel()
-neo4j_txn_model = Neo4jTransactionModel()
 neo4j_service = Neo4jService()
  
 
 @txn_bp.route("/", methods=["POST"])
 def make_transaction():
     tx_data = request.json
-    print(f"Received transaction data: {tx_data}")
 
     try:
         txn = Transaction(**tx_data)
@@ -40,16 +47,16 @@ def make_transaction():
     txn.sender.user_id = sender_user["user_id"]
     txn.recipient.user_id = recipient_user["user_id"]
 
-    # enforce trust policy
+    # enforce trust policy, the transaction is reserved in the user's rolling window
     try:
-        enforce_trust_policy(
+        reservation = enforce_trust_policy(
             user_id=txn.sender.user_id,
-            mongo_model=mongo_txn_model,
             amount=txn.amount,
-            action="transaction"
+            action="transaction",
+            timestamp=txn.timestamp
         )
-    except HTTPException as e:
-        return {"error": "Transaction blocked by trust policy", "details": str(e)}, 403
+    except TrustPolicyError as e:
+        return {"error": str(e)}, 403
 
     # generate ID
     transaction_id = get_next_id("transaction_id")
@@ -57,44 +64,36 @@ def make_transaction():
     
     # save transaction in MongoDB
     mongo_txn_model.create(txn)
-    print(f"Saved transaction in MongoDB: {txn}")
     
-    # create txn node in Neo4j
+    # create txn node and its relationships in Neo4j
     txn_node = TransactionSchema(
         transaction_id=transaction_id,
         amount=txn.amount,
         status=txn.status,
         timestamp=txn.timestamp.isoformat()
     )
-    neo4j_txn_model.create(txn_node)
-    print(f"Created transaction node in Neo4j: {txn_node}")
-
-    print(f'Sender Id: {sender_user["user_id"]}, Recipient Id: {recipient_user["user_id"]}')
-    
-    connection_data = {
-        "sender_id": sender_user["user_id"],
-        "receiver_id": recipient_user["user_id"],
-        "transaction_id": transaction_id,
-    }
-    neo4j_service.connect_user_transaction_user(connection_data)
-    print(f"Created relationship in Neo4j: {connection_data}")
+    neo4j_service.record_transaction(txn_node, sender_user["user_id"], recipient_user["user_id"])
+    logger.debug("Transaction %s of %s from %s to %s recorded", transaction_id, txn.amount,
+                 sender_user["user_id"], recipient_user["user_id"])
 
-    # calculate trust score
-    new_score, _ = calculate_score(sender_user["user_id"], str(transaction_id))
-    if new_score:
-        update_score_mongo(sender_user["user_id"])
-    
-    txn_updated = mongo_txn_model.read(str(transaction_id))
-    status = txn_updated["status"]
-    flag_reason = txn_updated["flag_reason"]
-    
-    # is txn is not marked suspicious, verify it
-    if status != "suspicious":
-        MongoService().verify_transaction(str(transaction_id))
-        txn_verified = mongo_txn_model.read(str(transaction_id))
-        status = txn_verified.get("status")
-        print(f"Transaction {transaction_id} verified because status is {status}")
+    checks = None
+    if is_streamed():
+        # scored by the scoring workers, poll the status endpoint
+        queue_transaction(sender_user["user_id"], str(transaction_id), reservation)
+        status, flag_reason, checks = txn.status.value, None, CHECKS_PENDING
+    else:
+        # calculate trust score, in tiered mode with the cheap detectors only
+        tiered = is_tiered()
+        rules = inline_rules() if tiered else None
+        result = score_transaction(sender_user["user_id"], str(transaction_id), reservation, rules)
+        status, flag_reason = result["status"], result["flag_reason"]
+        logger.debug("Transaction %s scored: %s", transaction_id, status)
 
+        # the graph detectors run after the response, and may still flag it
+        if tiered:
+            defer_checks(sender_user["user_id"], str(transaction_id),
+                         reservation if status != "suspicious" else None)
+            checks = CHECKS_PENDING
 
     return {
         "transaction_id": transaction_id,
@@ -103,6 +102,22 @@ def make_transaction():
         "amount": txn.amount,
         "status": status,
         "flag_reason": flag_reason,
+        **({"checks": checks} if checks else {}),
+    }
+
+
+@txn_bp.route('/<transaction_id>/status', methods=['GET'])
+def get_transaction_status(transaction_id: str):
+    """Polled after a tiered transaction until its deferred checks are done."""
+    txn = mongo_txn_model.read(transaction_id)
+    if not txn:
+        abort(404, description="Transaction not found")
+    return {
+        "transaction_id": transaction_id,
+        "status": txn["status"],
+        "flag_reason": txn.get("flag_reason"),
+        "checks": txn.get("checks", CHECKS_DONE),
+        "checks_rules": txn.get("checks_rules", []),
     }
 
 
@@ -110,6 +125,6 @@ def make_transaction():
 def get_user_transactions(user_id: str):
     transactions = MongoService().get_transactions_by_sender(user_id)
     if not transactions:
-        raise HTTPException(status_code=404, detail="No transactions found for this user")
+        abort(404, description="No transactions found for this user")
     
     return {"transactions": transactions}
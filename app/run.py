@@ -1,29 +1,95 @@
 import logging
-from flask import Flask, request, jsonify
+from flask import Flask, g, request, jsonify
 from pydantic import ValidationError
 from .routes.transactions_routes import txn_bp
 from .routes.auth_routes import user_bp
+from .routes.health_routes import health_bp
+from .routes.metrics_routes import metrics_bp
 from werkzeug.exceptions import HTTPException
+from .utils.config import Config
+from .db.registry import registry
+from .models.identity_map import start_identity_map, end_identity_map
+from .utils.metrics import REQUEST_LATENCY
+from .utils.tracing import start_trace, end_trace, current_trace
+from .utils.logs import configure_logging
+import atexit
+import time
 
 
-
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+# before the first use of app.logger, which would otherwise get its own handler
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-app.logger.setLevel(logging.DEBUG)
-
-# Force stdout to be unbuffered
-import sys
-sys.stdout.reconfigure(line_buffering=True)
-
 
 app.register_blueprint(user_bp, url_prefix='/')
 app.register_blueprint(txn_bp, url_prefix='/transactions')
+app.register_blueprint(health_bp)
+app.register_blueprint(metrics_bp)
+
+
+# request-scoped identity map of the MongoDB users and transactions
+@app.before_request
+def open_identity_map():
+    g.request_start = time.perf_counter()
+    g.identity_map_token = start_identity_map()
+
+
+# spans of the database round trips, under the caller's X-Request-ID if any
+@app.before_request
+def open_trace():
+    if Config.TRACING_ENABLED:
+        g.trace_token = start_trace(request.headers.get("X-Request-ID"))
+
+
+# latency by route (the rule, not the path, to keep the label values bounded)
+@app.after_request
+def observe_request(response):
+    start = g.get("request_start")
+    if Config.METRICS_ENABLED and start is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_LATENCY.labels(request.method, route, response.status_code).observe(time.perf_counter() - start)
+    trace = current_trace() if g.get("trace_token") is not None else None
+    if trace is not None:
+        response.headers["X-Trace-Id"] = trace.trace_id
+        if Config.TRACE_RESPONSE_HEADER:
+            response.headers["Server-Timing"] = trace.server_timing()
+    return response
+
+
+@app.teardown_request
+def close_trace(exc=None):
+    token = g.pop("trace_token", None)
+    if token is not None:
+        end_trace(token)
+
+
+@app.teardown_request
+def close_identity_map(exc=None):
+    token = g.pop("identity_map_token", None)
+    if token is None:
+        return
+    identity_map = end_identity_map(token)
+    if identity_map.hits:
+        app.logger.debug(
+            "%s %s: %d MongoDB reads served by the identity map, %d queried",
+            request.method, request.path, identity_map.hits, identity_map.misses
+        )
+
+
+
+def init_databases():
+    """One-off startup work, run once before serving (not in each worker)."""
+    if Config.MONGO_ENSURE_INDEXES:
+        from .models.mongo_indexes import ensure_indexes
+
+        try:
+            ensure_indexes()
+        except Exception as e:
+            logger.warning("MongoDB indexes creation failed: %s", e)
+
+# close the connection pools of the process on exit
+atexit.register(registry.close)
 
 
 # convert HTML error responses to JSON
@@ -37,13 +103,9 @@ def handle_http_exception(e):
     return response
 
 
-@app.route("/health")
-def health():
-    return {"status": "UP"}
-
 def run_app():
-    """Entry point for the application script"""
-    # Initialize the database before starting the app
+    """Entry point for the development server, see gunicorn.conf.py for production"""
+    init_databases()
     app.run(host="0.0.0.0", port=5050, debug=True)
 
 if __name__ == "__main__":
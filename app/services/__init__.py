@@ -1,6 +1,14 @@
-# Export services for easier imports
-from .mongo_service import MongoService
-from .neo4j_service import Neo4jService
-from .redis_service import RedisTrustScoreService
+# Export services for easier imports, MongoService and Neo4jService of the
+# DB_BACKEND (see app/db/backend.py). Loaded on first access, so that the
+# in-memory stand-ins can import the service modules they extend.
+__all__ = ['MongoService', 'RedisTrustScoreService', 'Neo4jService']
 
-__all__ = ['MongoService', 'RedisTrustScoreService', 'Neo4jService']
\ No newline at end of file
+
+def __getattr__(name):
+    if name == 'RedisTrustScoreService':
+        from .redis_service import RedisTrustScoreService
+        return RedisTrustScoreService
+    if name in ('MongoService', 'Neo4jService'):
+        from app.db import backend
+        return getattr(backend, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,193 @@
+"""
+Scoring of the transactions outside of the request.
+
+Tiered scoring (SCORING_MODE=tiered): the transactions endpoint only runs
+the cheap detectors before responding, and the expensive ones (Neo4j graph
+traversals) run afterwards, from a thread pool of the web worker
+(DEFERRED_BACKEND=local) or from the scoring workers of the Redis Streams
+pipeline (DEFERRED_BACKEND=stream, see scoring_pipeline).
+
+The deferred deductions are applied to the score when the checks finish,
+and a triggered rule flags the transaction as suspicious after the fact:
+a verified transaction then leaves the monthly_spend rollup and the trust
+window. The `checks` field of the transaction ("pending", then "done") is
+returned by GET /transactions/<transaction_id>/status.
+
+Stream scoring (SCORING_MODE=stream): the whole scoring of the transactions
+and the re-scoring after a login run in the scoring workers, the
+transaction staying pending until then.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from app.utils.config import Config
+from .detector_registry import COST_CHEAP, COST_EXPENSIVE, rules_by_cost
+from app.db.backend import MongoService
+from .score_service import calculate_score, update_score_mongo
+from .scoring_pipeline import event_handler, publish
+from .trust_service import release_trust_window
+import logging
+import os
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+CHECKS_PENDING = "pending"
+CHECKS_DONE = "done"
+CHECKS_FAILED = "failed"
+
+mongo = MongoService()
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def is_tiered() -> bool:
+    return Config.SCORING_MODE == "tiered"
+
+
+def is_streamed() -> bool:
+    return Config.SCORING_MODE == "stream"
+
+
+def inline_rules() -> set:
+    """Rules checked before responding in tiered mode."""
+    return rules_by_cost(COST_CHEAP)
+
+
+def deferred_rules() -> set:
+    return rules_by_cost(COST_EXPENSIVE)
+
+
+def get_deferred_executor() -> ThreadPoolExecutor:
+    """Thread pool of the local backend, re-created after a fork."""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=Config.DEFERRED_POOL_SIZE,
+                thread_name_prefix="deferred-checks",
+            )
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def defer_checks(user_id: str, transaction_id: str, reservation: Optional[dict] = None):
+    """Marks the checks of the transaction pending and queues them."""
+    job = {"user_id": user_id, "transaction_id": transaction_id, "reservation": reservation}
+    mongo.set_transaction_checks(transaction_id, CHECKS_PENDING)
+    if Config.DEFERRED_BACKEND == "stream":
+        publish("checks", user_id, x=transaction_id, r=_pack_reservation(reservation))
+    else:
+        get_deferred_executor().submit(_run_logged, job)
+    return job
+
+
+def score_transaction(user_id: str, transaction_id: str, reservation: Optional[dict] = None, rules=None) -> dict:
+    """
+    Scores a new transaction with the detectors (all of them, or those of
+    `rules`), then verifies it unless it was flagged suspicious, in which
+    case it is released from the trust window. Returns its status and flag
+    reason.
+    """
+    new_score, _ = calculate_score(user_id, transaction_id, rules)
+    if new_score:
+        update_score_mongo(user_id)
+
+    txn = mongo.get_transaction_by_id(transaction_id)
+    status = txn["status"]
+    flag_reason = txn["flag_reason"]
+
+    # suspicious txns are not counted in the trust policy limits
+    if status == "suspicious":
+        release_trust_window(reservation)
+    else:
+        mongo.verify_transaction(transaction_id)
+        status = mongo.get_transaction_by_id(transaction_id).get("status")
+    return {"status": status, "flag_reason": flag_reason}
+
+
+def queue_transaction(user_id: str, transaction_id: str, reservation: Optional[dict] = None):
+    """Stream scoring: the transaction stays pending until a scoring worker scored it."""
+    mongo.set_transaction_checks(transaction_id, CHECKS_PENDING)
+    return publish("txn", user_id, x=transaction_id, r=_pack_reservation(reservation))
+
+
+def queue_login(user_id: str):
+    """Stream scoring: re-scores the account (devices...) after a login."""
+    return publish("login", user_id)
+
+
+# compact event fields: x transaction id, r reservation "day:amount"
+
+def _pack_reservation(reservation: Optional[dict]) -> Optional[str]:
+    if not reservation:
+        return None
+    return f"{reservation['day']}:{reservation['amount']!r}"
+
+
+def _unpack_reservation(user_id: str, packed: Optional[str]) -> Optional[dict]:
+    if not packed:
+        return None
+    day, amount = packed.split(":")
+    return {"user_id": user_id, "day": int(day), "amount": float(amount)}
+
+
+@event_handler("txn")
+def handle_transaction_event(event: dict):
+    user_id, transaction_id = event["u"], event["x"]
+    txn = mongo.get_transaction_by_id(transaction_id)
+    if txn is not None and txn.get("checks") == CHECKS_DONE:
+        return  # handled already, replayed since (e.g. acknowledgement lost)
+    score_transaction(user_id, transaction_id, _unpack_reservation(user_id, event.get("r")))
+    mongo.set_transaction_checks(transaction_id, CHECKS_DONE)
+
+
+@event_handler("checks")
+def handle_checks_event(event: dict):
+    user_id = event["u"]
+    run_deferred_checks({
+        "user_id": user_id,
+        "transaction_id": event["x"],
+        "reservation": _unpack_reservation(user_id, event.get("r")),
+    })
+
+
+@event_handler("login")
+def handle_login_event(event: dict):
+    # no transaction: the account detectors only
+    score, _ = calculate_score(event["u"], rules=inline_rules())
+    if score:
+        update_score_mongo(event["u"])
+
+
+def run_deferred_checks(job: dict) -> set:
+    """
+    Runs the expensive detectors of a queued transaction, applies their
+    deductions and flags the transaction if any rule triggered. Returns the
+    triggered rules.
+    """
+    user_id, transaction_id = job["user_id"], job["transaction_id"]
+    score, rules = calculate_score(user_id, transaction_id, rules=deferred_rules())
+    if score:
+        update_score_mongo(user_id)
+
+    if rules:
+        reason = f"Flagged by deferred checks: {', '.join(sorted(rules))}"
+        previous = mongo.flag_transaction(transaction_id, reason)
+        if previous is not None:
+            # no longer counted in the trust policy limits
+            release_trust_window(job.get("reservation"))
+            logger.info("Transaction %s flagged after being %s: %s", transaction_id, previous, reason)
+
+    mongo.set_transaction_checks(transaction_id, CHECKS_DONE, rules)
+    return rules
+
+
+def _run_logged(job: dict):
+    try:
+        return run_deferred_checks(job)
+    except Exception:
+        logger.exception("Deferred checks of transaction %s failed", job["transaction_id"])
+        mongo.set_transaction_checks(job["transaction_id"], CHECKS_FAILED)
@@ -0,0 +1,128 @@
+"""
+Registry of the suspicious activity detectors and of the inputs they share.
+
+A detector declares the rule it reports, its cost class and the inputs it
+needs, and is called with those inputs as positional arguments:
+
+    @detector("new_account", requires=("account_features",))
+    def is_new_account(features): ...
+
+Inputs are loaded at most once per transaction by their registered loader,
+called with the DetectionContext, whichever detectors need them. The
+`user_id` and `transaction_id` inputs are always available.
+"""
+from typing import Callable, Optional
+from app.utils.metrics import DETECTOR_HITS, DETECTOR_INPUT_LATENCY, DETECTOR_LATENCY
+import threading
+import time
+
+
+# evaluated over the shared inputs, grouped with the other cheap detectors
+# needing the same inputs
+COST_CHEAP = "cheap"
+# runs its own queries (graph traversals), scheduled on its own
+COST_EXPENSIVE = "expensive"
+
+
+class Detector:
+    def __init__(self, rule: str, func: Callable, cost: str, requires: tuple):
+        self.rule = rule
+        self.func = func
+        self.cost = cost
+        self.requires = requires
+        self._latency = DETECTOR_LATENCY.labels(rule)
+        self._hits = DETECTOR_HITS.labels(rule)
+
+    def __call__(self, context: "DetectionContext"):
+        inputs = [context.get(name) for name in self.requires]
+        start = time.perf_counter()
+        try:
+            result = self.func(*inputs)
+        finally:
+            self._latency.observe(time.perf_counter() - start)
+        if result:
+            self._hits.inc()
+        return result
+
+    def __repr__(self):
+        return f"Detector({self.rule!r}, cost={self.cost!r}, requires={self.requires!r})"
+
+
+DETECTORS = {}
+INPUTS = {}
+_INPUT_LATENCIES = {}
+
+
+def _input_latency(name: str):
+    latency = _INPUT_LATENCIES.get(name)
+    if latency is None:
+        latency = _INPUT_LATENCIES[name] = DETECTOR_INPUT_LATENCY.labels(name)
+    return latency
+
+
+def detector(rule: str, cost: str = COST_CHEAP, requires: tuple = ()):
+    """Registers the decorated function as the detector of `rule`."""
+    if cost not in (COST_CHEAP, COST_EXPENSIVE):
+        raise ValueError(f"Unknown detector cost class: {cost}")
+
+    def register(func):
+        DETECTORS[rule] = Detector(rule, func, cost, tuple(requires))
+        return func
+    return register
+
+
+def detector_input(name: str):
+    """Registers the decorated function as the loader of the `name` input."""
+    def register(func):
+        INPUTS[name] = func
+        return func
+    return register
+
+
+class DetectionContext:
+    """Inputs of the detectors of one transaction, each loaded once."""
+
+    def __init__(self, user_id, transaction_id=None):
+        self.user_id = user_id
+        self.transaction_id = transaction_id
+        self._inputs = {"user_id": user_id, "transaction_id": transaction_id}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str):
+        if name in self._inputs:
+            return self._inputs[name]
+        with self._lock:
+            lock = self._locks.setdefault(name, threading.Lock())
+        # detectors running concurrently wait for the first load
+        with lock:
+            if name not in self._inputs:
+                start = time.perf_counter()
+                self._inputs[name] = INPUTS[name](self)
+                _input_latency(name).observe(time.perf_counter() - start)
+            return self._inputs[name]
+
+
+def rules_by_cost(cost: str) -> set:
+    return {rule for rule, registered in DETECTORS.items() if registered.cost == cost}
+
+
+def plan_detectors(rules: Optional[set] = None) -> list:
+    """
+    Groups the registered detectors (or those of `rules`) into tasks: one
+    per expensive detector, and one per set of inputs for the cheap ones,
+    which then run one after the other on the same loaded inputs.
+    Returns (name, detectors) pairs.
+    """
+    cheap = {}
+    tasks = []
+    for rule, registered in DETECTORS.items():
+        if rules is not None and rule not in rules:
+            continue
+        if registered.cost == COST_EXPENSIVE:
+            tasks.append((rule, [registered]))
+        else:
+            cheap.setdefault(registered.requires, []).append(registered)
+    for detectors in cheap.values():
+        tasks.append(("+".join(d.rule for d in detectors), detectors))
+    return tasks
@@ -0,0 +1,245 @@
+"""
+Bulk import of users, device logs and transactions from JSONL or CSV files,
+written to the three stores in chunks: insert_many in MongoDB, UNWIND
+batches in Neo4j and pipelines in Redis.
+"""
+from datetime import datetime
+from itertools import islice
+from typing import Callable, Optional
+from pydantic import ValidationError
+from app.models.mongo_indexes import ensure_indexes
+from app.models.mongo_model import (
+    MongoUserModel,
+    MongoTransactionModel,
+    DeviceLogModel,
+    MonthlySpendModel,
+    User,
+    ImportedTransaction,
+    ImportedDeviceLog,
+    TransactionStatus,
+    advance_ids,
+)
+from app.models.neo4j_model import Neo4jUserModel, UserSchema, TransactionSchema
+from app.utils.security import hash_password
+from .neo4j_service import Neo4jService
+from .redis_service import RedisTrustScoreService
+from .trust_service import invalidate_trust_windows
+import csv
+import hashlib
+import json
+import logging
+import os
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+def read_records(path: str):
+    """
+    Streams the records of a JSONL file (one object per line) or of a CSV
+    file with a header, where dotted columns (`sender.user_email`) are
+    nested and empty cells are left out.
+    """
+    if path.endswith(".csv"):
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                yield _unflatten(row)
+    else:
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _unflatten(row: dict) -> dict:
+    record = {}
+    for key, value in row.items():
+        if value is None or value == "":
+            continue
+        *parents, name = key.split(".")
+        target = record
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[name] = value
+    return record
+
+
+def import_key(record: dict) -> str:
+    """Deterministic key of a source record, the hash of its canonical JSON."""
+    return hashlib.sha1(json.dumps(record, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _chunks(records, size: int):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_users(users: list[User]) -> int:
+    for user in users:
+        user.password = hash_password(user.password)
+    inserted = MongoUserModel().create_many(users)  # duplicate emails are skipped
+    # the ids reserved next must not collide with the imported ones, also
+    # on a replay where they were all inserted already
+    advance_ids("user_id", [user.user_id for user in users])
+    if inserted:
+        Neo4jUserModel().create_many([
+            UserSchema(user_id=user.user_id, fname=user.fname, lname=user.lname, score=user.score)
+            for user in inserted
+        ])
+        RedisTrustScoreService().set_scores({user.user_id: user.score for user in inserted})
+    return len(inserted)
+
+
+def import_device_logs(device_logs: list[ImportedDeviceLog]) -> int:
+    return len(DeviceLogModel().create_many(device_logs))
+
+
+def import_transactions(txns: list[ImportedTransaction]) -> int:
+    # resolve the users given by email, like the transactions endpoint
+    emails = {
+        info.user_email
+        for txn in txns
+        for info in (txn.sender, txn.recipient)
+        if not info.user_id
+    }
+    user_ids = {}
+    if emails:
+        users = MongoUserModel().collection.find({"email": {"$in": list(emails)}}, {"email": 1, "user_id": 1})
+        user_ids = {user["email"]: user["user_id"] for user in users}
+    resolved = []
+    for txn in txns:
+        for info in (txn.sender, txn.recipient):
+            info.user_id = info.user_id or user_ids.get(info.user_email)
+        if txn.sender.user_id and txn.recipient.user_id:
+            resolved.append(txn)
+        else:
+            logger.warning("Skipping transaction %s: sender or recipient not found", txn.transaction_id)
+
+    # identical records are imported once, and a replayed record without
+    # transaction_id gets the id it was inserted with: rejected by the unique
+    # indexes, and merged into its Neo4j node
+    unique = {}
+    for txn in resolved:
+        unique.setdefault(txn.import_key, txn)
+    resolved = list(unique.values())
+    model = MongoTransactionModel()
+    inserted_ids = model.ids_by_import_key([txn.import_key for txn in resolved if not txn.transaction_id])
+    for txn in resolved:
+        txn.transaction_id = txn.transaction_id or inserted_ids.get(txn.import_key)
+
+    inserted = model.create_many(resolved)
+    advance_ids("transaction_id", [txn.transaction_id for txn in resolved])
+
+    # MERGE is idempotent: a replayed chunk completes the graph of the
+    # transactions already inserted in MongoDB
+    Neo4jService().record_transactions([
+        dict(
+            TransactionSchema(
+                transaction_id=txn.transaction_id,
+                amount=txn.amount,
+                status=txn.status,
+                timestamp=txn.timestamp.isoformat(),
+            ).dict(),
+            sender_id=txn.sender.user_id,
+            receiver_id=txn.recipient.user_id,
+        )
+        for txn in resolved
+    ])
+
+    # keep the rollups of the verified spending and the trust windows consistent
+    totals = {}
+    for txn in inserted:
+        if txn.status == TransactionStatus.VERIFIED:
+            key = (txn.sender.user_id, txn.timestamp.year, txn.timestamp.month)
+            amount, count = totals.get(key, (0.0, 0))
+            totals[key] = (amount + txn.amount, count + 1)
+    MonthlySpendModel().increment_many(totals)
+    invalidate_trust_windows([user_id for user_id, _, _ in totals])
+    return len(inserted)
+
+
+# kind: (model, writer, collections to index before importing)
+IMPORTERS = {
+    "users": (User, import_users, ["users"]),
+    "devices": (ImportedDeviceLog, import_device_logs, ["device_logs", "device_users"]),
+    "transactions": (ImportedTransaction, import_transactions, ["users", "transactions", "monthly_spend"]),
+}
+
+
+def _read_checkpoint(path: str) -> int:
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return json.load(f)["records"]
+
+
+def _write_checkpoint(path: str, records: int):
+    # written then renamed, so that a crash never leaves a truncated file
+    with open(path + ".tmp", "w") as f:
+        json.dump({"records": records, "updated_at": datetime.now().isoformat()}, f)
+    os.replace(path + ".tmp", path)
+
+
+def run_import(
+    kind: str,
+    path: str,
+    chunk_size: int = 5000,
+    checkpoint: Optional[str] = None,
+    restart: bool = False,
+    progress: Optional[Callable[[dict], None]] = None,
+):
+    """
+    Imports the records of `path` in chunks of `chunk_size`, validated with
+    the pydantic models; invalid records are logged and skipped.
+
+    The number of records processed is saved to `checkpoint` (default
+    `<path>.checkpoint`) after each chunk, and a new run resumes after them
+    unless `restart` is set. A chunk interrupted midway is replayed: the
+    records already inserted are rejected by the unique indexes and not
+    counted twice. Users are keyed by their ids and emails, device logs and
+    transactions by their `import_key`, the hash of the source record, so
+    identical records of a file are imported once. The id counters are moved
+    past the numeric user_id and transaction_id imported, so that the users
+    and transactions created next do not reuse them. The checkpoint is
+    removed once the import completes.
+    """
+    model, writer, collections = IMPORTERS[kind]
+    keyed = "import_key" in model.__fields__
+    checkpoint = checkpoint or path + ".checkpoint"
+    if restart and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    skip = _read_checkpoint(checkpoint)
+
+    ensure_indexes(collections)
+
+    stats = {"records": skip, "imported": 0, "invalid": 0, "skipped": skip, "seconds": 0.0, "per_second": 0.0}
+    start = time.perf_counter()
+    records = islice(read_records(path), skip, None)
+    for chunk in _chunks(records, chunk_size):
+        valid = []
+        for i, record in enumerate(chunk, stats["records"] + 1):
+            try:
+                valid.append(model(**dict(record, import_key=import_key(record))) if keyed else model(**record))
+            except ValidationError as e:
+                stats["invalid"] += 1
+                logger.warning("Invalid %s record #%d: %s", kind, i, e.errors())
+        stats["imported"] += writer(valid)
+        stats["records"] += len(chunk)
+        _write_checkpoint(checkpoint, stats["records"])
+
+        stats["seconds"] = time.perf_counter() - start
+        stats["per_second"] = (stats["records"] - skip) / stats["seconds"] if stats["seconds"] else 0.0
+        if progress:
+            progress(stats)
+
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    stats["seconds"] = time.perf_counter() - start
+    return stats
@@ -1,10 +1,15 @@
-from app.models.mongo_model import MongoUserModel, MongoTransactionModel, DeviceLogModel, User, Transaction, DeviceLog, TransactionStatus
+from datetime import datetime, timedelta
+from app.models.mongo_indexes import ensure_indexes
+from app.db.backend import MongoUserModel, MongoTransactionModel, DeviceLogModel, DeviceUsersModel, MonthlySpendModel
+from app.models.mongo_model import User, Transaction, DeviceLog, TransactionStatus
 
 class MongoService:
     def __init__(self):
         self.user_model = MongoUserModel()
         self.transaction_model = MongoTransactionModel()
         self.device_log_model = DeviceLogModel()
+        self.monthly_spend_model = MonthlySpendModel()
+        self.device_users_model = DeviceUsersModel()
     
     # User
     def create_user(self, user: User):
@@ -32,19 +37,147 @@ class MongoService:
         return list({doc["user_id"] for doc in res})
 
     
+    def get_detection_features(self, user_id):
+        """
+        Extracts in a single round trip everything the Mongo-backed detectors
+        need for one sender. Starting from the user document, $lookup stages
+        fetch the sender's monthly_spend rollups, count the sender's
+        transactions (capped at 3, as only new accounts need it) and read the
+        sender's devices with their number of distinct users from device_users.
+        """
+        pipeline = self.detection_features_pipeline(user_id)
+        res = list(self.user_model.collection.aggregate(pipeline))
+
+        features = {
+            "user_id": user_id,
+            "new_user": None,
+            "monthly_spending": {},
+            "txn_count": 0,
+            "devices": {},
+        }
+        if not res:
+            return features
+
+        doc = res[0]
+        features["new_user"] = doc.get("new_user", True)
+
+        for month in doc["monthly_spending"]:
+            features["monthly_spending"][(month["year"], month["month"])] = month["total_spent"]
+        if doc["txn_count"]:
+            features["txn_count"] = doc["txn_count"][0]["count"]
+
+        features["devices"] = {d["device_id"]: d["user_count"] for d in doc["devices"]}
+        return features
+
+    def detection_features_pipeline(self, user_id):
+        """The aggregation of get_detection_features, on the users collection."""
+        return [
+            {"$match": {"user_id": user_id}},
+            {"$project": {"_id": 0, "user_id": 1, "new_user": 1}},
+            {"$lookup": {
+                "from": self.monthly_spend_model.collection.name,
+                "localField": "user_id",
+                "foreignField": "user_id",
+                "as": "monthly_spending"
+            }},
+            {"$lookup": {
+                "from": self.transaction_model.collection.name,
+                "let": {"user_id": "$user_id"},
+                "pipeline": [
+                    {"$match": {"$expr": {"$eq": ["$sender.user_id", "$$user_id"]}}},
+                    {"$limit": 3},
+                    {"$count": "count"}
+                ],
+                "as": "txn_count"
+            }},
+            # the plain localField/foreignField form: combined with a pipeline
+            # it needs MongoDB 5.0, and the $expr form would not use the index
+            {"$lookup": {
+                "from": self.device_users_model.collection.name,
+                "localField": "user_id",
+                "foreignField": "user_ids",
+                "as": "devices"
+            }},
+            {"$project": {
+                "new_user": 1,
+                # a month whose verified transactions were all flagged is empty
+                "monthly_spending": {"$filter": {
+                    "input": "$monthly_spending",
+                    "as": "month",
+                    "cond": {"$gt": ["$$month.txn_count", 0]}
+                }},
+                "txn_count": 1,
+                "devices": {"$map": {
+                    "input": "$devices",
+                    "as": "device",
+                    "in": {"device_id": "$$device._id", "user_count": "$$device.user_count"}
+                }}
+            }}
+        ]
+
+    def mark_user_not_new(self, user_id):
+        result = self.user_model.collection.update_one(
+            {"user_id": user_id},
+            {"$set": {"new_user": False}}
+        )
+        self.user_model.invalidate(user_id)
+        return result.modified_count == 1
+
     def get_score(self, user_id):
         user = self.user_model.read(user_id)
         if user:
             return user["score"]
         return None
     
+    def get_scores(self, user_ids=(), emails=()):
+        """
+        Scores of many users in one query, by user_id and/or email.
+        Returns the {user_id, email, score} documents found.
+        """
+        query = self.scores_query(user_ids, emails)
+        if query is None:
+            return []
+        return list(self.user_model.collection.find(
+            query,
+            {"_id": 0, "user_id": 1, "email": 1, "score": 1}
+        ))
+
+    @staticmethod
+    def scores_query(user_ids=(), emails=()):
+        """The users filter of get_scores, None when there is nothing to look up."""
+        clauses = []
+        if user_ids:
+            clauses.append({"user_id": {"$in": list(user_ids)}})
+        if emails:
+            clauses.append({"email": {"$in": list(emails)}})
+        return {"$or": clauses} if clauses else None
+
     def update_score(self, user_id, score=100):
-        user = self.user_model.read(user_id)
-        if user:
-            user["score"] = score
-            user_obj = User(**user)
-            return self.user_model.update(user_id, user_obj)
-        return None
+        from pymongo import ReturnDocument
+
+        # only the score field, the rest of the user document is untouched
+        user = self.user_model.collection.find_one_and_update(
+            {"user_id": user_id},
+            {"$set": {"score": score}},
+            projection=self.user_model.PROJECTION,
+            return_document=ReturnDocument.AFTER
+        )
+        self.user_model.invalidate(user_id)
+        return user
+
+    def update_scores(self, scores: dict):
+        """Persists {user_id: score} with one unordered bulk write."""
+        from pymongo import UpdateOne
+
+        if not scores:
+            return 0
+        result = self.user_model.collection.bulk_write([
+            UpdateOne({"user_id": user_id}, {"$set": {"score": score}})
+            for user_id, score in scores.items()
+        ], ordered=False)
+        for user_id in scores:
+            self.user_model.invalidate(user_id)
+        return result.matched_count
     
     # Transactions
     def create_transaction(self, txn: Transaction):
@@ -60,12 +193,177 @@ class MongoService:
         return list(self.transaction_model.collection.find({"recipient.user_id": user_id}))
 
     def verify_transaction(self, transaction_id):
-        result = self.transaction_model.collection.update_one(
+        """
+        Flips the transaction to verified and adds its amount to the sender's
+        monthly_spend rollup. The status filter makes the flip happen once, so
+        the rollup is incremented exactly once per verified transaction.
+
+        The flip marks the transaction `spend_pending` until the rollup is
+        incremented: if the process dies in between, reconcile_monthly_spend
+        repairs the rollups of the sender.
+        """
+        pending = datetime.now()
+        txn = self.transaction_model.collection.find_one_and_update(
+            {"transaction_id": transaction_id, "status": {"$ne": TransactionStatus.VERIFIED.value}},
+            {"$set": {"status": TransactionStatus.VERIFIED.value, "spend_pending": pending}},
+            projection={"_id": 0, "sender.user_id": 1, "amount": 1, "timestamp": 1}
+        )
+        self.transaction_model.invalidate(transaction_id)
+        if not txn:
+            return False
+
+        timestamp = txn["timestamp"]
+        self.monthly_spend_model.increment(
+            txn["sender"]["user_id"], timestamp.year, timestamp.month, txn["amount"]
+        )
+        self._clear_spend_pending([(transaction_id, pending)])
+        return True
+
+    def flag_transaction(self, transaction_id, reason):
+        """
+        Flips the transaction to suspicious after the fact (deferred checks).
+        A verified transaction leaves the sender's monthly_spend rollup.
+        Returns the previous status, or None if it was already suspicious.
+        """
+        pending = datetime.now()
+        txn = self.transaction_model.collection.find_one_and_update(
+            {"transaction_id": transaction_id, "status": {"$ne": TransactionStatus.SUSPICIOUS.value}},
+            {"$set": {"status": TransactionStatus.SUSPICIOUS.value, "flag_reason": reason, "spend_pending": pending}},
+            projection={"_id": 0, "status": 1, "sender.user_id": 1, "amount": 1, "timestamp": 1}
+        )
+        self.transaction_model.invalidate(transaction_id)
+        if not txn:
+            return None
+
+        if txn["status"] == TransactionStatus.VERIFIED.value:
+            timestamp = txn["timestamp"]
+            self.monthly_spend_model.increment(
+                txn["sender"]["user_id"], timestamp.year, timestamp.month, -txn["amount"], count=-1
+            )
+        self._clear_spend_pending([(transaction_id, pending)])
+        return txn["status"]
+
+    def _clear_spend_pending(self, markers):
+        """Unsets the (transaction_id, spend_pending) markers, unless set again since."""
+        from pymongo import UpdateOne
+
+        self.transaction_model.collection.bulk_write([
+            UpdateOne({"transaction_id": transaction_id, "spend_pending": pending}, {"$unset": {"spend_pending": ""}})
+            for transaction_id, pending in markers
+        ], ordered=False)
+
+    def reconcile_monthly_spend(self, older_than_seconds=60):
+        """
+        Repairs the rollups left behind by a verification or a flag that
+        changed the status of a transaction but died before updating the
+        rollup: the rollups of the senders of the transactions still marked
+        `spend_pending` after `older_than_seconds` are rebuilt from their
+        history. Meant to be run periodically; returns the users repaired.
+        """
+        cutoff = datetime.now() - timedelta(seconds=older_than_seconds)
+        pending = list(self.transaction_model.collection.find(
+            {"spend_pending": {"$lte": cutoff}},
+            {"_id": 0, "transaction_id": 1, "sender.user_id": 1, "spend_pending": 1}
+        ))
+        users = {txn["sender"]["user_id"] for txn in pending}
+        for user_id in users:
+            self.rebuild_monthly_spend(user_id)
+        if pending:
+            self._clear_spend_pending([(txn["transaction_id"], txn["spend_pending"]) for txn in pending])
+        return len(users)
+
+    def set_transaction_checks(self, transaction_id, checks, rules=None):
+        """Records the state of the deferred checks of a transaction."""
+        update = {"checks": checks}
+        if rules is not None:
+            update["checks_rules"] = sorted(rules)
+        self.transaction_model.collection.update_one(
             {"transaction_id": transaction_id},
-            {"$set": {"status": TransactionStatus.VERIFIED.value}}
+            {"$set": update}
         )
-        return result.modified_count == 1
+        self.transaction_model.invalidate(transaction_id)
+
+    def rebuild_monthly_spend(self, user_id=None):
+        """
+        Rebuilds the monthly_spend rollups (of one user or of everyone) from
+        the verified transactions history, server side with $merge. Meant to
+        be run once before relying on the rollups, or to repair them; rollups
+        incremented by transactions verified while it runs may be overwritten.
+        """
+        match = {"status": TransactionStatus.VERIFIED.value}
+        if user_id:
+            match["sender.user_id"] = user_id
+
+        rollups = self.monthly_spend_model.collection
+        ensure_indexes([rollups.name])  # $merge needs the unique (user_id, year, month) index
+        rollups.delete_many({"user_id": user_id} if user_id else {})
+
+        pipeline = [
+            {"$match": match},
+            {"$group": {
+                "_id": {
+                    "user_id": "$sender.user_id",
+                    "year": {"$year": "$timestamp"},
+                    "month": {"$month": "$timestamp"}
+                },
+                "total_spent": {"$sum": "$amount"},
+                "txn_count": {"$sum": 1}
+            }},
+            {"$project": {
+                "_id": 0,
+                "user_id": "$_id.user_id",
+                "year": "$_id.year",
+                "month": "$_id.month",
+                "total_spent": 1,
+                "txn_count": 1
+            }},
+            {"$merge": {
+                "into": rollups.name,
+                "on": ["user_id", "year", "month"],
+                "whenMatched": "replace",
+                "whenNotMatched": "insert"
+            }}
+        ]
+        self.transaction_model.collection.aggregate(pipeline)
+        return rollups.count_documents({"user_id": user_id} if user_id else {})
     
+    def get_verified_spending_by_day(self, user_id, since, thresholds=()):
+        """
+        Groups the user's verified transactions since `since` by day, with
+        for each day the total amount, the number of transactions and, for
+        each threshold, the number of transactions >= threshold.
+        """
+        days = []
+        pipeline = self.verified_spending_by_day_pipeline(user_id, since, thresholds)
+        for doc in self.transaction_model.collection.aggregate(pipeline):
+            days.append({
+                "day": doc["_id"],
+                "amount": doc["amount"],
+                "count": doc["count"],
+                "high": {threshold: doc[f"high_{i}"] for i, threshold in enumerate(thresholds)}
+            })
+        return days
+
+    @staticmethod
+    def verified_spending_by_day_pipeline(user_id, since, thresholds=()):
+        """The aggregation of get_verified_spending_by_day, on the transactions collection."""
+        group = {
+            "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}},
+            "amount": {"$sum": "$amount"},
+            "count": {"$sum": 1}
+        }
+        for i, threshold in enumerate(thresholds):
+            group[f"high_{i}"] = {"$sum": {"$cond": [{"$gte": ["$amount", threshold]}, 1, 0]}}
+
+        return [
+            {"$match": {
+                "sender.user_id": user_id,
+                "timestamp": {"$gte": since},
+                "status": TransactionStatus.VERIFIED.value
+            }},
+            {"$group": group}
+        ]
+
     # Device Logs
     def log_device(self, device_log: DeviceLog):
         return self.device_log_model.create(device_log)
@@ -91,3 +389,29 @@ class MongoService:
         
         unique_device_ids = {doc["device_id"] for doc in res}
         return list(unique_device_ids)
+
+    def count_devices_by_user(self, user_id):
+        return self.device_users_model.count_devices(user_id)
+
+    def has_shared_device(self, user_id, max_users=5):
+        """Does any of the user's devices have more than `max_users` users?"""
+        return self.device_users_model.has_shared_device(user_id, max_users)
+
+    def rebuild_device_users(self):
+        """
+        Rebuilds the device_users cardinality index from the device_logs
+        history, server side with $merge.
+        """
+        pipeline = [
+            {"$match": {"device_id": {"$ne": None}}},
+            {"$group": {"_id": "$device_id", "user_ids": {"$addToSet": "$user_id"}}},
+            {"$set": {"user_count": {"$size": "$user_ids"}}},
+            {"$merge": {
+                "into": self.device_users_model.collection.name,
+                "on": "_id",
+                "whenMatched": "replace",
+                "whenNotMatched": "insert"
+            }}
+        ]
+        self.device_log_model.collection.aggregate(pipeline)
+        return self.device_users_model.collection.estimated_document_count()
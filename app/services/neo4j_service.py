@@ -1,9 +1,20 @@
 from app.db.neo4j import neo4j_driver
+from app.db.backend import Neo4jUserModel
 from app.models.neo4j_model import (
-    Neo4jUserModel,
     Neo4jTransactionModel,
     Neo4jDeviceModel,
+    TransactionSchema,
 )
+from .transaction_graph import get_transaction_graph
+
+
+def _query(text: str, timeout=None):
+    """The query, with a server-side transaction timeout in seconds if given."""
+    if timeout is None:
+        return text
+    from neo4j import Query
+
+    return Query(text, timeout=timeout)
 
 
 class Neo4jService:
@@ -35,7 +46,68 @@ class Neo4jService:
 
         with self.driver.session() as session:
             result = session.run(query, **tx_data)
-            return result.single()
+            record = result.single()
+
+        if record is not None:
+            self._add_to_graph([record])
+        return record
+
+    def record_transaction(self, txn: TransactionSchema, sender_id, receiver_id):
+        """
+        Creates the transaction node and its MADE/TO relationships in a
+        single write transaction. Returns the sender, txn and receiver
+        record, or None if one of the users does not exist.
+        """
+        records = self.record_transactions([
+            dict(txn.dict(), sender_id=sender_id, receiver_id=receiver_id)
+        ])
+        return records[0] if records else None
+
+    def record_transactions(self, rows):
+        """
+        Batched record_transaction: rows are TransactionSchema dicts with
+        the sender_id and receiver_id, written with one UNWIND round trip.
+        Rows whose users do not exist are skipped.
+        """
+        if not rows:
+            return []
+        with self.driver.session() as session:
+            records = session.execute_write(self._record_transactions, rows)
+        self._add_to_graph(records)
+        return records
+
+    @staticmethod
+    def _record_transactions(tx, rows):
+        query = """
+        UNWIND $rows AS row
+        MATCH (sender:User {user_id: row.sender_id})
+        MATCH (receiver:User {user_id: row.receiver_id})
+        MERGE (txn:Transaction {transaction_id: row.transaction_id})
+        ON CREATE SET txn.amount = row.amount,
+                    txn.timestamp = row.timestamp,
+                    txn.status = row.status,
+                    txn.created_at = timestamp()
+        MERGE (sender)-[:MADE]->(txn)
+        MERGE (txn)-[:TO]->(receiver)
+        RETURN sender, txn, receiver
+        """
+        return list(tx.run(query, rows=rows))
+
+    @staticmethod
+    def _add_to_graph(records):
+        graph = get_transaction_graph()
+        if graph is None:
+            return
+        for record in records:
+            graph.add_transaction(
+                record["sender"]["user_id"],
+                record["receiver"]["user_id"],
+                record["txn"]["transaction_id"],
+                record["txn"]["timestamp"],
+                record["txn"]["amount"],
+                sender_score=record["sender"]["score"],
+                receiver_score=record["receiver"]["score"],
+            )
 
     def connect_user_device(self, tx_data):
         query = """
@@ -59,7 +131,11 @@ class Neo4jService:
             result = session.run(query, **tx_data)
             return [record["txn"] for record in result]
 
-    def get_user_user_connections(self, tx_data):
+    def get_user_user_connections(self, tx_data, timeout=None):
+        graph = get_transaction_graph()
+        if graph is not None:
+            return graph.get_user_user_connections(tx_data["user_id"])
+
         query = """
         MATCH (u:User {user_id: $user_id})
         MATCH (u)-[:MADE]->(:Transaction)-[:TO]->(other:User)
@@ -72,7 +148,7 @@ class Neo4jService:
         """
 
         with self.driver.session() as session:
-            result = session.run(query, **tx_data)
+            result = session.run(_query(query, timeout), **tx_data)
             return result.data()
 
     def get_user_device_connections(self, tx_data):
@@ -85,39 +161,72 @@ class Neo4jService:
             result = session.run(query, **tx_data)
             return result.data()
 
-    def detect_circular_transaction(self, tx_data):
+    def detect_circular_transaction(self, tx_data, timeout=None):
         """
-        Detecys a circular transaction paths starting and ending at the same user,
-        alternating between User and Transaction nodes. Filters cycles whose total
-        transaction time is within $max_diff_minutes minutes to detect suspicious
-        money laundering or fraud behavior efficiently.
+        Detects a circular transaction path starting and ending at the same user,
+        alternating between User and Transaction nodes, with at most $max_depth
+        transactions whose timestamps all fit within $max_diff_minutes minutes.
+
+        When tx_data has a transaction_id (the new edge A -> T -> B), only the
+        cycles closed by that transaction are searched: paths from B back to A,
+        pruning during the expansion the transactions farther than
+        max_diff_minutes from T.
+
+        `timeout` (seconds) aborts the query on the server, so that a
+        detector giving up does not leave it running.
         """
 
+        graph = get_transaction_graph()
+        if graph is not None:
+            try:
+                return graph.detect_circular_transaction(tx_data)
+            except KeyError:
+                pass  # not in the graph: evicted, or written after the sync
+
         max_diff_minutes = tx_data.get("max_diff_minutes", 30)
-        query = """
-        MATCH path = (start:User {user_id: $user_id})-[:MADE|TO*2..20]->(start)
-        WITH path, nodes(path) AS path_nodes
-        WHERE ALL(i IN range(0, size(path_nodes) - 1)
-            WHERE (i % 2 = 0 AND "User" IN labels(path_nodes[i]))
-            OR (i % 2 = 1 AND "Transaction" IN labels(path_nodes[i]))
-        )
+        max_depth = max(1, int(tx_data.get("max_depth", 10)))
+        params = {
+            "user_id": tx_data["user_id"],
+            "max_diff_seconds": max_diff_minutes * 60,
+        }
+
+        if tx_data.get("transaction_id"):
+            params["transaction_id"] = tx_data["transaction_id"]
+            # the new transaction already accounts for 2 of the hops
+            query = """
+            MATCH (start:User {user_id: $user_id})-[:MADE]->(t:Transaction {transaction_id: $transaction_id})-[:TO]->(next:User)
+            WITH start, t, next, datetime(t.timestamp) AS t0
+            MATCH path = (next)-[:MADE|TO*0..%d]->(start)
+            WHERE ALL(n IN nodes(path) WHERE "User" IN labels(n)
+                OR ("Transaction" IN labels(n)
+                    AND abs(duration.inSeconds(t0, datetime(n.timestamp)).seconds) < $max_diff_seconds))
+            WITH [start, t] + nodes(path) AS path_nodes
+            """ % (2 * max_depth - 2)
+        else:
+            query = """
+            MATCH path = (start:User {user_id: $user_id})-[:MADE|TO*2..%d]->(start)
+            WITH nodes(path) AS path_nodes
+            WHERE ALL(i IN range(0, size(path_nodes) - 1)
+                WHERE (i %% 2 = 0 AND "User" IN labels(path_nodes[i]))
+                OR (i %% 2 = 1 AND "Transaction" IN labels(path_nodes[i]))
+            )
+            """ % (2 * max_depth)
+
+        query += """
         WITH path_nodes, [n IN path_nodes WHERE "Transaction" IN labels(n)] AS txns
+        WITH path_nodes, txns, [t IN txns | datetime(t.timestamp)] AS times
         WITH path_nodes, txns,
-            reduce(minTime = datetime("9999-12-31T23:59:59"), t IN txns | 
-                CASE WHEN t.timestamp < minTime THEN t.timestamp ELSE minTime END) AS earliest,
-            reduce(maxTime = datetime("0000-01-01T00:00:00"), t IN txns | 
-                CASE WHEN t.timestamp > maxTime THEN t.timestamp ELSE maxTime END) AS latest
-        WHERE duration.between(earliest, latest).minutes < $max_diff_minutes
+            reduce(minTime = times[0], t IN times | CASE WHEN t < minTime THEN t ELSE minTime END) AS earliest,
+            reduce(maxTime = times[0], t IN times | CASE WHEN t > maxTime THEN t ELSE maxTime END) AS latest
+        WHERE duration.inSeconds(earliest, latest).seconds < $max_diff_seconds
         RETURN 
             [n IN path_nodes | CASE WHEN "Transaction" IN labels(n) THEN n.transaction_id ELSE n.user_id END] AS path_ids,
-            duration.between(earliest, latest).minutes AS time_diff,
+            duration.inSeconds(earliest, latest).minutes AS time_diff,
             size(txns) AS num_transactions
         LIMIT 1
         """
         with self.driver.session() as session:
-            result = session.run(
-                query, user_id=tx_data["user_id"], max_diff_minutes=max_diff_minutes
-            )
+            result = session.run(_query(query, timeout), **params)
             record = result.single()
             if record:
                 return {
@@ -1,16 +1,54 @@
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
-from app.models.redis_model import RedisTrustScoreModel
+from app.db.backend import RedisTrustScoreModel
+from app.utils.config import Config
 from .suspicious_service import log_suspicious_actions
 import logging
+import math
+import os
+import random
+import threading
+import time
 
 
 logger = logging.getLogger(__name__)
 
 
+def _release(lock):
+    from redis.exceptions import LockError
+
+    try:
+        lock.release()
+    except LockError:
+        pass  # expired while loading, maybe taken by another request since
+
+
+_refresh_executor = None
+_refresh_executor_pid = None
+_refresh_executor_lock = threading.Lock()
+
+
+def get_refresh_executor() -> ThreadPoolExecutor:
+    """
+    Returns the thread pool refreshing the cached scores of this process,
+    created lazily (and re-created after a fork).
+    """
+    global _refresh_executor, _refresh_executor_pid
+    with _refresh_executor_lock:
+        if _refresh_executor is None or _refresh_executor_pid != os.getpid():
+            _refresh_executor = ThreadPoolExecutor(
+                max_workers=Config.SCORE_REFRESH_WORKERS,
+                thread_name_prefix="score-refresh",
+            )
+            _refresh_executor_pid = os.getpid()
+        return _refresh_executor
+
+
 class RedisTrustScoreService:
     def __init__(self, ttl: int = 3600):
         self.model = RedisTrustScoreModel()
         self.ttl = ttl
+        self._load_seconds = 0.01
 
     
     def get_score(self, user_id: str) -> Optional[int]:
@@ -23,11 +61,35 @@ class RedisTrustScoreService:
                 return None
         return None
 
+    def get_scores(self, user_ids: list) -> dict:
+        """Cached scores of many users with one MGET, None for the misses."""
+        if not user_ids:
+            return {}
+        scores = {}
+        for user_id, raw in zip(user_ids, self.model.get_many(user_ids)):
+            scores[user_id] = None
+            if raw is not None:
+                try:
+                    scores[user_id] = int(raw)
+                except ValueError:
+                    logger.warning(f"Failed to convert Redis trust score for user {user_id}: {raw}")
+        return scores
+
     def set_score(self, user_id: str, score: int, expire_seconds: Optional[int] = None):
         if expire_seconds is None:
             expire_seconds = self.ttl
         return self.model.set(user_id, str(score), expire_seconds)
 
+    def set_scores(self, scores: dict, expire_seconds: Optional[int] = None):
+        """
+        Caches the scores of many users missing from the cache in one
+        pipeline round trip, for the TTL get_or_load_score gives a score
+        read once. A score cached meanwhile, e.g. by a deduction, is kept.
+        """
+        if expire_seconds is None:
+            expire_seconds = self._adaptive_ttl(1) + Config.SCORE_STALE_SECONDS
+        return self.model.set_many({user_id: str(score) for user_id, score in scores.items()}, expire_seconds)
+
     def has_score(self, user_id: str) -> bool:
         return self.model.exists(user_id)
     
@@ -41,16 +103,161 @@ class RedisTrustScoreService:
     def delete_score(self, user_id: str) -> bool:
         return self.model.delete(user_id)
     
-    def get_or_load_score(self, user_id: str, loader_func: callable) -> int:
-        score = self.get_score(user_id)
-        if score is not None:
-            return score
+    @staticmethod
+    def _rules_key(user_id: str) -> str:
+        return f"score_rules:{user_id}"
+
+    DIRTY_KEY = "score_dirty"
+
+    def apply_deductions(self, user_id: str, deductions: list, loader_func: callable,
+                         mark_dirty: bool = False, operation: Optional[str] = None):
+        """
+        Applies (rule, delta, repeatable) deductions to the user's score in
+        one atomic script, recording the one-time rules in the
+        `score_rules:<user_id>` set. When the score or the rules set is
+        missing, loader_func(user_id) returns the stored (score, applied
+        rules), or None for an unknown user. With mark_dirty, the new score
+        is also marked dirty until it is persisted to MongoDB, by the score
+        flusher or update_score_mongo (see get_dirty_score). The deductions
+        of an `operation` id are applied once, a replay of the operation
+        within the TTL of the rules set applying none.
+
+        Returns (new score, rules applied for the first time), or (None, [])
+        for an unknown user.
+        """
+        args = [self.ttl, operation or ""]
+        for rule, delta, repeatable in deductions:
+            args += [rule, delta, 1 if repeatable else 0]
+
+        rules_key = self._rules_key(user_id)
+        dirty_key = self.DIRTY_KEY if mark_dirty else None
+        score, applied = self.model.deduct(user_id, rules_key, args, dirty_key)
+        if score is None:
+            state = loader_func(user_id)
+            if state is None:
+                return None, []
+            score, rules = state
+            # never overwrite a score or rules loaded (and deducted) concurrently
+            self.model.set_if_missing(user_id, str(score), self.ttl)
+            self.model.load_rules(rules_key, rules, self.ttl)
+            score, applied = self.model.deduct(user_id, rules_key, args, dirty_key)
+        return score, applied
+
+    def get_dirty_scores(self, limit: int) -> dict:
+        return self.model.get_dirty(self.DIRTY_KEY, limit)
+
+    def get_dirty_score(self, user_id: str) -> Optional[int]:
+        """Score not yet persisted to MongoDB by the flusher, if any."""
+        return self.model.get_dirty_one(self.DIRTY_KEY, user_id)
+
+    def clear_dirty_scores(self, scores: dict) -> int:
+        return self.model.clear_dirty(self.DIRTY_KEY, scores)
+
+    @staticmethod
+    def _reads_key(user_id: str) -> str:
+        return f"score_reads:{user_id}"
+
+    def _adaptive_ttl(self, reads: int) -> int:
+        """
+        Cache TTL of a score read `reads` times in the activity window:
+        SCORE_TTL_MIN for a user read once, growing linearly up to
+        SCORE_TTL_MAX for SCORE_HOT_READS reads and more.
+        """
+        low, high = Config.SCORE_TTL_MIN, Config.SCORE_TTL_MAX
+        ratio = min(1.0, max(0, reads - 1) / max(1, Config.SCORE_HOT_READS - 1))
+        return int(low + (high - low) * ratio)
+
+    def _should_refresh(self, fresh_seconds: float) -> bool:
+        # probabilistic early expiration (XFetch): the closer to expiry and
+        # the slower the load, the likelier a read refreshes the score
+        beta = Config.SCORE_REFRESH_BETA
+        if beta <= 0:
+            return False
+        return fresh_seconds <= -self._load_seconds * beta * math.log(1.0 - random.random())
+
+    def _load(self, user_id: str, loader_func: callable) -> Optional[int]:
+        start = time.perf_counter()
         score = loader_func(user_id)
-        if score is not None:
-            self.set_score(user_id, score)
-            return score
-        return 0
+        # moving average of the load time, used by the early refresh
+        self._load_seconds += 0.2 * (time.perf_counter() - start - self._load_seconds)
+        return score
 
-    
-        
-        
+    def _refresh(self, lock, user_id: str, raw: bytes, ttl_ms: int, ttl: int, loader_func: callable):
+        try:
+            score = self._load(user_id, loader_func)
+            if score is not None:
+                expire_ms = (ttl + Config.SCORE_STALE_SECONDS) * 1000
+                self.model.refresh(user_id, raw, ttl_ms, str(score), expire_ms)
+        except Exception:
+            logger.exception(f"Failed to refresh the trust score of user {user_id}")
+        finally:
+            _release(lock)
+
+    def _refresh_in_background(self, user_id: str, *args):
+        # single-flight before queuing: at most one refresh per user is queued
+        lock = self.model.lock(f"score_lock:{user_id}", Config.SCORE_LOCK_TIMEOUT)
+        if not lock.acquire(blocking=False):
+            return  # another request or process is refreshing it
+        try:
+            get_refresh_executor().submit(self._refresh, lock, user_id, *args)
+        except RuntimeError:  # shutting down
+            _release(lock)
+
+    def _load_missing(self, user_id: str, ttl: int, loader_func: callable) -> Optional[int]:
+        """Single-flight load of a missing score: one loader per user at a time."""
+        lock = self.model.lock(f"score_lock:{user_id}", Config.SCORE_LOCK_TIMEOUT)
+        if lock.acquire(blocking=False):
+            try:
+                score = self._load(user_id, loader_func)
+                if score is not None:
+                    # never overwrite a score loaded by a deduction in the meantime
+                    self.model.set_if_missing(user_id, str(score), ttl + Config.SCORE_STALE_SECONDS)
+                return score
+            finally:
+                _release(lock)
+
+        # wait for the request holding the lock to cache the score
+        deadline = time.monotonic() + Config.SCORE_LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(0.02)
+            score = self.get_score(user_id)
+            if score is not None:
+                return score
+        return self._load(user_id, loader_func)
+
+    def get_or_load_score(self, user_id: str, loader_func: callable) -> int:
+        """
+        Cached score of the user, loaded with loader_func(user_id) on a miss.
+
+        Scores are cached for an adaptive TTL (see _adaptive_ttl) plus
+        SCORE_STALE_SECONDS, during which the stale score is still served
+        while one request refreshes it in the background. Before that, reads
+        refresh it early with a probability growing towards the expiry, so
+        that a popular score is rarely missing at all. Loads are guarded by
+        a short `score_lock:<user_id>` lock: concurrent misses wait for the
+        first one instead of all querying MongoDB, and a read only queues a
+        refresh, on the SCORE_REFRESH_WORKERS threads, once it holds it.
+        loader_func has to return the dirty score while a deduction is not
+        persisted yet, or a refresh could cache the score of MongoDB from
+        before the deduction.
+        """
+        window_ms = Config.SCORE_ACTIVITY_WINDOW * 1000
+        raw, ttl_ms, reads = self.model.read(user_id, self._reads_key(user_id), window_ms)
+        ttl = self._adaptive_ttl(reads)
+
+        if raw is None:
+            score = self._load_missing(user_id, ttl, loader_func)
+            return score if score is not None else 0
+
+        try:
+            score = int(raw)
+        except ValueError:
+            logger.warning(f"Failed to convert Redis trust score for user {user_id}: {raw}")
+            score = self._load_missing(user_id, ttl, loader_func)
+            return score if score is not None else 0
+
+        if ttl_ms >= 0:  # -1: set without expiry, never refreshed
+            fresh_seconds = ttl_ms / 1000 - Config.SCORE_STALE_SECONDS
+            if fresh_seconds <= 0 or self._should_refresh(fresh_seconds):
+                self._refresh_in_background(user_id, raw, ttl_ms, ttl, loader_func)
+        return score
@@ -0,0 +1,115 @@
+from typing import Optional
+from app.utils.config import Config
+from app.db.backend import MongoService
+from .redis_service import RedisTrustScoreService
+import atexit
+import logging
+import os
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class ScoreFlusher:
+    """
+    Write-behind persistence of the trust scores: the score deduction script
+    marks the new scores dirty in the `score_dirty` Redis hash, and the
+    flusher copies them to MongoDB with one bulk write of `$set: {score}`
+    per batch.
+
+    A flush runs every `interval` seconds, or as soon as `batch_size` scores
+    were marked by this process. Entries are removed from the hash only once
+    written, and only if the score did not change in the meantime, so a
+    failed flush or a crashed worker leaves them for the next flush (of any
+    process). MongoDB lags behind Redis by at most `interval` seconds plus
+    the flush time while a worker is running.
+    """
+
+    def __init__(self, interval: float, batch_size: int):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.redis = RedisTrustScoreService()
+        self.mongo = MongoService()
+        self._marked = 0
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="score-flusher", daemon=True)
+        self._thread.start()
+        return self
+
+    def notify(self):
+        """Called after marking a score dirty, wakes the flusher on a full batch."""
+        self._marked += 1
+        if self._marked >= self.batch_size:
+            self._wake.set()
+
+    def flush(self) -> int:
+        """Persists the dirty scores, batch by batch. Returns the number written."""
+        self._marked = 0
+        flushed = 0
+        while True:
+            scores = self.redis.get_dirty_scores(self.batch_size)
+            if not scores:
+                return flushed
+            self.mongo.update_scores(scores)
+            self.redis.clear_dirty_scores(scores)
+            flushed += len(scores)
+            if len(scores) < self.batch_size:
+                return flushed
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stops the thread and flushes what is left, e.g. on shutdown."""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Final score flush failed, left for the other workers")
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopped.is_set():
+                return
+            try:
+                flushed = self.flush()
+                if flushed:
+                    logger.debug("Flushed %d scores to MongoDB", flushed)
+            except Exception:
+                logger.exception("Score flush failed, retrying in %.1fs", self.interval)
+
+
+_flusher = None
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def get_score_flusher() -> Optional[ScoreFlusher]:
+    """
+    Returns the flusher of this process, started on first use (and again in
+    a forked child), or None when write-behind is disabled.
+    """
+    global _flusher, _flusher_pid
+    if not Config.SCORE_WRITE_BEHIND:
+        return None
+    if _flusher_pid != os.getpid():
+        with _flusher_lock:
+            if _flusher_pid != os.getpid():
+                _flusher = ScoreFlusher(Config.SCORE_FLUSH_INTERVAL, Config.SCORE_FLUSH_BATCH_SIZE).start()
+                _flusher_pid = os.getpid()
+                # registered after the connection registry's, so it runs before the pools close
+                atexit.register(stop_score_flusher)
+    return _flusher
+
+
+def stop_score_flusher(timeout: float = 10.0):
+    """Flushes the pending scores of this process before it exits."""
+    if _flusher is not None and _flusher_pid == os.getpid():
+        _flusher.stop(timeout)
@@ -1,10 +1,12 @@
 from .suspicious_service import log_suspicious_actions
 from app.services.redis_service import RedisTrustScoreService
-from app.services.mongo_service import MongoService
-from app.models.mongo_model import MongoUserModel
+from app.db.backend import MongoService, MongoUserModel
 from app.utils.trust_rules import RULES
-from app.utils.trust_score import SCORE
+from app.utils.trust_score import SCORE_BANDS
+from app.utils.config import Config
+from .score_flusher import get_score_flusher
 from typing import Optional
+import zlib
 
 # get score
 # update score on redis
@@ -16,40 +18,109 @@ mongo_user = MongoUserModel()
 
 
 def get_flag_and_warning(score: int):
-    for level in SCORE:
-        if level["min"] <= score <= level["max"]:
-            return level["flag"], level["warning"]
-    return "Unknown", None
+    level = SCORE_BANDS.lookup(score)
+    if level is None:
+        return "Unknown", None
+    return level["flag"], level["warning"]
+
+def _load_score(user_id: str) -> Optional[int]:
+    # a score waiting for the write-behind flush is newer than MongoDB's
+    pending = redis.get_dirty_score(user_id)
+    return pending if pending is not None else mongo.get_score(user_id)
 
 def get_score(user_id: str) -> int:
-    score = redis.get_or_load_score(user_id, mongo.get_score)
+    score = redis.get_or_load_score(user_id, _load_score)
     return score if score is not None else 0
 
-def calculate_score(user_id: str, transaction_id=None) -> tuple[int, set[str]]:
-    suspicious_actions = log_suspicious_actions(user_id, transaction_id)
-
-    score = get_score(user_id)
-
+def get_scores(user_ids=(), emails=()) -> dict:
+    """
+    Batched get_score for user_ids and/or emails: one MGET for the cached
+    scores, one MongoDB query for the emails and the cache misses, and one
+    pipeline to cache the scores loaded from MongoDB.
+
+    Returns {user_id: {"user_id", "email", "score"}} for the users found.
+    """
+    users = {}
+    if emails:
+        # the emails have to be resolved to user ids in MongoDB anyway
+        for user in mongo.get_scores(emails=emails):
+            users[user["user_id"]] = user
+    user_ids = list(dict.fromkeys(list(user_ids) + list(users)))
+
+    cached = redis.get_scores(user_ids)
+    misses = [user_id for user_id, score in cached.items() if score is None and user_id not in users]
+    for user in mongo.get_scores(user_ids=misses):
+        users[user["user_id"]] = user
+
+    results, loaded = {}, {}
+    for user_id in user_ids:
+        user = users.get(user_id)
+        score = cached.get(user_id)
+        if score is None:
+            if user is None or user.get("score") is None:
+                continue
+            # as in _load_score, a score waiting for the flush is newer
+            pending = redis.get_dirty_score(user_id)
+            score = loaded[user_id] = pending if pending is not None else user["score"]
+        results[user_id] = {
+            "user_id": user_id,
+            "email": user["email"] if user else None,
+            "score": score,
+        }
+    if loaded:
+        redis.set_scores(loaded)
+    return results
+
+
+# only theses rules can be applied multiple time
+REPEATABLE_RULES = {"high_transaction_amount", "circular_transaction_detected"}
+
+
+def _load_score_state(user_id: str):
     user_data = mongo_user.read(user_id)
-    print(f"DEBUG: user_data for user_id={user_id}: {user_data}")
-
-    already_applied_rules = set(user_data.get("score_deductions_applied") or [])
-
-    newly_applied_rules = set()
-
-    for rule in RULES:
-        if rule not in suspicious_actions:
-            continue
-
-        # only theses rules can be applied multiple time
-        if rule == "high_transaction_amount" or rule == "circular_transaction_detected":
-            score += RULES[rule]
-        elif rule not in already_applied_rules and score > 0:
-            score += RULES[rule]
-            newly_applied_rules.add(rule)
-
-    # update score in redis
-    redis.update_score(user_id, score)
+    if not user_data:
+        return None
+    pending = redis.get_dirty_score(user_id)
+    score = pending if pending is not None else user_data["score"]
+    return score, user_data.get("score_deductions_applied") or []
+
+def _operation(transaction_id, rules) -> Optional[str]:
+    # the deductions of a transaction, by the detectors of `rules`
+    if not transaction_id:
+        return None
+    if rules is None:
+        return str(transaction_id)
+    return f"{transaction_id}:{zlib.crc32(','.join(sorted(rules)).encode()):x}"
+
+def calculate_score(user_id: str, transaction_id=None, rules=None) -> tuple[int, set[str]]:
+    """
+    Runs the detectors (all of them, or those of `rules`) and applies the
+    deductions of the triggered rules. Returns (new score, triggered rules).
+
+    The deductions of a transaction by the same detectors are applied once,
+    so that a scoring event retried or replayed after its deduction (see
+    scoring_pipeline) does not deduct the repeatable rules again.
+    """
+    suspicious_actions = log_suspicious_actions(user_id, transaction_id, rules)
+
+    deductions = [
+        (rule, delta, rule in REPEATABLE_RULES)
+        for rule, delta in RULES.items()
+        if rule in suspicious_actions
+    ]
+
+    # applied atomically in redis, concurrent transfers cannot lose a deduction.
+    # Marked dirty until persisted, also without write-behind, so that a
+    # refresh of the cache never loads the score of MongoDB from before it
+    flusher = get_score_flusher()
+    score, newly_applied_rules = redis.apply_deductions(
+        user_id, deductions, _load_score_state, mark_dirty=True,
+        operation=_operation(transaction_id, rules),
+    )
+    if score is None:
+        return 0, suspicious_actions
+    if flusher is not None:
+        flusher.notify()
 
     if newly_applied_rules:
         mongo_user.append_deductions(user_id, list(newly_applied_rules))
@@ -58,9 +129,18 @@ def calculate_score(user_id: str, transaction_id=None) -> tuple[int, set[str]]:
 
 
 def update_score_mongo(user_id: str, old_score: Optional[int] = None):
+    if Config.SCORE_WRITE_BEHIND:
+        # persisted by the score flusher
+        return None
     if old_score is None:
         old_score = mongo.get_score(user_id)
-    new_score = redis.get_score(user_id)
+    pending = redis.get_dirty_score(user_id)
+    new_score = pending if pending is not None else redis.get_score(user_id)
+    result = None
     if new_score is not None and old_score != new_score:
         mongo.update_score(user_id, new_score)
-        return "Score updated successfully in MongoDB"
+        result = "Score updated successfully in MongoDB"
+    if pending is not None:
+        # unless deducted again meanwhile, MongoDB is up to date
+        redis.clear_dirty_scores({user_id: pending})
+    return result
@@ -0,0 +1,223 @@
+"""
+Scoring event pipeline on Redis Streams (SCORING_MODE=stream, or the
+deferred checks of SCORING_MODE=tiered with DEFERRED_BACKEND=stream).
+
+The web workers publish compact events (`t` type, `u` user id, and the
+event fields) to SCORING_PARTITIONS streams `scoring:<partition>`, the
+partition being a hash of the user id. Scoring workers
+(`python -m app.cli scoring-worker`, as many processes as needed) read them
+through the `scorers` consumer group:
+
+- each partition is consumed by one worker at a time, which holds its
+  `scoring:lease:<partition>` lease, so the events of a user are processed
+  in order. The partitions are shared out evenly between the live workers
+  (`scoring:workers` heartbeats) and taken over when a worker dies;
+- an event is acknowledged once handled. A failed event is retried
+  SCORING_MAX_ATTEMPTS times with a backoff, then moved to the
+  `scoring:dead` stream, so a poison event never blocks its partition;
+- the pending (unacknowledged) events of a partition are claimed and
+  processed first by its new owner (XAUTOCLAIM, Redis >= 6.2), so none is
+  lost when a worker dies.
+
+Delivery is at least once: a handler may see an event again after a
+failure or a recovery, and has to be idempotent.
+"""
+from typing import Optional
+from app.models.redis_model import RedisStreamModel
+from app.utils.config import Config
+import logging
+import math
+import os
+import socket
+import threading
+import time
+import uuid
+import zlib
+
+
+logger = logging.getLogger(__name__)
+
+GROUP = "scorers"
+DEAD_LETTER_STREAM = "scoring:dead"
+WORKERS_KEY = "scoring:workers"
+
+streams = RedisStreamModel()
+
+# event type -> handler(event)
+HANDLERS = {}
+
+
+def event_handler(event_type: str):
+    """Registers the decorated function as the handler of `event_type` events."""
+    def register(func):
+        HANDLERS[event_type] = func
+        return func
+    return register
+
+
+def partition_of(user_id: str, partitions: Optional[int] = None) -> int:
+    return zlib.crc32(str(user_id).encode()) % (partitions or Config.SCORING_PARTITIONS)
+
+
+def stream_key(partition: int) -> str:
+    return f"scoring:{partition}"
+
+
+def lease_key(partition: int) -> str:
+    return f"scoring:lease:{partition}"
+
+
+def publish(event_type: str, user_id: str, **fields) -> str:
+    """Publishes an event to the partition of the user, None fields left out."""
+    event = {"t": event_type, "u": user_id}
+    event.update({key: value for key, value in fields.items() if value is not None})
+    return streams.add(stream_key(partition_of(user_id)), event, Config.SCORING_STREAM_MAXLEN)
+
+
+def _decode(fields: dict) -> dict:
+    return {
+        (key.decode() if isinstance(key, bytes) else key): (value.decode() if isinstance(value, bytes) else value)
+        for key, value in fields.items()
+    }
+
+
+class ScoringWorker:
+    def __init__(
+        self,
+        worker_id: Optional[str] = None,
+        handlers: Optional[dict] = None,
+        partitions: Optional[int] = None,
+        lease_seconds: Optional[float] = None,
+        max_attempts: Optional[int] = None,
+        batch_size: int = 100,
+        block_ms: int = 1000,
+    ):
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.handlers = HANDLERS if handlers is None else handlers
+        self.partitions = partitions or Config.SCORING_PARTITIONS
+        self.lease_ms = int((lease_seconds or Config.SCORING_LEASE_SECONDS) * 1000)
+        self.max_attempts = max_attempts or Config.SCORING_MAX_ATTEMPTS
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.owned = set()
+        self.stats = {"processed": 0, "retried": 0, "dead": 0}
+        self._renewed_at = 0.0
+
+    # partitions
+
+    def _rebalance(self):
+        """Renews the held leases, then takes or gives back partitions to hold a fair share."""
+        now = time.time()
+        live = streams.heartbeat(WORKERS_KEY, self.worker_id, now, now - self.lease_ms / 1000)
+        share = math.ceil(self.partitions / max(1, live))
+
+        self._renew()
+        while len(self.owned) > share:
+            partition = max(self.owned)
+            streams.release_lease(lease_key(partition), self.worker_id)
+            self.owned.discard(partition)
+
+        # start from a worker-dependent partition, so that workers starting
+        # together do not all compete for the same ones
+        offset = zlib.crc32(self.worker_id.encode())
+        for i in range(self.partitions):
+            if len(self.owned) >= share:
+                break
+            partition = (offset + i) % self.partitions
+            if partition in self.owned:
+                continue
+            if streams.acquire_lease(lease_key(partition), self.worker_id, self.lease_ms):
+                streams.ensure_group(stream_key(partition), GROUP)
+                self.owned.add(partition)
+                self._recover(partition)
+
+    def _recover(self, partition: int):
+        """Processes the events left pending by the previous owner, in order."""
+        stream = stream_key(partition)
+        start_id = "0-0"
+        while True:
+            next_id, entries = streams.claim_pending(stream, GROUP, self.worker_id, start_id, self.batch_size)
+            for entry_id, fields in entries:
+                if fields:  # None when the entry was trimmed meanwhile
+                    self._process(stream, entry_id, _decode(fields))
+                else:
+                    streams.ack(stream, GROUP, entry_id)
+            start_id = next_id.decode() if isinstance(next_id, bytes) else next_id
+            if start_id == "0-0" or not entries:
+                return
+
+    def release_all(self):
+        for partition in list(self.owned):
+            streams.release_lease(lease_key(partition), self.worker_id)
+        self.owned.clear()
+        streams.leave(WORKERS_KEY, self.worker_id)
+
+    # events
+
+    def _renew(self):
+        for partition in list(self.owned):
+            if not streams.renew_lease(lease_key(partition), self.worker_id, self.lease_ms):
+                logger.warning("Worker %s lost partition %d", self.worker_id, partition)
+                self.owned.discard(partition)
+        self._renewed_at = time.monotonic()
+
+    def _renew_due(self) -> bool:
+        return time.monotonic() - self._renewed_at >= self.lease_ms / 3000
+
+    def _process(self, stream: str, entry_id, event: dict):
+        handler = self.handlers.get(event.get("t"))
+        attempt = 0
+        while True:
+            attempt += 1
+            if self._renew_due():
+                self._renew()  # long batches or retries must not lose the leases
+            try:
+                if handler is None:
+                    raise ValueError(f"No handler for {event.get('t')!r} events")
+                handler(event)
+                self.stats["processed"] += 1
+                break
+            except Exception as e:
+                if handler is None or attempt >= self.max_attempts:
+                    logger.exception("Event %s of %s failed %d times, dead-lettered", entry_id, stream, attempt)
+                    streams.add(DEAD_LETTER_STREAM, dict(event, stream=stream, id=entry_id, error=repr(e)),
+                                Config.SCORING_STREAM_MAXLEN)
+                    self.stats["dead"] += 1
+                    break
+                self.stats["retried"] += 1
+                time.sleep(min(2.0, 0.05 * 2 ** attempt))
+        streams.ack(stream, GROUP, entry_id)
+
+    def poll(self) -> int:
+        """One round: rebalance when due, then read and handle one batch. Returns the events handled."""
+        if self._renew_due():
+            self._rebalance()
+        if not self.owned:
+            time.sleep(self.block_ms / 1000)
+            return 0
+
+        handled = 0
+        batches = streams.read(
+            {stream_key(partition): ">" for partition in self.owned},
+            GROUP, self.worker_id, self.batch_size, self.block_ms,
+        )
+        for stream, entries in batches:
+            stream = stream.decode() if isinstance(stream, bytes) else stream
+            for entry_id, fields in entries:
+                self._process(stream, entry_id, _decode(fields))
+                handled += 1
+        return handled
+
+    def run(self, stop: Optional[threading.Event] = None):
+        stop = stop or threading.Event()
+        logger.info("Scoring worker %s started", self.worker_id)
+        try:
+            while not stop.is_set():
+                try:
+                    self.poll()
+                except Exception:
+                    logger.exception("Scoring worker %s failed to poll, retrying", self.worker_id)
+                    time.sleep(1)
+        finally:
+            self.release_all()
+            logger.info("Scoring worker %s stopped: %s", self.worker_id, self.stats)
@@ -1,93 +1,127 @@
-from app.models.mongo_model import MongoUserModel, MongoTransactionModel, DeviceLogModel, User, Transaction, DeviceLog, TransactionStatus
+from app.db.backend import MongoUserModel, MongoTransactionModel, DeviceLogModel, MongoService, Neo4jService
+from app.models.mongo_model import User, Transaction, DeviceLog, TransactionStatus
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
 from app.utils.trust_rules import RULES
-
-from .neo4j_service import Neo4jService
-from .mongo_service import MongoService
+from app.utils.config import Config
+from app.utils.metrics import DETECTOR_POOL_BUSY, DETECTOR_TIMEOUTS
+
+from .detector_registry import (
+    COST_EXPENSIVE,
+    DetectionContext,
+    detector,
+    detector_input,
+    plan_detectors,
+)
+import contextvars
 import logging
+import os
+import threading
+import time
 
 
-logging.basicConfig(level=logging.DEBUG)  
 logger = logging.getLogger(__name__)
 
-# Mongo service
-def check_high_transactions_amount(user_id, transaction_id):
-    user_id = str(user_id).zfill(3)
-    txn_model = MongoTransactionModel()
-    user_model = MongoUserModel()
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_busy = 0
+
+
+def get_detector_executor() -> ThreadPoolExecutor:
+    """
+    Returns the thread pool shared by all requests of this process to run
+    detectors. It is created lazily (and re-created after a fork) so that
+    pre-forked workers never inherit a pool whose threads do not exist.
+    """
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(
+                max_workers=Config.DETECTOR_POOL_SIZE,
+                thread_name_prefix="detector",
+            )
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def detector_pool_busy() -> int:
+    """Threads of the detector pool running a task, including the ones that timed out."""
+    return _busy
+
+
+def _track_busy(delta: int):
+    global _busy
+    with _executor_lock:
+        _busy += delta
+    if Config.METRICS_ENABLED:
+        DETECTOR_POOL_BUSY.inc(delta)
+
 
-    transaction = txn_model.read(transaction_id)
-    if not transaction:
+def _is_driver_timeout(error: Exception) -> bool:
+    # pymongo.timeout() expired, or Neo4j transaction timeout
+    return getattr(error, "timeout", False) is True or "TransactionTimedOut" in (getattr(error, "code", None) or "")
+
+# Detector inputs, loaded once per transaction
+@detector_input("transaction")
+def load_transaction(context):
+    if not context.transaction_id:
+        return None
+    return MongoTransactionModel().read(context.transaction_id)
+
+@detector_input("user")
+def load_user(context):
+    return MongoUserModel().read(str(context.user_id).zfill(3))
+
+@detector_input("account_features")
+def load_account_features(context):
+    """One feature-extraction query for the Mongo-backed account detectors."""
+    mongo_service = MongoService()
+    features = mongo_service.get_detection_features(context.user_id)
+
+    # the account is no longer new once it has 3+ transactions
+    if features["new_user"] and features["txn_count"] >= 3:
+        mongo_service.mark_user_not_new(context.user_id)
+    return features
+
+
+# Mongo service
+@detector("high_txn_amount", requires=("transaction", "user"))
+def check_high_transactions_amount(transaction, user):
+    if not transaction or not user:
         return False
 
     sender_info = transaction.get("sender", {})
     sender_id = sender_info.get("user_id")
-    if sender_id != user_id:
-        return False
-
-    user = user_model.read(user_id)
-    if not user:
+    if sender_id != user["user_id"]:
         return False
 
     plafond = user.get("plafond", 1000.0)
     amount = transaction.get("amount", 0)
 
     if amount > (plafond * 2):
-        txn_model.collection.update_one(
-            {"transaction_id": transaction_id},
-            {"$set": {
-                "status": TransactionStatus.SUSPICIOUS,
-                "flag_reason": f"Amount {amount} exceeds user plafond {plafond}"
-            }}
+        MongoService().flag_transaction(
+            transaction["transaction_id"], f"Amount {amount} exceeds user plafond {plafond}"
         )
         return True
-    logger.debug("Transaction found: %s", transaction)
-    logger.debug("Sender ID in txn: %s", sender_id)
-    logger.debug("User ID passed: %s", user_id)
-    logger.debug("Amount: %s | Plafond: %s", amount, plafond)
-    logger.debug("Comparison result: %s", amount > (plafond * 2))
-
+    logger.debug("Transaction %s of user %s: amount %s within twice the plafond %s",
+                 transaction.get("transaction_id"), sender_id, amount, plafond)
     return False
 
 
-def check_suspicious_monthly_spent(user_id):
+@detector("high_monthly_spent", requires=("account_features",))
+def check_suspicious_monthly_spent(features, now=None):
     """
-    Aggregates verified transactions by month for a given user and detects
-    if the current month's spending exceeds twice the average spending of
-    previous months, indicating potentially suspicious behavior.
+    Detects if the current month's verified spending exceeds twice the
+    average spending of previous months, indicating potentially suspicious
+    behavior. `features` comes from MongoService.get_detection_features.
     """
 
-    now = datetime.now()
+    now = now or datetime.now()
     current_year = now.year
     current_month = now.month
 
-    pipeline = [
-        {
-            "$match": {
-                "sender.user_id": user_id,
-                "status": TransactionStatus.VERIFIED.value  
-            }
-        },
-        {
-            "$group": {
-                "_id": {
-                    "year": {"$year": "$timestamp"},
-                    "month": {"$month": "$timestamp"}
-                },
-                "total_spent": {"$sum": "$amount"}
-            }
-        }
-    ]
-
-    cursor = MongoTransactionModel().collection.aggregate(pipeline)
-
-    monthly_spending = {}
-    for doc in cursor:
-        # separate year and month
-        y = doc["_id"]["year"]
-        m = doc["_id"]["month"]
-        total = doc["total_spent"]
-        monthly_spending[(y, m)] = total
+    monthly_spending = features["monthly_spending"]
 
     current_spent = monthly_spending.get((current_year, current_month), 0)
     
@@ -104,56 +138,37 @@ def check_suspicious_monthly_spent(user_id):
     return current_spent > 2 * average_past
     
 
-def is_new_account(user_id):
-    txn_model = MongoTransactionModel()
-    user_model = MongoUserModel()
-    
-    user = user_model.read(user_id)
-    if not user:
+@detector("new_account", requires=("account_features",))
+def is_new_account(features):
+    if features["new_user"] is None:  # user not found
         return False 
 
-    if not user.get("new_user", True):
+    if not features["new_user"]:
         return False
-    
-    pipeline = [
-        {"$match": {"sender.user_id": user_id}},
-        {"$count": "txn_count"}
-    ]
-
-    result = list(txn_model.collection.aggregate(pipeline))
 
-    txn_count = result[0]["txn_count"] if result else 0
-
-    if txn_count >= 3:  # has 3+ transactions -> new_user = False
-        user_model.collection.update_one(
-            {"user_id": user_id},
-            {"$set": {"new_user": False}}
-        )
+    if features["txn_count"] >= 3:  # has 3+ transactions -> new_user = False
         return False
     
     return True
 
 
-def has_multiple_devices(user_id): # 1 user uses >5 devices
-    user_devices = MongoService().get_devices_by_user(user_id)
-    return len(user_devices) > 5
+@detector("has_multiple_devices", requires=("account_features",))
+def has_multiple_devices(features): # 1 user uses >5 devices
+    return len(features["devices"]) > 5
 
-def has_shared_device_count(user_id: str) -> bool:
-    user_devices = MongoService().get_devices_by_user(user_id)  # giả sử hàm này trả về list device_id
+@detector("shared_device_count", requires=("account_features",))
+def has_shared_device_count(features) -> bool: # 1 device of the user is used by >5 users
+    return any(user_count > 5 for user_count in features["devices"].values())
 
-    for device_id in user_devices:
-        device_users = MongoService().get_users_by_device(device_id)
-        if len(device_users) > 5 and user_id in device_users:
-            return True
-    return False
 
 # Neo4j serviceS
+@detector("suspicious_connections", cost=COST_EXPENSIVE, requires=("user_id",))
 def has_suspicious_connections(user_id):
     neo4j_service = Neo4jService()
     data = {
         "user_id": user_id,
     }
-    user_relations = neo4j_service.get_user_user_connections(data)
+    user_relations = neo4j_service.get_user_user_connections(data, timeout=Config.DETECTOR_TIMEOUT)
     suspicious_connections = []
     for relation in user_relations:
         if relation['score'] < 50:
@@ -162,45 +177,107 @@ def has_suspicious_connections(user_id):
         return True
     return False
 
-def has_circular_transactions(user_id):
+@detector("circular_transaction_detected", cost=COST_EXPENSIVE, requires=("user_id", "transaction_id"))
+def has_circular_transactions(user_id, transaction_id=None):
     neo4j_service = Neo4jService()
     tx_data = {
         "user_id": user_id, 
-        "max_depth": 4
+        "max_depth": 4,
+        # only search the cycles closed by the new transaction
+        "transaction_id": transaction_id
     }
-    circular_transaction = neo4j_service.detect_circular_transaction(tx_data)
+    circular_transaction = neo4j_service.detect_circular_transaction(tx_data, timeout=Config.DETECTOR_TIMEOUT)
     return circular_transaction is not None
 
 
-def log_suspicious_actions(user_id, transaction_id=None):
-    log = set()
-
-    # check suspicious transactions amount
-    if check_high_transactions_amount(user_id, transaction_id):
-        log.add('high_txn_amount')
-
-    # check suspicious monthly spending
-    if check_suspicious_monthly_spent(user_id):
-        log.add('high_monthly_spent')
+def run_detectors(detectors, timeout=None):
+    """
+    Runs the (rule, func, args) detectors concurrently on the shared pool and
+    returns the set of rules whose detector returned True. A detector may also
+    return a set of rules, which is merged as is.
+
+    Each detector gets its own `timeout` seconds, counted from the moment it
+    starts running (or from submission while it is still queued). A detector
+    that times out is logged and counted as not triggered, so the caller waits
+    for the slowest check instead of the sum of all of them. Exceptions raised
+    by a detector are propagated.
+
+    A running thread cannot be cancelled: the MongoDB operations of a
+    detector are bounded by the same timeout (pymongo.timeout), and the Neo4j
+    detectors pass it to the server as a transaction timeout, so that the
+    threads of timed out detectors return to the pool.
+    """
+    import pymongo
+
+    if timeout is None:
+        timeout = Config.DETECTOR_TIMEOUT
+
+    executor = get_detector_executor()
+    started = {}
+
+    def timed(rule, func, args):
+        started[rule] = time.monotonic()
+        _track_busy(1)
+        try:
+            with pymongo.timeout(timeout):
+                return func(*args)
+        except Exception as e:
+            if not _is_driver_timeout(e):
+                raise
+            logger.warning("Detector %s aborted by the database after %.2fs: %s", rule, timeout, e)
+            return False
+        finally:
+            _track_busy(-1)
+
+    submitted_at = time.monotonic()
+    # each detector runs in a copy of the request context, sharing its identity map
+    futures = {
+        executor.submit(contextvars.copy_context().run, timed, rule, func, args): rule
+        for rule, func, args in detectors
+    }
 
-    # check new account status
-    if is_new_account(user_id):
-        log.add('new_account')
+    log = set()
+    pending = set(futures)
+    while pending:
+        now = time.monotonic()
+        deadlines = {f: started.get(futures[f], submitted_at) + timeout for f in pending}
+        expired = {f for f, deadline in deadlines.items() if deadline <= now and not f.done()}
+        for future in expired:
+            future.cancel()
+            logger.warning("Detector %s timed out after %.2fs (%d of %d pool threads busy)",
+                           futures[future], timeout, _busy, Config.DETECTOR_POOL_SIZE)
+            DETECTOR_TIMEOUTS.labels(futures[future]).inc()
+        pending -= expired
+        if not pending:
+            break
+
+        done, pending = wait(
+            pending,
+            timeout=max(0, min(deadlines[f] for f in pending) - now),
+            return_when=FIRST_COMPLETED,
+        )
+        for future in done:
+            result = future.result()
+            if isinstance(result, set):  # detector reporting several rules
+                log |= result
+            elif result:
+                log.add(futures[future])
 
-    # check multiple devices
-    if has_multiple_devices(user_id):
-        log.add("has_multiple_devices")
+    return log
 
-    # check shared device count
-    if has_shared_device_count(user_id):
-        log.add("shared_device_count")
 
-    # check suspicious connections
-    if has_suspicious_connections(user_id):
-        log.add("suspicious_connections")
+def _run_detector_group(detectors, context):
+    return {registered.rule for registered in detectors if registered(context)}
 
-    # check circular transactions
-    if has_circular_transactions(user_id):
-        log.add("circular_transaction_detected")
 
-    return log
+def log_suspicious_actions(user_id, transaction_id=None, rules=None):
+    """
+    Runs the registered detectors (or those of `rules`) for the transaction
+    and returns the set of triggered rules. Each input is loaded once and
+    shared by the detectors needing it, see plan_detectors.
+    """
+    context = DetectionContext(user_id, transaction_id)
+    return run_detectors([
+        (name, _run_detector_group, (detectors, context))
+        for name, detectors in plan_detectors(rules)
+    ])
@@ -0,0 +1,391 @@
+from array import array
+from datetime import datetime
+from typing import Optional
+from app.db.neo4j import neo4j_driver
+from app.utils.config import Config
+import logging
+import os
+import sys
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# delay between the creation of a transaction node (its `created_at`, set by
+# the Neo4j server when the write starts) and its commit covered by the
+# syncs: the edges are read again from this long before the newest one read
+SYNC_MARGIN_SECONDS = 10
+
+EDGES_QUERY = """
+MATCH (s:User)-[:MADE]->(t:Transaction)-[:TO]->(r:User)
+%s
+RETURN s.user_id AS sender_id, r.user_id AS receiver_id,
+    s.score AS sender_score, r.score AS receiver_score,
+    t.transaction_id AS transaction_id, t.timestamp AS timestamp,
+    t.amount AS amount, t.created_at AS created_at
+ORDER BY t.timestamp
+"""
+
+
+def _to_epoch(timestamp) -> float:
+    if isinstance(timestamp, (int, float)):
+        return float(timestamp)
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    elif hasattr(timestamp, "to_native"):  # neo4j temporal types
+        timestamp = timestamp.to_native()
+    return timestamp.timestamp()
+
+
+class TransactionGraph:
+    """
+    In-process copy of the user -> user transaction edges, answering the
+    per-user graph detectors without a Neo4j scan. Neo4j stays the system
+    of record: the graph is warmed from it, then kept up to date with the
+    edges created by this process, and by the other processes through
+    sync_from_neo4j().
+
+    Edges live in a ring buffer of `max_edges` slots (parallel arrays of
+    sender, receiver, timestamp and amount); when it is full the oldest edge
+    is overwritten. Adjacency lists are arrays of edge sequence numbers, an
+    entry being valid only while its slot still holds that sequence number.
+    Stale entries are compacted away lazily, which bounds the memory to
+    O(users + max_edges).
+    """
+
+    def __init__(self, max_edges: int = 1_000_000):
+        self.max_edges = max_edges
+        self._lock = threading.RLock()
+
+        # users
+        self._index = {}
+        self._user_ids = []
+        self._scores = []
+        self._out = []
+        self._in = []
+
+        # edges ring buffer
+        self._seq = array("q", [-1]) * max_edges
+        self._src = array("i", [0]) * max_edges
+        self._dst = array("i", [0]) * max_edges
+        self._ts = array("d", [0.0]) * max_edges
+        self._amount = array("d", [0.0]) * max_edges
+        self._txn_ids = [None] * max_edges
+        self._txn_index = {}
+        self._next_seq = 0
+        self._stale = 0
+
+        self.ready = False
+        self.loaded_at = None
+        # created_at (ms, Neo4j server clock) from which the next sync reads the edges
+        self._synced_from = 0
+        self._sync_lock = threading.Lock()
+        # graph replacing this one, see retire()
+        self._successor = None
+
+    # writes
+
+    def _user(self, user_id: str, score=None) -> int:
+        i = self._index.get(user_id)
+        if i is None:
+            i = len(self._user_ids)
+            self._index[user_id] = i
+            self._user_ids.append(user_id)
+            self._scores.append(score)
+            self._out.append(array("q"))
+            self._in.append(array("q"))
+        elif score is not None:
+            self._scores[i] = score
+        return i
+
+    def add_user(self, user_id: str, score: Optional[int] = None):
+        with self._lock:
+            if self._successor is not None:
+                return self._successor.add_user(user_id, score)
+            self._user(user_id, score)
+
+    def add_transaction(self, sender_id, receiver_id, transaction_id, timestamp, amount,
+                        sender_score=None, receiver_score=None):
+        with self._lock:
+            if self._successor is not None:
+                return self._successor.add_transaction(sender_id, receiver_id, transaction_id, timestamp,
+                                                       amount, sender_score, receiver_score)
+            if transaction_id in self._txn_index:
+                return
+            src = self._user(sender_id, sender_score)
+            dst = self._user(receiver_id, receiver_score)
+
+            seq = self._next_seq
+            self._next_seq += 1
+            slot = seq % self.max_edges
+            if self._seq[slot] >= 0:  # evict the oldest edge
+                self._txn_index.pop(self._txn_ids[slot], None)
+                self._stale += 2
+
+            self._seq[slot] = seq
+            self._src[slot] = src
+            self._dst[slot] = dst
+            self._ts[slot] = _to_epoch(timestamp)
+            self._amount[slot] = amount or 0.0
+            self._txn_ids[slot] = transaction_id
+            self._txn_index[transaction_id] = seq
+            self._out[src].append(seq)
+            self._in[dst].append(seq)
+
+            if self._stale > self.max_edges:
+                self._compact()
+
+    def _valid(self, seq: int) -> bool:
+        return self._seq[seq % self.max_edges] == seq
+
+    def _compact(self):
+        for lists in (self._out, self._in):
+            for i, seqs in enumerate(lists):
+                lists[i] = array("q", (seq for seq in seqs if self._valid(seq)))
+        self._stale = 0
+
+    # reads
+
+    def _edges(self, seqs):
+        for seq in seqs:
+            if self._valid(seq):
+                yield seq % self.max_edges
+
+    def get_user_user_connections(self, user_id: str):
+        """Same result as Neo4jService.get_user_user_connections."""
+        with self._lock:
+            i = self._index.get(user_id)
+            if i is None:
+                return []
+            others = {self._dst[slot] for slot in self._edges(self._out[i])}
+            others |= {self._src[slot] for slot in self._edges(self._in[i])}
+            return [
+                {"receiver_id": self._user_ids[o], "score": self._scores[o]}
+                for o in others
+            ]
+
+    def detect_circular_transaction(self, tx_data):
+        """
+        Same search as Neo4jService.detect_circular_transaction. Raises
+        KeyError when the given user or transaction is not in the graph (yet).
+        """
+        max_diff = tx_data.get("max_diff_minutes", 30) * 60
+        max_depth = max(1, int(tx_data.get("max_depth", 10)))
+
+        with self._lock:
+            start = self._index[tx_data["user_id"]]
+
+            transaction_id = tx_data.get("transaction_id")
+            if transaction_id:
+                seq = self._txn_index[transaction_id]
+                slot = seq % self.max_edges
+                if self._src[slot] != start:
+                    return None
+                path = self._search(self._dst[slot], start, [slot], max_depth, max_diff,
+                                    anchor=self._ts[slot])
+            else:
+                path = self._search(start, start, [], max_depth, max_diff)
+
+            if path is None:
+                return None
+
+            times = [self._ts[slot] for slot in path]
+            path_ids = [self._user_ids[start]]
+            for slot in path:
+                path_ids += [self._txn_ids[slot], self._user_ids[self._dst[slot]]]
+            return {
+                "path_ids": path_ids,
+                "time_diff": int((max(times) - min(times)) // 60),
+                "num_transactions": len(path),
+            }
+
+    def _search(self, node, target, path, max_depth, max_diff, anchor=None):
+        """
+        Depth-first search of a path of edges from `node` to `target`
+        extending `path`, with at most `max_depth` edges in total and all the
+        edge timestamps within `max_diff` seconds of each other (and of
+        `anchor`), pruning as soon as the window is exceeded.
+        """
+        if path and node == target:
+            return list(path)
+        if len(path) >= max_depth:
+            return None
+
+        times = [self._ts[slot] for slot in path]
+        for slot in self._edges(self._out[node]):
+            if slot in path:
+                continue
+            ts = self._ts[slot]
+            if anchor is not None and abs(ts - anchor) >= max_diff:
+                continue
+            if times and max(times + [ts]) - min(times + [ts]) >= max_diff:
+                continue
+            path.append(slot)
+            found = self._search(self._dst[slot], target, path, max_depth, max_diff, anchor)
+            path.pop()
+            if found is not None:
+                return found
+        return None
+
+    # loading
+
+    def _add_records(self, records) -> Optional[int]:
+        """Adds the edges of `records`, returns their newest created_at (ms) if any."""
+        newest = None
+        for record in records:
+            created_at = record.get("created_at")
+            if created_at is not None and (newest is None or created_at > newest):
+                newest = created_at
+            self.add_transaction(
+                record["sender_id"],
+                record["receiver_id"],
+                record["transaction_id"],
+                record["timestamp"],
+                record["amount"],
+                sender_score=record["sender_score"],
+                receiver_score=record["receiver_score"],
+            )
+        return newest
+
+    def load_from_neo4j(self, driver=None):
+        """Loads every user and user -> transaction -> user edge from Neo4j."""
+        driver = driver or neo4j_driver
+        with driver.session() as session:
+            # server clock, the one of the created_at of the nodes
+            now = session.run("RETURN timestamp() AS now").single()["now"]
+            synced_from = now - SYNC_MARGIN_SECONDS * 1000
+            for record in session.run("MATCH (u:User) RETURN u.user_id AS user_id, u.score AS score"):
+                self.add_user(record["user_id"], record["score"])
+
+            # oldest first, so that the ring buffer keeps the newest edges
+            self._add_records(session.run(EDGES_QUERY % ""))
+        self._synced_from = synced_from
+        self.ready = True
+        self.loaded_at = time.time()
+        return self
+
+    def sync_from_neo4j(self, driver=None):
+        """
+        Adds the edges written to Neo4j since the last load or sync, by any
+        process: one query on the transaction `created_at` index, returning
+        the few edges created in the last seconds, whatever their (client)
+        timestamp. The edges already known are skipped.
+        """
+        driver = driver or neo4j_driver
+        with self._sync_lock:
+            with driver.session() as session:
+                newest = self._add_records(session.run(EDGES_QUERY % "WHERE t.created_at >= $since",
+                                                       since=self._synced_from))
+            if newest is not None:
+                self._synced_from = max(self._synced_from, newest - SYNC_MARGIN_SECONDS * 1000)
+
+    def retire(self, successor: "TransactionGraph", since_seq: int):
+        """
+        Copies the edges added since `since_seq` (see stats()["next_seq"]) to
+        the `successor` loaded in the meantime, and forwards the next writes
+        to it, so that none is lost while the successor is swapped in.
+        """
+        with self._lock:
+            for seq in range(max(since_seq, self._next_seq - self.max_edges), self._next_seq):
+                if not self._valid(seq):
+                    continue
+                slot = seq % self.max_edges
+                src, dst = self._src[slot], self._dst[slot]
+                successor.add_transaction(
+                    self._user_ids[src], self._user_ids[dst], self._txn_ids[slot],
+                    self._ts[slot], self._amount[slot], self._scores[src], self._scores[dst],
+                )
+            self._successor = successor
+
+    def stats(self):
+        with self._lock:
+            arrays = (self._seq, self._src, self._dst, self._ts, self._amount, *self._out, *self._in)
+            # the ids are shared by the lists and the dicts, counted once
+            objects = sum(sys.getsizeof(o) for o in (
+                self._txn_ids, self._txn_index, self._index, self._user_ids, self._scores, self._out, self._in,
+            ))
+            objects += sum(sys.getsizeof(txn_id) + sys.getsizeof(seq) for txn_id, seq in self._txn_index.items())
+            objects += sum(sys.getsizeof(user_id) + sys.getsizeof(i) for user_id, i in self._index.items())
+            array_bytes = sum(sys.getsizeof(a) for a in arrays)
+            return {
+                "users": len(self._user_ids),
+                "edges": min(self._next_seq, self.max_edges),
+                "max_edges": self.max_edges,
+                "next_seq": self._next_seq,
+                # ring buffer and adjacency arrays
+                "array_bytes": array_bytes,
+                # ids, their lists and dicts
+                "object_bytes": objects,
+                "total_bytes": array_bytes + objects,
+                "loaded_at": self.loaded_at,
+            }
+
+
+_graph = None
+_graph_pid = None
+_graph_lock = threading.Lock()
+
+
+def rebuild_transaction_graph():
+    """
+    Builds a new graph from Neo4j and swaps it in once it is loaded. The
+    previous graph keeps answering in the meantime, and the edges it gets
+    during the load are replayed into the new one.
+    """
+    global _graph
+    previous = _graph
+    since_seq = previous.stats()["next_seq"] if previous is not None else 0
+    graph = TransactionGraph(Config.GRAPH_MAX_EDGES).load_from_neo4j()
+    if previous is not None:
+        previous.retire(graph, since_seq)
+    _graph = graph
+    logger.info("Transaction graph loaded: %s", graph.stats())
+    return graph
+
+
+def _refresh_loop():
+    while True:
+        try:
+            rebuild_transaction_graph()
+        except Exception:
+            logger.exception("Failed to load the transaction graph")
+        if Config.GRAPH_REFRESH_SECONDS <= 0:
+            return
+        time.sleep(Config.GRAPH_REFRESH_SECONDS)
+
+
+def _sync_loop():
+    while True:
+        time.sleep(Config.GRAPH_SYNC_SECONDS)
+        graph = _graph
+        if graph is None or not graph.ready:
+            continue
+        try:
+            graph.sync_from_neo4j()
+        except Exception:
+            logger.exception("Failed to sync the transaction graph")
+
+
+def get_transaction_graph() -> Optional[TransactionGraph]:
+    """
+    Returns the process graph once it is loaded, or None if the graph engine
+    is disabled or still warming up (callers then query Neo4j). The first
+    call of each process starts loading it in the background, then reloads
+    it every GRAPH_REFRESH_SECONDS. Each process holds its own copy, synced
+    with the edges of the other processes every GRAPH_SYNC_SECONDS by
+    another background thread.
+    """
+    global _graph, _graph_pid
+    if not Config.GRAPH_ENGINE:
+        return None
+    if _graph_pid != os.getpid():
+        with _graph_lock:
+            if _graph_pid != os.getpid():
+                _graph = None
+                _graph_pid = os.getpid()
+                threading.Thread(target=_refresh_loop, name="transaction-graph", daemon=True).start()
+                if Config.GRAPH_SYNC_SECONDS > 0:
+                    threading.Thread(target=_sync_loop, name="transaction-graph-sync", daemon=True).start()
+    graph = _graph
+    return graph if graph is not None and graph.ready else None
@@ -1,32 +1,164 @@
 from datetime import datetime, timedelta
-from fastapi import HTTPException
-from app.utils.trust_policies import TRUST_POLICY
-from app.utils.trust_score import SCORE
-from app.models.mongo_model import MongoTransactionModel
-from app.services.mongo_service import MongoService
+from app.utils.trust_policies import TRUST_POLICY, TRUST_POLICY_BANDS
+from app.db.backend import MongoService, RedisTrustWindowModel
 from app.services.redis_service import RedisTrustScoreService
 from app.services.score_service import get_score
-from app.models.mongo_model import TransactionStatus
+from app.utils.metrics import POLICY_DECISIONS
 from typing import Optional
-from flask import abort, jsonify
 
 
 redis = RedisTrustScoreService()
 mongo = MongoService()
 
+
+class TrustPolicyError(Exception):
+    """
+    The trust policy refuses the action: locked account, window limit
+    exceeded, or no policy for the user's score. Mapped to a 403 by the
+    routes, the services also run outside of a request (scoring workers).
+    """
+
+# results of the trust window reservation script
+WINDOW_MISSING = -1
+WINDOW_RESERVED = 0
+TOTAL_AMOUNT_EXCEEDED = 1
+HIGH_VALUE_TXNS_EXCEEDED = 2
+MONTHLY_TXNS_EXCEEDED = 3
+TXN_AMOUNT_EXCEEDED = 4
+
+# decision counted for each result (reserved or nothing to enforce: allowed)
+WINDOW_DECISIONS = {
+    TOTAL_AMOUNT_EXCEEDED: "total_amount_exceeded",
+    HIGH_VALUE_TXNS_EXCEEDED: "high_value_txns_exceeded",
+    MONTHLY_TXNS_EXCEEDED: "monthly_txns_exceeded",
+    TXN_AMOUNT_EXCEEDED: "txn_amount_exceeded",
+}
+
+WINDOW_DAYS = 90  # the total amount limit covers 3 months
+WINDOW_TTL = (WINDOW_DAYS + 1) * 24 * 3600
+HIGH_VALUE_THRESHOLDS = sorted({
+    policy["restrictions"]["threshold"]
+    for policy in TRUST_POLICY
+    if policy["restrictions"] and "threshold" in policy["restrictions"]
+})
+
+window_model = RedisTrustWindowModel()
+
+
 def get_policy_by_score(score: int): # find the limitation by score
-    for policy in TRUST_POLICY:
-        if policy["min"] <= score <= policy["max"]:
-            return policy
-    return None
+    return TRUST_POLICY_BANDS.lookup(score)
+
+
+def _window_key(user_id: str) -> str:
+    return f"trust_window:{user_id}"
+
+def _high_field(threshold) -> str:
+    return f"h{threshold:g}"
+
+def _high_fields_args() -> list:
+    args = []
+    for threshold in HIGH_VALUE_THRESHOLDS:
+        args += [_high_field(threshold), threshold]
+    return args
+
+
+def load_trust_window(user_id: str, now: datetime):
+    """
+    Rebuilds the user's rolling window in Redis from the verified
+    transactions stored in MongoDB. Used when the window key is missing.
+    """
+    since = datetime.combine((now - timedelta(days=WINDOW_DAYS)).date(), datetime.min.time())
+    fields = {}
+    for day in mongo.get_verified_spending_by_day(user_id, since, HIGH_VALUE_THRESHOLDS):
+        ordinal = datetime.strptime(day["day"], "%Y-%m-%d").toordinal()
+        fields[f"a:{ordinal}"] = day["amount"]
+        fields[f"c:{ordinal}"] = day["count"]
+        for threshold, count in day["high"].items():
+            if count:
+                fields[f"{_high_field(threshold)}:{ordinal}"] = count
+    return window_model.load(_window_key(user_id), fields, WINDOW_TTL)
+
+
+def reserve_trust_window(user_id: str, amount: float, timestamp: datetime, restrictions: Optional[dict] = None):
+    """
+    Checks the transaction against the rolling window limits of the policy
+    and records it in the window, atomically in a Redis script, so that two
+    concurrent transfers cannot both slip under a limit.
+
+    The window is bucketed by date and counts whole days: it covers today
+    and the WINDOW_DAYS days before it from midnight, so a transaction made
+    90 days ago at 6:00 still counts at 8:00 today. The monthly limits cover
+    the calendar month.
+
+    Returns the reservation to pass to release_trust_window if the
+    transaction does not end up verified, or None if nothing was recorded.
+    Raises TrustPolicyError if a limit is exceeded.
+    """
+    restrictions = restrictions or {}
+    now = datetime.now()
+    day = timestamp.date().toordinal()
+    threshold = restrictions.get("threshold")
+
+    args = [
+        (now - timedelta(days=WINDOW_DAYS)).date().toordinal(),
+        now.replace(day=1).date().toordinal(),
+        day,
+        amount,
+        WINDOW_TTL,
+        restrictions.get("total_amount_limit", -1),
+        restrictions.get("max_high_value_txns", -1),
+        _high_field(threshold) if threshold is not None else "",
+        restrictions.get("max_txns_per_month", -1),
+        restrictions.get("max_txn_amount", -1),
+    ] + _high_fields_args()
+
+    key = _window_key(user_id)
+    code, _ = window_model.reserve(key, args)
+    if code == WINDOW_MISSING:
+        if not restrictions:
+            # nothing to enforce, the window is rebuilt from MongoDB when needed
+            POLICY_DECISIONS.labels("transaction", "allowed").inc()
+            return None
+        load_trust_window(user_id, now)
+        code, _ = window_model.reserve(key, args)
+
+    POLICY_DECISIONS.labels("transaction", WINDOW_DECISIONS.get(code, "allowed")).inc()
+    if code == TOTAL_AMOUNT_EXCEEDED:
+        raise TrustPolicyError(f"Limit exceeded: Max €{restrictions['total_amount_limit']} in 3 months")
+    if code == HIGH_VALUE_TXNS_EXCEEDED:
+        raise TrustPolicyError(f"Limit exceeded: Max {restrictions['max_high_value_txns']} transactions > €{restrictions['threshold']} in 1 month")
+    if code == MONTHLY_TXNS_EXCEEDED:
+        raise TrustPolicyError(f"Limit exceeded: Max {restrictions['max_txns_per_month']} transactions per month")
+    if code == TXN_AMOUNT_EXCEEDED:
+        raise TrustPolicyError(f"Transaction too high: Max €{restrictions['max_txn_amount']} per transaction for this trust level")
+
+    if code != WINDOW_RESERVED:
+        return None
+    return {"user_id": user_id, "day": day, "amount": amount}
+
+
+def release_trust_window(reservation: Optional[dict]):
+    """Removes a reserved transaction from the window (e.g. flagged suspicious)."""
+    if not reservation:
+        return False
+    args = [reservation["day"], reservation["amount"]] + _high_fields_args()
+    return window_model.release(_window_key(reservation["user_id"]), args)
+
+
+def invalidate_trust_windows(user_ids):
+    """
+    Drops the rolling windows of the users, rebuilt from MongoDB on their
+    next transaction (e.g. after importing historical transactions).
+    """
+    return window_model.delete_many([_window_key(user_id) for user_id in set(user_ids)])
 
 
 def enforce_trust_policy(
     user_id: str,
-    mongo_model: MongoTransactionModel = None,
     amount: float = None,
     action: str = "transaction", # or login,
-    score: Optional[int] = None
+    score: Optional[int] = None,
+    timestamp: Optional[datetime] = None
 ):   
     # get score
     if score is None:
@@ -36,49 +168,19 @@ def enforce_trust_policy(
     
     policy = get_policy_by_score(score)
     if not policy:
-        raise HTTPException(500, "Unable to determine trust policy")
+        POLICY_DECISIONS.labels(action, "no_policy").inc()
+        raise TrustPolicyError("Unable to determine trust policy")
     
     restrictions = policy["restrictions"] or {}
-    now = datetime.now()
     
     if restrictions.get("locked"):
-        abort(403, description="Account is locked. Identity verification required")
+        POLICY_DECISIONS.labels(action, "locked").inc()
+        raise TrustPolicyError("Account is locked. Identity verification required")
 
     # check action, if not transaction, end 
-    if action != "transaction" or not restrictions:
-        return
-    
-    transactions = list(mongo_model.collection.find({
-        "sender.user_id": user_id,
-        "timestamp": {"$gte": now - timedelta(days=90)},
-        "status": TransactionStatus.VERIFIED.value
-    }))
-    
-    if "total_amount_limit" in restrictions:
-        print(f"txn list: {transactions}")
-        total = sum(t["amount"] for t in transactions)
-        if total + amount > restrictions["total_amount_limit"]:
-            abort(403, description=f"Limit exceeded: Max €{restrictions['total_amount_limit']} in 3 months")
-
-    if "max_high_value_txns" in restrictions:
-        start_of_month = now.replace(day=1)
-        monthly_txns = [t for t in transactions if t["timestamp"] >= start_of_month and t["amount"] >= restrictions["threshold"]]
-        if len(monthly_txns) >= restrictions["max_high_value_txns"]:
-            abort(403, description=f"Limit exceeded: Max {restrictions['max_high_value_txns']} transactions > €{restrictions['threshold']} in 1 month")
-
-    if "max_txns_per_month" in restrictions:
-        start_of_month = now.replace(day=1)
-        monthly_txns = [t for t in transactions if t["timestamp"] >= start_of_month]
-
-        if len(monthly_txns) >= restrictions["max_txns_per_month"]:
-            abort(403, description=f"Limit exceeded: Max {restrictions['max_txns_per_month']} transactions per month")
+    if action != "transaction":
+        POLICY_DECISIONS.labels(action, "allowed").inc()
+        return None
 
-        if amount > restrictions["max_txn_amount"]:
-            abort(403, description=f"Transaction too high: Max €{restrictions['max_txn_amount']} per transaction for this trust level")
-
-    return
-            
-
-    
-    
-        
\ No newline at end of file
+    # check the rolling window limits and reserve the transaction in it
+    return reserve_trust_window(user_id, amount, timestamp or datetime.now(), restrictions)
@@ -8,4 +8,92 @@ class Config:
     REDIS_URI = os.getenv('REDIS_URI', 'redis://localhost:6379/0')
     NEO4J_URI = os.getenv('NEO4J_URI', 'bolt://localhost:7687')
     NEO4J_USERNAME = os.getenv('NEO4J_USERNAME')
-    NEO4J_PASSWORD = os.getenv('NEO4J_PASSWORD')
\ No newline at end of file
+    NEO4J_PASSWORD = os.getenv('NEO4J_PASSWORD')
+
+    # "memory": in-process stand-ins of MongoDB, Redis and Neo4j (app/memory),
+    # for the offline benchmarks; nothing is persisted
+    DB_BACKEND = os.getenv('DB_BACKEND', 'live').lower()
+
+    # connection pools, per process
+    MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', 100))
+    REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 50))
+    REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT', 5.0))
+    NEO4J_MAX_POOL_SIZE = int(os.getenv('NEO4J_MAX_POOL_SIZE', 100))
+    # seconds to open a connection, for the three drivers
+    DB_CONNECT_TIMEOUT = float(os.getenv('DB_CONNECT_TIMEOUT', 5.0))
+
+    # gunicorn server, see gunicorn.conf.py
+    WEB_WORKERS = int(os.getenv('WEB_WORKERS', 2 * (os.cpu_count() or 1) + 1))
+    WEB_THREADS = int(os.getenv('WEB_THREADS', 4))
+    WEB_TIMEOUT = int(os.getenv('WEB_TIMEOUT', 30))
+    WEB_GRACEFUL_TIMEOUT = int(os.getenv('WEB_GRACEFUL_TIMEOUT', 30))
+
+    # readiness checks of /health/ready
+    HEALTH_TIMEOUT = float(os.getenv('HEALTH_TIMEOUT', 2.0))
+
+    # user and transaction ids reserved per process at once (1: one counter update per id)
+    ID_BLOCK_SIZE = int(os.getenv('ID_BLOCK_SIZE', 1000))
+
+    # users per POST /score/batch request
+    SCORE_BATCH_MAX_SIZE = int(os.getenv('SCORE_BATCH_MAX_SIZE', 500))
+
+    # score cache: TTL adapted to the reads in the activity window, stale
+    # scores served while refreshed, probabilistic early refresh (0: off)
+    SCORE_TTL_MIN = int(os.getenv('SCORE_TTL_MIN', 600))
+    SCORE_TTL_MAX = int(os.getenv('SCORE_TTL_MAX', 14400))
+    SCORE_HOT_READS = int(os.getenv('SCORE_HOT_READS', 20))
+    SCORE_ACTIVITY_WINDOW = int(os.getenv('SCORE_ACTIVITY_WINDOW', 600))
+    SCORE_STALE_SECONDS = int(os.getenv('SCORE_STALE_SECONDS', 60))
+    SCORE_REFRESH_BETA = float(os.getenv('SCORE_REFRESH_BETA', 1.0))
+    SCORE_LOCK_TIMEOUT = float(os.getenv('SCORE_LOCK_TIMEOUT', 2.0))
+    SCORE_REFRESH_WORKERS = int(os.getenv('SCORE_REFRESH_WORKERS', 4))
+
+    # write-behind persistence of the scores from Redis to MongoDB
+    SCORE_WRITE_BEHIND = os.getenv('SCORE_WRITE_BEHIND', 'false').lower() == 'true'
+    SCORE_FLUSH_INTERVAL = float(os.getenv('SCORE_FLUSH_INTERVAL', 5.0))
+    SCORE_FLUSH_BATCH_SIZE = int(os.getenv('SCORE_FLUSH_BATCH_SIZE', 500))
+
+    # suspicious detectors
+    DETECTOR_POOL_SIZE = int(os.getenv('DETECTOR_POOL_SIZE', 16))
+    DETECTOR_TIMEOUT = float(os.getenv('DETECTOR_TIMEOUT', 5.0))
+
+    # scoring of a transaction: "sync" runs every detector before responding,
+    # "tiered" runs the cheap ones inline and defers the expensive (graph)
+    # ones to a local thread pool or the scoring workers ("local" or "stream"),
+    # "stream" leaves all the scoring to the scoring workers
+    SCORING_MODE = os.getenv('SCORING_MODE', 'sync').lower()
+    DEFERRED_BACKEND = os.getenv('DEFERRED_BACKEND', 'local').lower()
+    DEFERRED_POOL_SIZE = int(os.getenv('DEFERRED_POOL_SIZE', 4))
+
+    # Redis Streams pipeline of the scoring workers
+    SCORING_PARTITIONS = int(os.getenv('SCORING_PARTITIONS', 16))
+    SCORING_LEASE_SECONDS = float(os.getenv('SCORING_LEASE_SECONDS', 10.0))
+    SCORING_MAX_ATTEMPTS = int(os.getenv('SCORING_MAX_ATTEMPTS', 5))
+    SCORING_STREAM_MAXLEN = int(os.getenv('SCORING_STREAM_MAXLEN', 100_000))
+
+    # logging, see app/utils/logs.py: root level, per logger levels
+    # (`logger=LEVEL,...`), share of the DEBUG records kept, `text` or `json`
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_LEVELS = os.getenv('LOG_LEVELS', '')
+    LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 1.0))
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+
+    # Prometheus metrics on GET /metrics, with the request and database round-trip latencies
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+
+    # spans of the database round trips of each request, round trips slower
+    # than SLOW_QUERY_MS logged (0: off), their breakdown returned in a
+    # Server-Timing response header, Neo4j queries profiled for their db hits
+    TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'true').lower() == 'true'
+    SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 500))
+    TRACE_RESPONSE_HEADER = os.getenv('TRACE_RESPONSE_HEADER', 'false').lower() == 'true'
+    NEO4J_PROFILE = os.getenv('NEO4J_PROFILE', 'false').lower() == 'true'
+
+    # create the MongoDB indexes when the app starts
+    MONGO_ENSURE_INDEXES = os.getenv('MONGO_ENSURE_INDEXES', 'true').lower() == 'true'
+
+    # in-process transaction graph for the graph detectors
+    GRAPH_ENGINE = os.getenv('GRAPH_ENGINE', 'false').lower() == 'true'
+    GRAPH_MAX_EDGES = int(os.getenv('GRAPH_MAX_EDGES', 1_000_000))
+    GRAPH_REFRESH_SECONDS = int(os.getenv('GRAPH_REFRESH_SECONDS', 3600))
+    GRAPH_SYNC_SECONDS = float(os.getenv('GRAPH_SYNC_SECONDS', 1.0))
@@ -0,0 +1,164 @@
+"""
+Logging of the app and the CLI, set up once by configure_logging():
+
+- levels: LOG_LEVEL for the root logger, and per logger in LOG_LEVELS,
+  e.g. `app.services.suspicious_service=DEBUG,app.slow_queries=WARNING`;
+- sampling: only LOG_DEBUG_SAMPLE_RATE of the DEBUG records are kept, the
+  others are dropped before being formatted;
+- non-blocking: the request threads put the records in a queue, a
+  listener thread formats and writes them to stderr;
+- format: `text` lines, or `json` objects (LOG_FORMAT), with the trace id
+  of the request (app/utils/tracing);
+- redaction: passwords and the local part of the email addresses are
+  masked in the written lines.
+"""
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+from app.utils.config import Config
+from app.utils.tracing import current_trace
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+
+
+_PASSWORD = re.compile(r"""(password['"]?\s*[:=]\s*b?)(?:(['"]).*?\2|[^\s,;&}'"]+)""", re.IGNORECASE)
+_EMAIL = re.compile(r"\b([A-Za-z0-9])[A-Za-z0-9._%+-]*@([A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)+)")
+
+
+def redact(text: str) -> str:
+    """Masks the passwords (`password: ...`, `"password": "..."`, `password=...`) and the emails."""
+    text = _PASSWORD.sub(lambda m: f"{m.group(1)}{m.group(2) or ''}***{m.group(2) or ''}", text)
+    return _EMAIL.sub(r"\1***@\2", text)
+
+
+def parse_levels(spec: str) -> dict:
+    """`logger=LEVEL,...` -> {logger: level}, the unknown levels are ignored."""
+    levels = {}
+    for item in spec.split(","):
+        name, _, level = item.partition("=")
+        level = logging.getLevelName(level.strip().upper())
+        if name.strip() and isinstance(level, int):
+            levels[name.strip()] = level
+    return levels
+
+
+class DebugSampler(logging.Filter):
+    """Keeps `rate` of the DEBUG records, and every record of a higher level."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or self.rate >= 1 or random.random() < self.rate
+
+
+class TraceContext(logging.Filter):
+    """Adds the trace id of the current request, read in the thread logging the record."""
+
+    def filter(self, record):
+        trace = current_trace()
+        record.trace_id = trace.trace_id if trace else None
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s%(trace)s: %(message)s", "%Y-%m-%d %H:%M:%S")
+
+    def format(self, record):
+        record.trace = f" [{record.trace_id}]" if getattr(record, "trace_id", None) else ""
+        return redact(super().format(record))
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        # redacted before serialization, which escapes the quotes redact() matches
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": redact(record.getMessage()),
+        }
+        if getattr(record, "trace_id", None):
+            entry["trace_id"] = record.trace_id
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = redact(record.exc_text)
+        return json.dumps(entry, default=str)
+
+
+class _LazyQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # the message is merged in the caller thread, as the arguments may
+        # change afterwards, but the line is formatted by the listener
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_handler: Optional[QueueHandler] = None
+_listener: Optional[QueueListener] = None
+_lock = threading.Lock()
+
+
+def _output_handler() -> logging.Handler:
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if Config.LOG_FORMAT == "json" else TextFormatter())
+    return handler
+
+
+def _start_listener():
+    """Starts the thread writing the records of the queue, with a new queue (after a fork)."""
+    global _listener
+    if _handler is None:
+        return
+    records = queue.SimpleQueue()
+    _handler.queue = records
+    _listener = QueueListener(records, _output_handler())
+    _listener.start()
+
+
+def stop_logging():
+    """Writes the queued records and stops the listener thread, e.g. on exit."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def configure_logging():
+    """Sets up the logging of the process from the configuration, once."""
+    global _handler
+    with _lock:
+        if _handler is not None:
+            return
+        _handler = _LazyQueueHandler(queue.SimpleQueue())
+        _handler.addFilter(DebugSampler(Config.LOG_DEBUG_SAMPLE_RATE))
+        _handler.addFilter(TraceContext())
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_handler)
+        root.setLevel(logging.getLevelName(Config.LOG_LEVEL.upper()))
+        for name, level in parse_levels(Config.LOG_LEVELS).items():
+            logging.getLogger(name).setLevel(level)
+
+        _start_listener()
+        atexit.register(stop_logging)
+        if hasattr(os, "register_at_fork"):
+            # the listener thread does not survive a fork (preloaded gunicorn workers)
+            os.register_at_fork(after_in_child=_start_listener)
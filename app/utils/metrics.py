@@ -0,0 +1,80 @@
+"""
+Prometheus metrics of the process, exposed on GET /metrics.
+
+Recording a value is a few dict lookups and additions under a lock, cheap
+enough to stay on in production. Under gunicorn, each worker process keeps
+its own values: set PROMETHEUS_MULTIPROC_DIR to an empty directory for
+/metrics to aggregate the values of all the workers.
+"""
+from prometheus_client import Counter, Gauge, Histogram
+
+
+NAMESPACE = "antiscam"
+
+# from sub-millisecond cache reads to the slowest graph traversals
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Latency of the HTTP requests, by route",
+    ["method", "route", "status"], namespace=NAMESPACE, buckets=LATENCY_BUCKETS,
+)
+
+DETECTOR_LATENCY = Histogram(
+    "detector_duration_seconds", "Latency of the suspicious detectors, without loading their inputs",
+    ["rule"], namespace=NAMESPACE, buckets=LATENCY_BUCKETS,
+)
+DETECTOR_HITS = Counter(
+    "detector_hits", "Detector runs that triggered their rule", ["rule"], namespace=NAMESPACE,
+)
+DETECTOR_INPUT_LATENCY = Histogram(
+    "detector_input_duration_seconds", "Latency of the loading of the detector inputs",
+    ["input"], namespace=NAMESPACE, buckets=LATENCY_BUCKETS,
+)
+DETECTOR_TIMEOUTS = Counter(
+    "detector_timeouts", "Detector tasks skipped after DETECTOR_TIMEOUT", ["task"], namespace=NAMESPACE,
+)
+DETECTOR_POOL_BUSY = Gauge(
+    "detector_pool_busy_threads", "Threads of the detector pool running a task, timed out ones included",
+    namespace=NAMESPACE, multiprocess_mode="livesum",
+)
+
+POLICY_DECISIONS = Counter(
+    "trust_policy_decisions", "Decisions of the trust policy, by action",
+    ["action", "decision"], namespace=NAMESPACE,
+)
+
+DATASTORE_LATENCY = Histogram(
+    "datastore_operation_duration_seconds",
+    "Latency of the database round trips: MongoDB commands, Redis commands and pipelines, Neo4j queries",
+    ["datastore", "operation"], namespace=NAMESPACE, buckets=LATENCY_BUCKETS,
+)
+DATASTORE_ERRORS = Counter(
+    "datastore_operation_errors", "Database round trips that failed", ["datastore", "operation"],
+    namespace=NAMESPACE,
+)
+
+IDENTITY_MAP_READS = Counter(
+    "identity_map_reads", "MongoDB reads of the requests, served by the identity map (hit) or queried (miss)",
+    ["result"], namespace=NAMESPACE,
+)
+
+
+def observe_datastore(datastore: str, operation: str, seconds: float, failed: bool = False):
+    DATASTORE_LATENCY.labels(datastore, operation).observe(seconds)
+    if failed:
+        DATASTORE_ERRORS.labels(datastore, operation).inc()
+
+
+def render_metrics():
+    """The exposition of the metrics of this process, or of all the workers in multiprocess mode."""
+    from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest
+    import os
+
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
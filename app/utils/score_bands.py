@@ -0,0 +1,23 @@
+class ScoreBands:
+    """
+    Score bands ({"min", "max", ...} dicts, first match wins) compiled into a
+    table indexed by the score, so that finding the band of a score is one
+    lookup instead of a scan. Scores outside every band map to None.
+    """
+
+    def __init__(self, bands: list):
+        self.bands = bands
+        self.low = min(band["min"] for band in bands)
+        high = max(band["max"] for band in bands)
+        table = [None] * (high - self.low + 1)
+        for band in reversed(bands):  # earlier bands overwrite the later ones
+            for score in range(band["min"], band["max"] + 1):
+                table[score - self.low] = band
+        self.table = tuple(table)
+
+    def lookup(self, score):
+        index = score - self.low
+        if score != int(score) or not 0 <= index < len(self.table):
+            # a fractional score falls in the gaps between the integer bands
+            return None
+        return self.table[int(index)]
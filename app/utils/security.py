@@ -0,0 +1,9 @@
+import hashlib
+
+
+def hash_password(password):
+    """Hash a password using SHA-256"""
+    return hashlib.sha256(password.encode()).hexdigest()
+
+def verify_password(stored_password_hash, provided_password):
+    return stored_password_hash == hash_password(provided_password)
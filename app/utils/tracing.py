@@ -0,0 +1,145 @@
+"""
+Request tracing: each request gets a trace id, and each database round trip
+made on its behalf (app/db/instrumentation.py) is recorded as a span of its
+trace, including those of the detector threads, which run in a copy of the
+request context.
+
+Round trips slower than SLOW_QUERY_MS are written to the `app.slow_queries`
+logger as one JSON object per line: trace id, datastore, operation,
+duration, statement and parameters (truncated), and for Neo4j the result
+summary.
+"""
+from contextvars import ContextVar
+from typing import Optional
+from app.utils.config import Config
+import json
+import logging
+import re
+import time
+import uuid
+
+
+slow_query_logger = logging.getLogger("app.slow_queries")
+
+# spans kept per trace, the others are only counted
+MAX_SPANS = 1000
+# characters kept of each statement and parameter in the slow query log
+MAX_LOGGED_LENGTH = 500
+
+_TRACE_ID = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+class Span:
+    __slots__ = ("datastore", "operation", "start", "duration", "failed", "detail")
+
+    def __init__(self, datastore: str, operation: str, start: float, duration: float, failed: bool, detail):
+        self.datastore = datastore
+        self.operation = operation
+        self.start = start
+        self.duration = duration
+        self.failed = failed
+        self.detail = detail
+
+    def to_dict(self) -> dict:
+        span = {"name": f"{self.datastore}.{self.operation}", "duration_ms": round(self.duration * 1000, 3)}
+        if self.failed:
+            span["failed"] = True
+        if self.detail:
+            span.update(self.detail)
+        return span
+
+
+class Trace:
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.start = time.perf_counter()
+        self.spans = []
+        self.dropped = 0
+
+    def add(self, span: Span):
+        # list.append is atomic, the detector threads add to the same trace
+        if len(self.spans) < MAX_SPANS:
+            self.spans.append(span)
+        else:
+            self.dropped += 1
+
+    def breakdown(self) -> dict:
+        """`datastore.operation` -> [round trips, seconds], slowest first."""
+        totals = {}
+        for span in list(self.spans):
+            total = totals.setdefault(f"{span.datastore}.{span.operation}", [0, 0.0])
+            total[0] += 1
+            total[1] += span.duration
+        return dict(sorted(totals.items(), key=lambda item: item[1][1], reverse=True))
+
+    def server_timing(self) -> str:
+        """The breakdown as a Server-Timing header value, shown by the browser developer tools."""
+        entries = [
+            f'{name};desc="{count}x";dur={seconds * 1000:.3f}'
+            for name, (count, seconds) in self.breakdown().items()
+        ]
+        entries.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.3f}")
+        return ", ".join(entries)
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+
+
+def start_trace(trace_id: Optional[str] = None):
+    """Starts the trace of a request, with the caller's trace id if valid. Returns the token to end it."""
+    if not trace_id or not _TRACE_ID.match(trace_id):
+        trace_id = uuid.uuid4().hex
+    return _current.set(Trace(trace_id))
+
+
+def end_trace(token) -> Optional[Trace]:
+    trace = _current.get()
+    _current.reset(token)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def _truncate(value) -> str:
+    text = value if isinstance(value, str) else repr(value)
+    if len(text) > MAX_LOGGED_LENGTH:
+        return text[:MAX_LOGGED_LENGTH] + f"... ({len(text)} chars)"
+    return text
+
+
+def log_slow_query(trace: Optional[Trace], span: Span, statement=None, parameters=None):
+    entry = {
+        "trace_id": trace.trace_id if trace else None,
+        "datastore": span.datastore,
+        "operation": span.operation,
+        "duration_ms": round(span.duration * 1000, 3),
+        "failed": span.failed,
+        "statement": _truncate(" ".join(statement.split()) if isinstance(statement, str) else statement),
+    }
+    if isinstance(parameters, dict):
+        entry["parameters"] = {key: _truncate(value) for key, value in parameters.items()}
+    elif parameters is not None:
+        entry["parameters"] = [_truncate(value) for value in parameters]
+    if span.detail:
+        entry.update(span.detail)
+    slow_query_logger.warning(json.dumps(entry, default=str))
+
+
+def record_span(datastore: str, operation: str, start: float, duration: float, failed: bool = False,
+                statement=None, parameters=None, detail: Optional[dict] = None):
+    """
+    Adds the span of a round trip to the current trace, if any, and logs it
+    if slower than SLOW_QUERY_MS. `statement` and `parameters` are only
+    formatted for the log.
+    """
+    trace = _current.get()
+    slow = Config.SLOW_QUERY_MS > 0 and duration * 1000 >= Config.SLOW_QUERY_MS
+    if trace is None and not slow:
+        return
+    span = Span(datastore, operation, start, duration, failed, detail)
+    if trace is not None:
+        trace.add(span)
+    if slow:
+        log_slow_query(trace, span, statement, parameters)
@@ -1,3 +1,5 @@
+from app.utils.score_bands import ScoreBands
+
 TRUST_POLICY = [
     {
         "min": 90,
@@ -42,3 +44,6 @@ TRUST_POLICY = [
         }
     }
 ]
+
+# compiled once at import, score -> band
+TRUST_POLICY_BANDS = ScoreBands(TRUST_POLICY)
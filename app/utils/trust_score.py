@@ -1,3 +1,5 @@
+from app.utils.score_bands import ScoreBands
+
 SCORE = [
     {
         "min": 90,
@@ -30,3 +32,6 @@ SCORE = [
         "warning": "Your account is locked. Identity verification required",
     }
 ]
+
+# compiled once at import, score -> band
+SCORE_BANDS = ScoreBands(SCORE)
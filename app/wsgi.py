@@ -0,0 +1,2 @@
+# WSGI entry point: gunicorn -c gunicorn.conf.py app.wsgi:app
+from app.run import app
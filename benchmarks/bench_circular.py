@@ -0,0 +1,139 @@
+"""
+Benchmark of the circular transaction detection on a synthetic dense graph.
+
+Compares the full search (every cycle through the user) with the incremental
+search (only the cycles closed by the new transaction), and the incremental
+search answered by the in-process transaction graph. Needs the Neo4j
+database of the .env file; the benchmark nodes are prefixed with `bench-`
+and deleted afterwards.
+
+    python -m benchmarks.bench_circular --users 200 --degree 8 --depth 4
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from app.db.neo4j import neo4j_driver
+from app.services.neo4j_service import Neo4jService
+from app.services.transaction_graph import TransactionGraph
+
+
+PREFIX = "bench-"
+
+
+def build_graph(users, degree, seed):
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    user_rows = [{"user_id": f"{PREFIX}u{i}"} for i in range(users)]
+    txn_rows = []
+    for i in range(users):
+        for j in range(degree):
+            receiver = rng.randrange(users)
+            txn_rows.append({
+                "transaction_id": f"{PREFIX}t{i}-{j}",
+                "sender_id": f"{PREFIX}u{i}",
+                "receiver_id": f"{PREFIX}u{receiver}",
+                "amount": 100.0,
+                # every transaction within the detection window: worst case
+                "timestamp": (now + timedelta(seconds=rng.randrange(600))).isoformat(),
+            })
+
+    with neo4j_driver.session() as session:
+        session.run(
+            "UNWIND $rows AS row MERGE (:User {user_id: row.user_id, score: 100})",
+            rows=user_rows,
+        )
+        for k in range(0, len(txn_rows), 5000):
+            session.run(
+                """
+                UNWIND $rows AS row
+                MATCH (s:User {user_id: row.sender_id})
+                MATCH (r:User {user_id: row.receiver_id})
+                MERGE (t:Transaction {transaction_id: row.transaction_id})
+                SET t.amount = row.amount, t.timestamp = row.timestamp, t.status = 'verified'
+                MERGE (s)-[:MADE]->(t)
+                MERGE (t)-[:TO]->(r)
+                """,
+                rows=txn_rows[k:k + 5000],
+            )
+    return txn_rows
+
+
+def cleanup():
+    with neo4j_driver.session() as session:
+        session.run(
+            """
+            MATCH (n)
+            WHERE n.user_id STARTS WITH $prefix OR n.transaction_id STARTS WITH $prefix
+            DETACH DELETE n
+            """,
+            prefix=PREFIX,
+        )
+
+
+def timed(func, repeat):
+    durations = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        durations.append(time.perf_counter() - start)
+    return result, durations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--degree", type=int, default=8, help="transactions sent per user")
+    parser.add_argument("--depth", type=int, default=4, help="max transactions in a cycle")
+    parser.add_argument("--samples", type=int, default=20, help="new transactions to check")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    service = Neo4jService()
+    cleanup()
+    try:
+        txn_rows = build_graph(args.users, args.degree, args.seed)
+        samples = random.Random(args.seed).sample(txn_rows, min(args.samples, len(txn_rows)))
+        graph = TransactionGraph(max_edges=len(txn_rows))
+        for row in txn_rows:
+            graph.add_transaction(row["sender_id"], row["receiver_id"], row["transaction_id"],
+                                  row["timestamp"], row["amount"])
+
+        full_times, incremental_times, graph_times = [], [], []
+        mismatches = 0
+        for row in samples:
+            tx_data = {"user_id": row["sender_id"], "max_depth": args.depth}
+            full, durations = timed(lambda: service.detect_circular_transaction(tx_data), args.repeat)
+            full_times += durations
+
+            incremental_data = dict(tx_data, transaction_id=row["transaction_id"])
+            incremental, durations = timed(lambda: service.detect_circular_transaction(incremental_data), args.repeat)
+            incremental_times += durations
+
+            in_graph, durations = timed(lambda: graph.detect_circular_transaction(incremental_data), args.repeat)
+            graph_times += durations
+
+            # a cycle closed by the new transaction is also a cycle through the user
+            if incremental is not None and full is None:
+                mismatches += 1
+            if (in_graph is None) != (incremental is None):
+                mismatches += 1
+
+        full_median = statistics.median(full_times) * 1000
+        incremental_median = statistics.median(incremental_times) * 1000
+        print(f"graph: {args.users} users, {len(txn_rows)} transactions, depth {args.depth}")
+        print(f"full search:        median {full_median:9.2f} ms  max {max(full_times) * 1000:9.2f} ms")
+        print(f"incremental search: median {incremental_median:9.2f} ms  max {max(incremental_times) * 1000:9.2f} ms")
+        graph_median = statistics.median(graph_times) * 1000
+        print(f"in-process graph:   median {graph_median:9.2f} ms  max {max(graph_times) * 1000:9.2f} ms")
+        print(f"speedup: x{full_median / incremental_median:.1f} (graph x{full_median / graph_median:.1f}), mismatches: {mismatches}")
+    finally:
+        cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+CPU cost of the endpoints and of the detectors, measured offline on the
+in-memory stand-ins of the databases (DB_BACKEND=memory, see app/memory):
+ops/s and latency percentiles of register, login and make_transaction
+(through the WSGI app, as a request), of each registered detector (with the
+loading of its inputs) and of enforce_trust_policy, for several data sizes.
+
+A data size is a number of users, each with --txns-per-user verified
+transactions over the last 90 days and one or two devices, seeded directly
+in the stand-ins before the run.
+
+Compares the ops/s with benchmarks/baselines/offline.json and exits with an
+error when one is lower than the baseline by more than --tolerance.
+
+    python -m benchmarks.bench_offline --sizes 100 1000 10000 --ops 300
+    python -m benchmarks.bench_offline --save-baseline
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "offline.json")
+PASSWORD = "bench-password"
+
+
+def _percentiles(latencies):
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {"p50_ms": cuts[49] * 1000, "p95_ms": cuts[94] * 1000, "p99_ms": cuts[98] * 1000}
+
+
+def measure(func, args_list):
+    """Calls func(*args) for each args, returns the ops/s and latency percentiles."""
+    latencies = []
+    start = time.perf_counter()
+    for args in args_list:
+        begin = time.perf_counter()
+        func(*args)
+        latencies.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - start
+    return dict(ops_per_s=len(latencies) / elapsed, **_percentiles(latencies))
+
+
+def seed(size, txns_per_user, rng):
+    """Users, transactions, devices and rollups of a data size. Returns the users and transactions."""
+    from app.memory import reset
+    from app.db.backend import MongoUserModel, MongoTransactionModel, DeviceLogModel, Neo4jUserModel, MongoService, Neo4jService
+    from app.models.mongo_model import User, Transaction, DeviceLog
+    from app.models.neo4j_model import UserSchema
+    from app.utils.security import hash_password
+
+    reset()
+    password = hash_password(PASSWORD)
+    users = MongoUserModel().create_many([
+        User(fname="Bench", lname=str(i), email=f"user{i}@bench.example", password=password, new_user=False)
+        for i in range(size)
+    ])
+    Neo4jUserModel().create_many([
+        UserSchema(user_id=user.user_id, fname=user.fname, lname=user.lname, score=user.score) for user in users
+    ])
+
+    now = datetime.now()
+    txns = []
+    for sender in users:
+        for _ in range(txns_per_user):
+            recipient = rng.choice(users)
+            txns.append(Transaction(
+                sender={"user_id": sender.user_id, "user_email": sender.email, "user_fname": sender.fname, "user_lname": sender.lname},
+                recipient={"user_id": recipient.user_id, "user_email": recipient.email, "user_fname": recipient.fname, "user_lname": recipient.lname},
+                sender_device_id="bench",
+                amount=round(rng.uniform(10, 100), 2),
+                timestamp=now - timedelta(minutes=rng.randrange(90 * 24 * 60)),
+                status="verified",
+            ))
+    txns = MongoTransactionModel().create_many(txns)
+    Neo4jService().record_transactions([
+        dict(transaction_id=txn.transaction_id, amount=txn.amount, status=txn.status,
+             timestamp=txn.timestamp.isoformat(), sender_id=txn.sender.user_id, receiver_id=txn.recipient.user_id)
+        for txn in txns
+    ])
+    MongoService().rebuild_monthly_spend()
+
+    devices = max(1, size // 2)
+    DeviceLogModel().create_many([
+        DeviceLog(user_id=user.user_id, mac_address=f"00:00:{rng.randrange(devices):08X}",
+                  ip_address="10.0.0.1", location="Paris")
+        for user in users for _ in range(rng.randint(1, 2))
+    ])
+    return users, txns
+
+
+def run(size, ops, txns_per_user, seed_value=0):
+    from werkzeug.test import create_environ
+    from app.models.identity_map import identity_map_scope
+    from app.run import app
+    from app.services.detector_registry import DETECTORS, DetectionContext
+    from app.services.trust_service import enforce_trust_policy, TrustPolicyError
+
+    rng = random.Random(seed_value)
+    users, txns = seed(size, txns_per_user, rng)
+
+    def request(method, path, body):
+        environ = create_environ(path, method=method, json=body)
+        b"".join(app(environ, lambda status, headers: None))
+
+    def user_info(user):
+        return {"user_email": user.email, "user_fname": user.fname, "user_lname": user.lname}
+
+    # the first half of the users send to the second half only, so that the
+    # measured transactions do not close cycles with each other
+    senders, recipients = users[:len(users) // 2 or 1], users[len(users) // 2:]
+    results = {
+        "register": measure(request, [
+            ("POST", "/register", {"fname": "New", "lname": str(i), "email": f"new{i}@bench.example", "password": PASSWORD})
+            for i in range(ops)
+        ]),
+        "login": measure(request, [
+            ("POST", "/login", {"email": user.email, "password": PASSWORD, "device_log": {
+                "mac_address": f"00:00:{rng.randrange(size):08X}", "ip_address": "10.0.0.1", "location": "Paris",
+            }})
+            for user in rng.choices(users, k=ops)
+        ]),
+        "make_transaction": measure(request, [
+            ("POST", "/transactions/", {
+                "sender": user_info(rng.choice(senders)),
+                "recipient": user_info(rng.choice(recipients)),
+                "sender_device_id": "bench",
+                "amount": 20,
+            })
+            for _ in range(ops)
+        ]),
+    }
+
+    def detect(registered, txn):
+        with identity_map_scope():
+            registered(DetectionContext(txn.sender.user_id, txn.transaction_id))
+
+    for rule, registered in DETECTORS.items():
+        results[f"detector:{rule}"] = measure(detect, [(registered, txn) for txn in rng.choices(txns, k=ops)])
+
+    def enforce(user_id, score):
+        try:
+            enforce_trust_policy(user_id, amount=20, action="transaction", score=score)
+        except TrustPolicyError:
+            pass  # limit exceeded, the checks ran all the same
+
+    results["enforce_trust_policy"] = measure(enforce, [
+        (user.user_id, rng.choice((100, 80, 60, 40))) for user in rng.choices(users, k=ops)
+    ])
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Prints the ratio to the baseline, returns the (size, operation) more than `tolerance` slower."""
+    regressions = []
+    for size, operations in results.items():
+        for operation, result in operations.items():
+            expected = baseline.get(size, {}).get(operation)
+            if not expected:
+                continue
+            ratio = result["ops_per_s"] / expected["ops_per_s"]
+            print(f"{size:>7} {operation:40} baseline {expected['ops_per_s']:9.0f} ops/s  x{ratio:.2f}")
+            if ratio < 1 - tolerance:
+                regressions.append(f"{operation} ({size} users)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000], help="users of each data size")
+    parser.add_argument("--ops", type=int, default=300, help="calls of each operation")
+    parser.add_argument("--txns-per-user", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed ops/s loss over the baseline")
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    # set before the configuration is imported
+    os.environ["DB_BACKEND"] = "memory"
+    os.environ["MONGO_ENSURE_INDEXES"] = "false"
+    os.environ.setdefault("GRAPH_MAX_EDGES", str(max(args.sizes) * (args.txns_per_user + 2) + 10 * args.ops))
+
+    logging.disable(logging.CRITICAL)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        run(100, 20, args.txns_per_user)  # warm the imports and the thread pools
+    logging.disable(logging.NOTSET)
+
+    results = {}
+    print(f"{'users':>7} {'operation':40} {'ops/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for size in args.sizes:
+        # the request logs and prints of the application are not measured
+        logging.disable(logging.CRITICAL)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            results[str(size)] = run(size, args.ops, args.txns_per_user)
+        logging.disable(logging.NOTSET)
+        for operation, result in results[str(size)].items():
+            print(f"{size:>7} {operation:40} {result['ops_per_s']:9.0f} {result['p50_ms']:8.2f} "
+                  f"{result['p95_ms']:8.2f} {result['p99_ms']:8.2f}")
+
+    if args.save_baseline:
+        with open(BASELINE, "w") as f:
+            json.dump({
+                size: {operation: {key: round(value, 3) for key, value in result.items()}
+                       for operation, result in operations.items()}
+                for size, operations in results.items()
+            }, f, indent=2)
+            f.write("\n")
+        print(f"baseline saved to {BASELINE}")
+        return
+
+    if not os.path.exists(BASELINE):
+        return
+    with open(BASELINE) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"REGRESSION: {', '.join(regressions)} more than {args.tolerance:.0%} slower than the baseline")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
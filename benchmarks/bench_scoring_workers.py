@@ -0,0 +1,100 @@
+"""
+Load test of the scoring workers of the Redis Streams pipeline: throughput
+with 1, 2, 4... worker processes on the same backlog of events.
+
+The events are handled by a synthetic handler which waits --work-ms, as
+the detector queries of a real event would, so the benchmark measures the
+pipeline (partitioning, leases, reads and acknowledgements) and its scaling
+rather than the databases. Needs the Redis server of the .env file; the
+benchmark uses database --db (15 by default), flushed before each run.
+
+    python -m benchmarks.bench_scoring_workers --events 2000 --workers 1 2 4 8
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+
+def _worker(stop, work_ms):
+    from app.db.redis import redis_client
+    from app.services.scoring_pipeline import ScoringWorker
+
+    def handle(event):
+        time.sleep(work_ms / 1000)
+        redis_client.incr("bench:done")
+
+    ScoringWorker(handlers={"bench": handle}, block_ms=100).run(stop)
+
+
+def _balanced(redis_client, partitions, workers):
+    owners = redis_client.mget([f"scoring:lease:{p}" for p in range(partitions)])
+    if any(owner is None for owner in owners):
+        return False
+    counts = {}
+    for owner in owners:
+        counts[owner] = counts.get(owner, 0) + 1
+    return len(counts) == workers and max(counts.values()) - min(counts.values()) <= 1
+
+
+def run(workers, events, users, work_ms, partitions, timeout=300):
+    from app.db.redis import redis_client
+    from app.services.scoring_pipeline import publish
+
+    redis_client.flushdb()
+    context = multiprocessing.get_context("spawn")
+    stop = context.Event()
+    processes = [context.Process(target=_worker, args=(stop, work_ms)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        # wait for the workers to share out the partitions
+        deadline = time.monotonic() + timeout
+        while not _balanced(redis_client, partitions, workers):
+            if time.monotonic() > deadline:
+                raise TimeoutError("the workers did not share out the partitions")
+            time.sleep(0.1)
+
+        start = time.perf_counter()
+        for i in range(events):
+            publish("bench", f"bench-u{i % users}")
+        while int(redis_client.get("bench:done") or 0) < events:
+            if time.monotonic() > deadline:
+                raise TimeoutError("the events were not all handled")
+            time.sleep(0.01)
+        return time.perf_counter() - start
+    finally:
+        stop.set()
+        for process in processes:
+            process.join(10)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--work-ms", type=float, default=5.0, help="simulated handling time of an event")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--partitions", type=int, default=16)
+    parser.add_argument("--db", type=int, default=15, help="Redis database used by the benchmark")
+    args = parser.parse_args(argv)
+
+    # set before the configuration is imported, inherited by the workers
+    uri = urlsplit(os.getenv("REDIS_URI", "redis://localhost:6379/0"))
+    os.environ["REDIS_URI"] = urlunsplit(uri._replace(path=f"/{args.db}"))
+    os.environ["SCORING_PARTITIONS"] = str(args.partitions)
+    os.environ["SCORING_LEASE_SECONDS"] = "1"  # fast rebalancing when the workers start
+
+    baseline = None
+    print(f"{args.events} events of {args.users} users, {args.work_ms} ms each, {args.partitions} partitions")
+    for workers in args.workers:
+        seconds = run(workers, args.events, args.users, args.work_ms, args.partitions)
+        throughput = args.events / seconds
+        baseline = baseline or throughput / workers
+        print(f"{workers:3} workers: {seconds:7.2f} s  {throughput:8.0f} events/s  "
+              f"scaling efficiency {throughput / (baseline * workers):5.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark of the application cold start, each sample in a fresh Python
+process: import time of `app.run`, and time from the start of the import to
+the first response of /health/live. No database is needed, nothing should
+connect before the first request that uses it.
+
+Compares the medians with benchmarks/baselines/startup.json and exits with
+an error when one is slower than the baseline by more than --tolerance.
+
+    python -m benchmarks.bench_startup --samples 10
+    python -m benchmarks.bench_startup --save-baseline
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baselines", "startup.json")
+
+PROBE = """
+import json, time
+start = time.perf_counter()
+import app.run
+from werkzeug.test import create_environ
+imported = time.perf_counter()
+status = []
+body = b"".join(app.run.app(create_environ("/health/live"), lambda s, headers: status.append(s)))
+assert status == ["200 OK"], status
+responded = time.perf_counter()
+print(json.dumps({"import_s": imported - start, "first_response_s": responded - start}))
+"""
+
+
+def sample():
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        capture_output=True, text=True, check=True,
+        env=dict(os.environ, MONGO_ENSURE_INDEXES="false"),
+    )
+    times = json.loads(result.stdout.strip().splitlines()[-1])
+    return times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=10)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown over the baseline")
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    sample()  # warm the file system and bytecode caches
+    samples = [sample() for _ in range(args.samples)]
+    medians = {key: statistics.median(s[key] for s in samples) for key in samples[0]}
+    for key, value in medians.items():
+        print(f"{key:18} median {value * 1000:8.1f} ms  max {max(s[key] for s in samples) * 1000:8.1f} ms")
+
+    if args.save_baseline:
+        with open(BASELINE, "w") as f:
+            json.dump({key: round(value, 4) for key, value in medians.items()}, f, indent=2)
+            f.write("\n")
+        print(f"baseline saved to {BASELINE}")
+        return
+
+    if not os.path.exists(BASELINE):
+        return
+    with open(BASELINE) as f:
+        baseline = json.load(f)
+    regressions = [
+        key for key, value in medians.items()
+        if key in baseline and value > baseline[key] * (1 + args.tolerance)
+    ]
+    for key in medians:
+        if key in baseline:
+            print(f"{key:18} baseline {baseline[key] * 1000:6.1f} ms  x{medians[key] / baseline[key]:.2f}")
+    if regressions:
+        print(f"REGRESSION: {', '.join(regressions)} more than {args.tolerance:.0%} slower than the baseline")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
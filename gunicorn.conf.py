@@ -0,0 +1,42 @@
+"""
+Production server: gunicorn -c gunicorn.conf.py app.wsgi:app
+
+The app is loaded once in the master process and forked into WEB_WORKERS
+processes of WEB_THREADS threads each. Database clients are created lazily
+in each worker (app/db/registry.py), never shared across processes.
+"""
+from app.utils.config import Config
+
+
+bind = "0.0.0.0:5050"
+workers = Config.WEB_WORKERS
+worker_class = "gthread"
+threads = Config.WEB_THREADS
+timeout = Config.WEB_TIMEOUT
+# on SIGTERM, workers finish their requests within this delay
+graceful_timeout = Config.WEB_GRACEFUL_TIMEOUT
+preload_app = True
+accesslog = "-"
+
+
+def on_starting(server):
+    from app.run import init_databases
+    from app.db.registry import registry
+
+    init_databases()
+    # do not fork with the master's open connections
+    registry.close()
+
+
+def post_fork(server, worker):
+    from app.db.registry import registry
+
+    registry.reset()
+
+
+def worker_exit(server, worker):
+    from app.db.registry import registry
+    from app.services.score_flusher import stop_score_flusher
+
+    stop_score_flusher()
+    registry.close()
@@ -1,42 +1,69 @@
 import pytest
-from app.services.mongo_service import MongoService
+from app.db import backend
+from app.db.backend import MongoService, Neo4jService
 from app.services.redis_service import RedisTrustScoreService
-from app.services.neo4j_service import Neo4jService
 from app.run import app
-from app.db.mongo import db as test_db
-from app.db.redis import redis_client 
-from app.db.neo4j import neo4j_driver   
+from app.models.mongo_model import reset_id_allocators
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "live: needs the MongoDB, Redis and Neo4j servers, skipped with DB_BACKEND=memory"
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    if not backend.is_memory():
+        return
+    skip_live = pytest.mark.skip(reason="needs the live databases (DB_BACKEND=memory)")
+    for item in items:
+        if "live" in item.keywords:
+            item.add_marker(skip_live)
 
 
-@pytest.fixture(scope="function", autouse=True)
 def clean_mongo():
+    from app.db.mongo import db as test_db
+
     print("Cleaning MongoDB collections...")
-    for col in ["users", "transactions", "device_logs", "counters"]:
+    for col in ["users", "transactions", "device_logs", "device_users", "counters", "monthly_spend"]:
         test_db[col].delete_many({})
-    yield 
-        
-@pytest.fixture(scope="function", autouse=True)
+    reset_id_allocators()
+
 def clean_redis():
+    from app.db.redis import redis_client
+
     print("Cleaning Redis database...")
     redis_client.flushdb()
-    yield
-    
-@pytest.fixture(scope="function", autouse=True)
+
 def clean_neo4j():
+    from app.db.neo4j import neo4j_driver
+
     print("Cleaning Neo4j database...")
-    driver = neo4j_driver
-    with driver.session() as session:
+    with neo4j_driver.session() as session:
         session.run("MATCH (n) DETACH DELETE n")
+
+
+@pytest.fixture(scope="function", autouse=True)
+def clean_databases():
+    if backend.is_memory():
+        from app.memory import reset
+
+        print("Cleaning the in-memory databases...")
+        reset()
+    else:
+        clean_mongo()
+        clean_redis()
+        clean_neo4j()
     yield
-    
-    
+
+
 @pytest.fixture(scope="session", autouse=True)
 def setup_neo4j_constraints():
     print("Setting up Neo4j constraints...")
     Neo4jService.setup_constraints()
     yield
 
-        
+
 @pytest.fixture
 def redis_service():
     return RedisTrustScoreService(ttl=3600)
@@ -0,0 +1,69 @@
+from unittest.mock import patch
+from app.services import deferred_scoring
+from app.services.deferred_scoring import defer_checks, run_deferred_checks, inline_rules, deferred_rules
+
+
+JOB = {"user_id": "001", "transaction_id": "010", "reservation": {"user_id": "001", "day": 1, "amount": 50.0}}
+
+
+# Test: the graph detectors should be deferred, every other rule checked inline
+def test_tiered_rules():
+    assert deferred_rules() == {"suspicious_connections", "circular_transaction_detected"}
+    assert "high_txn_amount" in inline_rules()
+    assert not inline_rules() & deferred_rules()
+
+# Test: a triggered deferred rule should flag the transaction and release its trust window
+def test_run_deferred_checks_flags_transaction():
+    with patch.object(deferred_scoring, 'calculate_score', return_value=(70, {"circular_transaction_detected"})) as mock_score, \
+        patch.object(deferred_scoring, 'update_score_mongo') as mock_update, \
+        patch.object(deferred_scoring.mongo, 'flag_transaction', return_value="verified") as mock_flag, \
+        patch.object(deferred_scoring.mongo, 'set_transaction_checks') as mock_checks, \
+        patch.object(deferred_scoring, 'release_trust_window') as mock_release:
+        assert run_deferred_checks(JOB) == {"circular_transaction_detected"}
+
+    assert mock_score.call_args.kwargs["rules"] == deferred_rules()
+    mock_update.assert_called_once_with("001")
+    assert mock_flag.call_args[0][0] == "010"
+    mock_release.assert_called_once_with(JOB["reservation"])
+    mock_checks.assert_called_once_with("010", "done", {"circular_transaction_detected"})
+
+# Test: clean deferred checks should leave the transaction as is
+def test_run_deferred_checks_clean():
+    with patch.object(deferred_scoring, 'calculate_score', return_value=(100, set())), \
+        patch.object(deferred_scoring, 'update_score_mongo'), \
+        patch.object(deferred_scoring.mongo, 'flag_transaction') as mock_flag, \
+        patch.object(deferred_scoring.mongo, 'set_transaction_checks') as mock_checks, \
+        patch.object(deferred_scoring, 'release_trust_window') as mock_release:
+        assert run_deferred_checks(JOB) == set()
+    mock_flag.assert_not_called()
+    mock_release.assert_not_called()
+    mock_checks.assert_called_once_with("010", "done", set())
+
+# Test: defer_checks should mark the checks pending and queue them on the configured backend
+def test_defer_checks_backends():
+    with patch.object(deferred_scoring.mongo, 'set_transaction_checks') as mock_checks, \
+        patch.object(deferred_scoring, 'publish') as mock_publish, \
+        patch.object(deferred_scoring.Config, 'DEFERRED_BACKEND', 'stream'):
+        defer_checks("001", "010", JOB["reservation"])
+    mock_checks.assert_called_once_with("010", "pending")
+    mock_publish.assert_called_once_with("checks", "001", x="010", r="1:50.0")
+
+    with patch.object(deferred_scoring.mongo, 'set_transaction_checks'), \
+        patch.object(deferred_scoring, 'get_deferred_executor') as mock_executor, \
+        patch.object(deferred_scoring.Config, 'DEFERRED_BACKEND', 'local'):
+        defer_checks("001", "010", JOB["reservation"])
+    mock_executor.return_value.submit.assert_called_once_with(deferred_scoring._run_logged, JOB)
+
+# Test: a checks event should carry the job in compact fields
+def test_checks_event_roundtrip():
+    with patch.object(deferred_scoring, 'run_deferred_checks') as mock_run:
+        deferred_scoring.handle_checks_event({"t": "checks", "u": "001", "x": "010", "r": "1:50.0"})
+    mock_run.assert_called_once_with(JOB)
+
+
+# Test: a transaction event replayed after its checks are done should be skipped
+def test_transaction_event_replay_skipped():
+    with patch.object(deferred_scoring.mongo, 'get_transaction_by_id', return_value={"transaction_id": "010", "checks": "done"}), \
+        patch.object(deferred_scoring, 'score_transaction') as mock_score:
+        deferred_scoring.handle_transaction_event({"t": "txn", "u": "001", "x": "010"})
+    mock_score.assert_not_called()
@@ -0,0 +1,53 @@
+import pytest
+from unittest.mock import patch
+
+from app.routes import health_routes
+
+
+# Test: liveness should not depend on the databases
+def test_health_live(client):
+    with patch.object(health_routes, '_checks') as mock_checks:
+        response = client.get("/health/live")
+        mock_checks.assert_not_called()
+    assert response.status_code == 200
+    assert response.json == {"status": "UP"}
+
+# Test: readiness should ping every database
+@pytest.mark.live
+def test_health_ready(client):
+    response = client.get("/health/ready")
+    assert response.status_code == 200
+    assert response.json["checks"] == {"mongodb": "UP", "redis": "UP", "neo4j": "UP"}
+
+# Test: a failing database should make the app not ready
+def test_health_ready_failure(client):
+    def failing(timeout):
+        raise ConnectionError("unreachable")
+
+    with patch.object(health_routes, '_checks', return_value={"mongodb": failing}):
+        response = client.get("/health/ready")
+    assert response.status_code == 503
+    assert response.json == {"status": "DOWN", "checks": {"mongodb": "error: unreachable"}}
+
+# Test: readiness should reuse one executor, and not start again a check still running
+def test_health_ready_hanging_check(client):
+    import threading
+
+    release = threading.Event()
+    calls = []
+
+    def hanging(timeout):
+        calls.append(timeout)
+        release.wait(5)
+
+    with patch.object(health_routes, '_checks', return_value={"mongodb": hanging}), \
+        patch.object(health_routes.Config, 'HEALTH_TIMEOUT', 0.1):
+        for _ in range(3):
+            response = client.get("/health/ready")
+            assert response.json == {"status": "DOWN", "checks": {"mongodb": "timeout"}}
+        assert calls == [0.1]
+        executor = health_routes._executor
+        release.set()
+        health_routes._running["mongodb"].result()
+        assert client.get("/health/ready").status_code == 200
+        assert health_routes._executor is executor
@@ -0,0 +1,47 @@
+from app.models.identity_map import IdentityMap, identity_map_scope, current_identity_map
+from app.services.suspicious_service import run_detectors
+from tests.test_mongo import create_dummy_user
+
+
+# Test: repeated reads by user_id or email should query MongoDB once, without the password
+def test_identity_map_repeated_reads(mongo_service):
+    user = create_dummy_user(mongo_service)
+    with identity_map_scope() as identity_map:
+        first = mongo_service.user_model.read(user.user_id)
+        assert "password" not in first
+        assert mongo_service.user_model.read_by_email("a@example.com") is first
+        assert mongo_service.get_score(user.user_id) == 100
+    assert (identity_map.hits, identity_map.misses) == (2, 1)
+
+# Test: a write should invalidate the document under all of its keys
+def test_identity_map_invalidated_on_write(mongo_service):
+    user = create_dummy_user(mongo_service)
+    with identity_map_scope():
+        assert mongo_service.get_score(user.user_id) == 100
+        mongo_service.update_score(user.user_id, score=70)
+        assert mongo_service.get_score(user.user_id) == 70
+        assert mongo_service.user_model.read_by_email("a@example.com")["score"] == 70
+
+# Test: outside a request every read should query MongoDB
+def test_identity_map_not_used_outside_scope(mongo_service):
+    user = create_dummy_user(mongo_service)
+    assert current_identity_map() is None
+    assert mongo_service.user_model.read(user.user_id) is not mongo_service.user_model.read(user.user_id)
+
+# Test: invalidating one key should drop the document under the others
+def test_identity_map_invalidate_all_keys():
+    identity_map = IdentityMap()
+    doc = {"user_id": "001", "email": "a@example.com"}
+    identity_map.put("users", doc, ("user_id", "email"))
+    assert identity_map.get("users", "email", "a@example.com") is doc
+    identity_map.invalidate("users", "user_id", "001")
+    assert identity_map.get("users", "email", "a@example.com") is None
+
+# Test: detectors running on the shared pool should see the identity map of the request
+def test_detectors_share_identity_map():
+    with identity_map_scope() as identity_map:
+        detectors = [
+            ("a", lambda: current_identity_map() is identity_map, ()),
+            ("b", lambda: current_identity_map() is identity_map, ()),
+        ]
+        assert run_detectors(detectors, timeout=5) == {"a", "b"}
@@ -0,0 +1,120 @@
+import pytest
+import json
+from datetime import datetime
+
+from app.db.mongo import db
+from app.db.redis import redis_client
+from app.services.import_service import run_import
+from app.services.neo4j_service import Neo4jService
+
+# imports into the three live databases
+pytestmark = pytest.mark.live
+
+
+def write_jsonl(path, records):
+    path.write_text("\n".join(json.dumps(record) for record in records))
+    return str(path)
+
+def user_record(i):
+    return {"user_id": f"{i:03d}", "fname": "U", "lname": str(i), "email": f"user{i}@example.com", "password": "secret"}
+
+def txn_record(i, sender, recipient, status="verified"):
+    return {
+        "transaction_id": f"{i:03d}",
+        "sender": {"user_email": sender, "user_fname": None, "user_lname": None},
+        "recipient": {"user_email": recipient, "user_fname": None, "user_lname": None},
+        "sender_device_id": "AABBCCDDEEFF",
+        "amount": 100.0,
+        "timestamp": datetime(2025, 3, i).isoformat(),
+        "status": status,
+    }
+
+
+# Test: users should be written to the three stores, invalid records skipped
+def test_import_users(tmp_path):
+    path = write_jsonl(tmp_path / "users.jsonl", [user_record(1), user_record(2), {"fname": "invalid"}])
+
+    stats = run_import("users", path, chunk_size=2)
+
+    assert stats["records"] == 3
+    assert stats["imported"] == 2
+    assert stats["invalid"] == 1
+    assert db.users.find_one({"user_id": "001"})["password"] != "secret"
+    assert redis_client.get("002") == b"100"
+    assert not (tmp_path / "users.jsonl.checkpoint").exists()
+
+# Test: transactions should resolve the users by email and maintain the rollups
+def test_import_transactions(tmp_path):
+    run_import("users", write_jsonl(tmp_path / "users.jsonl", [user_record(1), user_record(2)]))
+    redis_client.hset("trust_window:001", "loaded", 1)
+    txns = [
+        txn_record(1, "user1@example.com", "user2@example.com"),
+        txn_record(2, "user1@example.com", "user2@example.com"),
+        txn_record(3, "user1@example.com", "user2@example.com", status="suspicious"),
+        txn_record(4, "unknown@example.com", "user2@example.com"),
+    ]
+
+    stats = run_import("transactions", write_jsonl(tmp_path / "txns.jsonl", txns))
+
+    assert stats["imported"] == 3
+    rollup = db.monthly_spend.find_one({"user_id": "001", "year": 2025, "month": 3})
+    assert rollup["total_spent"] == 200.0
+    assert rollup["txn_count"] == 2
+    assert not redis_client.exists("trust_window:001")
+    connections = Neo4jService().get_user_transactions_connections({"user_id": "001"})
+    assert len(connections) == 3
+
+# Test: an import should resume after the checkpoint, replayed records not counted twice
+def test_import_resumes_from_checkpoint(tmp_path):
+    path = write_jsonl(tmp_path / "users.jsonl", [user_record(i) for i in range(1, 5)])
+    run_import("users", write_jsonl(tmp_path / "first.jsonl", [user_record(1)]))
+    (tmp_path / "users.jsonl.checkpoint").write_text(json.dumps({"records": 0}))
+
+    stats = run_import("users", path)
+    assert stats["imported"] == 3
+    assert db.users.count_documents({}) == 4
+
+    (tmp_path / "users.jsonl.checkpoint").write_text(json.dumps({"records": 3}))
+    stats = run_import("users", path)
+    assert stats["skipped"] == 3
+    assert stats["records"] == 4
+    assert stats["imported"] == 0
+
+# Test: replaying a chunk should not duplicate device logs and transactions without transaction_id
+def test_import_replay_without_ids(tmp_path):
+    run_import("users", write_jsonl(tmp_path / "users.jsonl", [user_record(1), user_record(2)]))
+    logs = [
+        {"user_id": "001", "mac_address": "aa:bb:cc:dd:ee:ff", "ip_address": "10.0.0.1",
+         "timestamp": datetime(2025, 3, i).isoformat(), "location": "Paris"}
+        for i in (1, 2)
+    ]
+    txns = [dict(txn_record(i, "user1@example.com", "user2@example.com"), transaction_id=None) for i in (1, 2)]
+    logs_path = write_jsonl(tmp_path / "logs.jsonl", logs)
+    txns_path = write_jsonl(tmp_path / "txns.jsonl", txns)
+
+    for _ in range(2):
+        (tmp_path / "logs.jsonl.checkpoint").write_text(json.dumps({"records": 0}))
+        run_import("devices", logs_path)
+        (tmp_path / "txns.jsonl.checkpoint").write_text(json.dumps({"records": 0}))
+        run_import("transactions", txns_path)
+
+    assert db.device_logs.count_documents({}) == 2
+    assert db.transactions.count_documents({}) == 2
+    rollup = db.monthly_spend.find_one({"user_id": "001", "year": 2025, "month": 3})
+    assert rollup["txn_count"] == 2
+    connections = Neo4jService().get_user_transactions_connections({"user_id": "001"})
+    assert len(connections) == 2
+
+# Test: the users and transactions created after an import should not reuse the imported ids
+def test_import_advances_counters(tmp_path):
+    from app.models.mongo_model import MongoUserModel, MongoTransactionModel, Transaction, User
+
+    run_import("users", write_jsonl(tmp_path / "users.jsonl", [user_record(1), user_record(50)]))
+    run_import("transactions", write_jsonl(tmp_path / "txns.jsonl", [
+        dict(txn_record(1, "user1@example.com", "user50@example.com"), transaction_id="020"),
+    ]))
+
+    user = MongoUserModel().create(User(fname="New", lname="User", email="new@example.com", password="secret"))
+    assert int(user.user_id) > 50
+    txn = MongoTransactionModel().create(Transaction(**dict(txn_record(2, "new@example.com", "user1@example.com"), transaction_id=None)))
+    assert int(txn.transaction_id) > 20
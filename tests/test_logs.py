@@ -0,0 +1,69 @@
+import json
+import logging
+import queue
+from unittest.mock import patch
+from app.utils.logs import (
+    DebugSampler,
+    JsonFormatter,
+    TextFormatter,
+    TraceContext,
+    _LazyQueueHandler,
+    parse_levels,
+    redact,
+)
+from app.utils.tracing import start_trace, end_trace
+
+
+def make_record(level, msg, *args):
+    return logging.LogRecord("app.test", level, __file__, 1, msg, args, None)
+
+
+# Test: passwords and the local part of the emails should be masked
+def test_redact():
+    assert redact("{'email': 'john.doe@bank.example', 'password': b'$2b$12$abc'}") == \
+        "{'email': 'j***@bank.example', 'password': b'***'}"
+    assert redact('{"password": "two words", "amount": 20}') == '{"password": "***", "amount": 20}'
+    assert redact("User(password='hunter2', fname='A')") == "User(password='***', fname='A')"
+    assert redact("login password=secret&next=1") == "login password=***&next=1"
+
+# Test: the JSON lines should mask the passwords of JSON messages, whose quotes they escape
+def test_json_formatter_redacts_json_message():
+    record = make_record(logging.INFO, 'Payload %s', json.dumps({"email": "bob@example.com", "password": "abc def"}))
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["message"] == 'Payload {"email": "b***@example.com", "password": "***"}'
+
+# Test: the per-logger levels should be parsed, unknown levels ignored
+def test_parse_levels():
+    assert parse_levels("app.services=DEBUG, werkzeug=warning,app.db=LOUD,") == {
+        "app.services": logging.DEBUG,
+        "werkzeug": logging.WARNING,
+    }
+
+# Test: only the sampled share of the DEBUG records should pass, the other levels always
+def test_debug_sampler():
+    sampler = DebugSampler(0.25)
+    with patch("app.utils.logs.random.random", side_effect=[0.1, 0.5]):
+        assert sampler.filter(make_record(logging.DEBUG, "kept"))
+        assert not sampler.filter(make_record(logging.DEBUG, "dropped"))
+    assert sampler.filter(make_record(logging.INFO, "info"))
+
+# Test: a queued record should carry its merged message and trace id, formatted and redacted by the listener
+def test_queued_record_format():
+    records = queue.SimpleQueue()
+    handler = _LazyQueueHandler(records)
+    handler.addFilter(TraceContext())
+    user = {"user_id": "001", "email": "alice@example.com"}
+
+    token = start_trace("request-1")
+    try:
+        handler.handle(make_record(logging.INFO, "User %s logged in", user))
+    finally:
+        end_trace(token)
+    user["user_id"] = "002"  # changed after logging
+
+    record = records.get_nowait()
+    assert record.args is None
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["message"] == "User {'user_id': '001', 'email': 'a***@example.com'} logged in"
+    assert entry["trace_id"] == "request-1"
+    assert "[request-1]: User {'user_id': '001'" in TextFormatter().format(record)
@@ -0,0 +1,117 @@
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from app.memory import reset
+from app.memory.mongo import MemoryUserModel, MemoryTransactionModel
+from app.memory.mongo_service import MemoryMongoService
+from app.memory.neo4j import MemoryNeo4jUserModel
+from app.memory.neo4j_service import MemoryNeo4jService
+from app.memory.redis import MemoryTrustScoreModel, MemoryTrustWindowModel, keyspace
+from app.models.mongo_model import User, Transaction
+from app.models.neo4j_model import UserSchema
+from app.services.redis_service import RedisTrustScoreService
+from app.utils.config import Config
+
+
+def make_transaction(sender, recipient, amount=50.0, minutes=0):
+    return Transaction(
+        sender={"user_id": sender, "user_email": f"{sender}@example.com", "user_fname": "A", "user_lname": "B"},
+        recipient={"user_id": recipient, "user_email": f"{recipient}@example.com", "user_fname": "A", "user_lname": "B"},
+        sender_device_id="device",
+        amount=amount,
+        timestamp=datetime(2025, 3, 1, 12, 0) + timedelta(minutes=minutes),
+    )
+
+
+# Test: the in-memory deductions should apply one-time rules once and repeatable rules each time
+def test_memory_score_deductions():
+    reset()
+    redis = RedisTrustScoreService()
+    redis.model = MemoryTrustScoreModel()
+    deductions = [("new_account", -5, False), ("circular_transaction_detected", -30, True)]
+
+    assert redis.apply_deductions("001", deductions, lambda user_id: (100, [])) == (65, ["new_account"])
+    assert redis.apply_deductions("001", deductions, lambda user_id: None) == (35, [])
+    assert redis.get_score("001") == 35
+    assert redis.apply_deductions("002", deductions, lambda user_id: None) == (None, [])
+
+# Test: a deduction should keep the adaptive TTL of the cached score
+def test_memory_score_deductions_keep_ttl():
+    reset()
+    redis = RedisTrustScoreService(ttl=3600)
+    redis.model = MemoryTrustScoreModel()
+    redis.set_score("001", 100, expire_seconds=14400)
+
+    assert redis.apply_deductions("001", [("new_account", -5, False)], lambda user_id: (100, [])) == (95, ["new_account"])
+    assert keyspace.pttl("001") > 3600 * 1000
+
+# Test: a deduction should only mark the score dirty when it changed it
+def test_memory_score_deductions_dirty_only_on_change():
+    reset()
+    redis = RedisTrustScoreService()
+    redis.model = MemoryTrustScoreModel()
+    deductions = [("new_account", -5, False)]
+
+    assert redis.apply_deductions("001", deductions, lambda user_id: (100, []), mark_dirty=True) == (95, ["new_account"])
+    assert redis.get_dirty_score("001") == 95
+    redis.clear_dirty_scores({"001": 95})
+    assert redis.apply_deductions("001", deductions, lambda user_id: None, mark_dirty=True) == (95, [])
+    assert redis.get_dirty_score("001") is None
+
+# Test: the in-memory trust window should enforce the limits like the reservation script
+def test_memory_trust_window():
+    reset()
+    window = MemoryTrustWindowModel()
+    day = datetime(2025, 3, 10).toordinal()
+    # window_start, month_start, day, amount, ttl, total limit, max high, high field, max per month, max amount
+    args = [day - 90, day - 9, day, 3000.0, 3600, 5000, -1, "", -1, -1, "h1000", 1000]
+
+    assert window.reserve("trust_window:001", args) == (-1, 0.0)
+    window.load("trust_window:001", {f"a:{day - 100}": 4000.0, f"a:{day - 1}": 1000.0}, 3600)
+    assert window.reserve("trust_window:001", args) == (0, 0.0)
+    assert window.reserve("trust_window:001", args) == (1, 4000.0)
+    assert window.release("trust_window:001", [day, 3000.0, "h1000", 1000])
+    assert window.reserve("trust_window:001", args)[0] == 0
+
+# Test: the in-memory MongoService should extract the detection features of the stored documents
+def test_memory_mongo_service_features():
+    reset()
+    mongo = MemoryMongoService()
+    for email in ("001@example.com", "002@example.com"):
+        MemoryUserModel().create(User(fname="A", lname="B", email=email, password="x"))
+    txns = MemoryTransactionModel().create_many([make_transaction("001", "002") for _ in range(4)])
+    for txn in txns[:3]:
+        assert mongo.verify_transaction(txn.transaction_id)
+    assert not mongo.verify_transaction(txns[0].transaction_id)
+    assert mongo.flag_transaction(txns[2].transaction_id, "test") == "verified"
+
+    features = mongo.get_detection_features("001")
+    assert features["new_user"] is True
+    assert features["txn_count"] == 3
+    assert features["monthly_spending"] == {(2025, 3): 100.0}
+    assert mongo.get_verified_spending_by_day("001", datetime(2025, 1, 1), (40,)) == [
+        {"day": "2025-03-01", "amount": 100.0, "count": 2, "high": {40: 2}}
+    ]
+    assert "password" not in mongo.get_user_by_id("001")
+
+# Test: the in-memory Neo4jService should detect a cycle closed by a recorded transaction
+@patch.object(Config, 'GRAPH_MAX_EDGES', 100)
+def test_memory_neo4j_circular_transaction():
+    reset()
+    neo4j = MemoryNeo4jService()
+    for user_id in ("001", "002", "003"):
+        MemoryNeo4jUserModel().create(UserSchema(user_id=user_id, fname="A", lname="B", score=40))
+    rows = [
+        {"transaction_id": "t1", "sender_id": "002", "receiver_id": "003", "minutes": 0},
+        {"transaction_id": "t2", "sender_id": "003", "receiver_id": "001", "minutes": 5},
+        {"transaction_id": "t3", "sender_id": "001", "receiver_id": "002", "minutes": 10},
+    ]
+    records = neo4j.record_transactions([
+        dict(row, amount=50.0, status="pending",
+             timestamp=(datetime(2025, 3, 1, 12, 0) + timedelta(minutes=row["minutes"])).isoformat())
+        for row in rows
+    ])
+
+    assert len(records) == 3
+    assert sorted(c["receiver_id"] for c in neo4j.get_user_user_connections({"user_id": "001"})) == ["002", "003"]
+    result = neo4j.detect_circular_transaction({"user_id": "001", "transaction_id": "t3", "max_depth": 4})
+    assert result["path_ids"] == ["001", "t3", "002", "t1", "003", "t2", "001"]
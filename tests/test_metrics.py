@@ -0,0 +1,88 @@
+import pytest
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+from prometheus_client import REGISTRY
+from app.db.instrumentation import InstrumentedDriver, instrument_redis
+from app.db.backend import RedisTrustWindowModel
+from app.services.detector_registry import Detector, DetectionContext
+from app.services.trust_service import enforce_trust_policy, reserve_trust_window, TrustPolicyError, MONTHLY_TXNS_EXCEEDED
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(f"antiscam_{name}", labels) or 0
+
+
+# Test: a detector run should be timed and counted as a hit when it triggers
+def test_detector_metrics():
+    detector = Detector("test_metrics_rule", lambda user_id: user_id == "001", "cheap", ("user_id",))
+    runs = sample("detector_duration_seconds_count", rule="test_metrics_rule")
+    hits = sample("detector_hits_total", rule="test_metrics_rule")
+
+    assert detector(DetectionContext("001"))
+    assert not detector(DetectionContext("002"))
+
+    assert sample("detector_duration_seconds_count", rule="test_metrics_rule") == runs + 2
+    assert sample("detector_hits_total", rule="test_metrics_rule") == hits + 1
+
+# Test: the trust policy decisions should be counted by action and outcome
+def test_policy_decision_metrics():
+    locked = sample("trust_policy_decisions_total", action="login", decision="locked")
+    with pytest.raises(TrustPolicyError):
+        enforce_trust_policy("001", action="login", score=10)
+    assert sample("trust_policy_decisions_total", action="login", decision="locked") == locked + 1
+
+    exceeded = sample("trust_policy_decisions_total", action="transaction", decision="monthly_txns_exceeded")
+    with patch.object(RedisTrustWindowModel, 'reserve', return_value=(MONTHLY_TXNS_EXCEEDED, 10)):
+        with pytest.raises(TrustPolicyError):
+            reserve_trust_window("001", 50, datetime.now(), {"max_txns_per_month": 10, "max_txn_amount": 100})
+    assert sample("trust_policy_decisions_total", action="transaction", decision="monthly_txns_exceeded") == exceeded + 1
+
+# Test: the Redis commands and pipelines should be timed, failures counted
+def test_redis_round_trip_metrics():
+    client = MagicMock()
+    client.execute_command.side_effect = [b"1", ConnectionError("down")]
+    instrument_redis(client)
+    gets = sample("datastore_operation_duration_seconds_count", datastore="redis", operation="GET")
+    errors = sample("datastore_operation_errors_total", datastore="redis", operation="GET")
+    pipelines = sample("datastore_operation_duration_seconds_count", datastore="redis", operation="PIPELINE")
+
+    assert client.execute_command("GET", "score:001") == b"1"
+    with pytest.raises(ConnectionError):
+        client.execute_command("GET", "score:002")
+    client.pipeline(transaction=False).execute()
+
+    assert sample("datastore_operation_duration_seconds_count", datastore="redis", operation="GET") == gets + 2
+    assert sample("datastore_operation_errors_total", datastore="redis", operation="GET") == errors + 1
+    assert sample("datastore_operation_duration_seconds_count", datastore="redis", operation="PIPELINE") == pipelines + 1
+
+# Test: a Neo4j query should be timed under the method or unit of work running it
+def test_neo4j_query_metrics():
+    neo4j_driver = MagicMock()
+    neo4j_session = neo4j_driver.session.return_value
+    neo4j_session.run.return_value.consume.return_value.profile = None
+    neo4j_session.execute_write.side_effect = lambda unit, *args: unit(neo4j_session, *args)
+    driver = InstrumentedDriver(neo4j_driver)
+    sessions = sample("datastore_operation_duration_seconds_count", datastore="neo4j", operation="find_cycles")
+    units = sample("datastore_operation_duration_seconds_count", datastore="neo4j", operation="_create_user_node")
+
+    def find_cycles():
+        with driver.session() as session:
+            session.run("MATCH (n) RETURN n")
+
+    def _create_user_node(tx):
+        tx.run("MERGE (u:User {user_id: $user_id})", user_id="001")
+
+    find_cycles()
+    with driver.session() as session:
+        session.execute_write(_create_user_node)
+
+    assert sample("datastore_operation_duration_seconds_count", datastore="neo4j", operation="find_cycles") == sessions + 1
+    assert sample("datastore_operation_duration_seconds_count", datastore="neo4j", operation="_create_user_node") == units + 1
+
+# Test: /metrics should expose the request latencies in the Prometheus format
+def test_metrics_endpoint(client):
+    client.get("/health/live")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain")
+    assert 'antiscam_http_request_duration_seconds_count{method="GET",route="/health/live",status="200"}' in response.text
@@ -1,4 +1,12 @@
-from app.models.mongo_model import User, DeviceLog, Transaction, UserInfo
+import pytest
+import threading
+import time
+from datetime import datetime
+from unittest.mock import patch
+from app.db.mongo import db as test_db
+from app.models.mongo_model import User, DeviceLog, Transaction, UserInfo, IdBlockAllocator
+from app.models.mongo_indexes import ensure_indexes, check_query_plans, _lookup_query
+from app.services.suspicious_service import check_suspicious_monthly_spent
 
 
 def create_dummy_user(mongo_service, email="a@example.com"):
@@ -33,6 +41,16 @@ def test_get_score_and_update_score(mongo_service):
     assert mongo_service.get_score(user.user_id) == 150
 
 
+def test_update_scores_bulk(mongo_service):
+    user1 = create_dummy_user(mongo_service, email="s1@example.com")
+    user2 = create_dummy_user(mongo_service, email="s2@example.com")
+
+    matched = mongo_service.update_scores({user1.user_id: 70, user2.user_id: 40, "missing": 10})
+    assert matched == 2
+    assert mongo_service.get_score(user1.user_id) == 70
+    assert mongo_service.get_score(user2.user_id) == 40
+
+
 def test_get_users_by_device(mongo_service):
     user1 = create_dummy_user(mongo_service, email="u1@example.com")
     user2 = create_dummy_user(mongo_service, email="u2@example.com")
@@ -129,3 +147,203 @@ def test_get_devices_by_user(mongo_service):
 
     device_ids = mongo_service.get_devices_by_user(user.user_id)
     assert set(device_ids) == {"AABBCCDDEEFF", "112233445566"}
+
+
+def test_get_detection_features(mongo_service):
+    user = create_dummy_user(mongo_service, email="features@example.com")
+    other = create_dummy_user(mongo_service, email="other@example.com")
+
+    for mac, user_id in [
+        ("aa:bb:cc:dd:ee:ff", user.user_id),
+        ("11:22:33:44:55:66", user.user_id),
+        ("11:22:33:44:55:66", other.user_id),
+    ]:
+        mongo_service.log_device(
+            DeviceLog(user_id=user_id, mac_address=mac, ip_address="8.8.8.8", location="Paris")
+        )
+
+    for amount in [100.0, 200.0]:
+        txn = mongo_service.create_transaction(
+            Transaction(
+                sender=UserInfo(user_id=user.user_id, user_email=user.email, user_fname=user.fname, user_lname=user.lname),
+                recipient=UserInfo(user_id=other.user_id, user_email=other.email, user_fname=other.fname, user_lname=other.lname),
+                sender_device_id="AABBCCDDEEFF",
+                amount=amount,
+            )
+        )
+        mongo_service.verify_transaction(txn.transaction_id)
+
+    features = mongo_service.get_detection_features(user.user_id)
+    assert features["new_user"] is False
+    assert features["txn_count"] == 2
+    assert sum(features["monthly_spending"].values()) == 300.0
+    assert features["devices"] == {"AABBCCDDEEFF": 1, "112233445566": 2}
+
+
+@pytest.mark.live
+def test_verify_transaction_updates_monthly_spend(mongo_service):
+    sender = create_dummy_user(mongo_service, email="rollup.sender@example.com")
+    recipient = create_dummy_user(mongo_service, email="rollup.recipient@example.com")
+
+    txn = mongo_service.create_transaction(
+        Transaction(
+            sender=UserInfo(user_id=sender.user_id, user_email=sender.email, user_fname=sender.fname, user_lname=sender.lname),
+            recipient=UserInfo(user_id=recipient.user_id, user_email=recipient.email, user_fname=recipient.fname, user_lname=recipient.lname),
+            sender_device_id="abc123",
+            amount=250.0,
+        )
+    )
+    assert mongo_service.verify_transaction(txn.transaction_id) is True
+    # verifying twice must not count the amount twice
+    assert mongo_service.verify_transaction(txn.transaction_id) is False
+
+    rollups = mongo_service.monthly_spend_model.read_by_user(sender.user_id)
+    assert len(rollups) == 1
+    assert rollups[0]["total_spent"] == 250.0
+    assert rollups[0]["txn_count"] == 1
+
+    # the backfill rebuilds the same rollups from the history
+    mongo_service.monthly_spend_model.collection.delete_many({})
+    assert mongo_service.rebuild_monthly_spend() == 1
+    rollups = mongo_service.monthly_spend_model.read_by_user(sender.user_id)
+    assert rollups[0]["total_spent"] == 250.0
+
+
+
+def test_flag_transaction_after_verification(mongo_service):
+    sender = create_dummy_user(mongo_service, email="flag.sender@example.com")
+    recipient = create_dummy_user(mongo_service, email="flag.recipient@example.com")
+    txn = mongo_service.create_transaction(
+        Transaction(
+            sender=UserInfo(user_id=sender.user_id, user_email=sender.email, user_fname=sender.fname, user_lname=sender.lname),
+            recipient=UserInfo(user_id=recipient.user_id, user_email=recipient.email, user_fname=recipient.fname, user_lname=recipient.lname),
+            sender_device_id="abc123",
+            amount=250.0,
+        )
+    )
+    mongo_service.verify_transaction(txn.transaction_id)
+
+    assert mongo_service.flag_transaction(txn.transaction_id, "circular") == "verified"
+    # flagging twice must not decrement the rollup twice
+    assert mongo_service.flag_transaction(txn.transaction_id, "circular") is None
+
+    assert mongo_service.get_transaction_by_id(txn.transaction_id)["status"] == "suspicious"
+    rollups = mongo_service.monthly_spend_model.read_by_user(sender.user_id)
+    assert rollups[0]["total_spent"] == 0.0
+    assert rollups[0]["txn_count"] == 0
+
+# Test: a month whose only verified transaction is flagged should leave the spending history
+def test_flag_only_transaction_of_month(mongo_service):
+    sender = create_dummy_user(mongo_service, email="month.sender@example.com")
+    recipient = create_dummy_user(mongo_service, email="month.recipient@example.com")
+    txns = {}
+    for month, amount in ((8, 100.0), (9, 100.0), (10, 150.0)):
+        txns[month] = mongo_service.create_transaction(
+            Transaction(
+                sender=UserInfo(user_id=sender.user_id, user_email=sender.email, user_fname=sender.fname, user_lname=sender.lname),
+                recipient=UserInfo(user_id=recipient.user_id, user_email=recipient.email, user_fname=recipient.fname, user_lname=recipient.lname),
+                sender_device_id="abc123",
+                amount=amount,
+                timestamp=datetime(2026, month, 5),
+            )
+        )
+        mongo_service.verify_transaction(txns[month].transaction_id)
+    now = datetime(2026, 10, 20)
+    assert check_suspicious_monthly_spent(mongo_service.get_detection_features(sender.user_id), now=now) is False
+
+    assert mongo_service.flag_transaction(txns[9].transaction_id, "circular") == "verified"
+
+    features = mongo_service.get_detection_features(sender.user_id)
+    assert features["monthly_spending"] == {(2026, 8): 100.0, (2026, 10): 150.0}
+    assert check_suspicious_monthly_spent(features, now=now) is False
+
+# Test: a verification interrupted before the rollup update should be repaired by the reconcile
+@pytest.mark.live
+def test_reconcile_monthly_spend(mongo_service):
+    sender = create_dummy_user(mongo_service, email="reconcile.sender@example.com")
+    recipient = create_dummy_user(mongo_service, email="reconcile.recipient@example.com")
+    txn = mongo_service.create_transaction(
+        Transaction(
+            sender=UserInfo(user_id=sender.user_id, user_email=sender.email, user_fname=sender.fname, user_lname=sender.lname),
+            recipient=UserInfo(user_id=recipient.user_id, user_email=recipient.email, user_fname=recipient.fname, user_lname=recipient.lname),
+            sender_device_id="abc123",
+            amount=250.0,
+        )
+    )
+    with patch.object(mongo_service.monthly_spend_model, 'increment', side_effect=ConnectionError("down")):
+        with pytest.raises(ConnectionError):
+            mongo_service.verify_transaction(txn.transaction_id)
+    assert mongo_service.monthly_spend_model.read_by_user(sender.user_id) == []
+
+    assert mongo_service.reconcile_monthly_spend(older_than_seconds=60) == 0  # still in flight
+    assert mongo_service.reconcile_monthly_spend(older_than_seconds=0) == 1
+    assert mongo_service.monthly_spend_model.read_by_user(sender.user_id)[0]["total_spent"] == 250.0
+    assert test_db.transactions.count_documents({"spend_pending": {"$exists": True}}) == 0
+
+@pytest.mark.live
+def test_service_queries_use_indexes(mongo_service):
+    ensure_indexes()
+    assert check_query_plans() == []
+
+# Test: the foreign query of each $lookup of the feature aggregation should be derived from its join
+@pytest.mark.live
+def test_lookup_queries(mongo_service):
+    lookups = [stage["$lookup"] for stage in mongo_service.detection_features_pipeline("001") if "$lookup" in stage]
+    assert [_lookup_query(lookup, "001") for lookup in lookups] == [
+        {"user_id": "001"}, {"sender.user_id": "001"}, {"user_ids": "001"},
+    ]
+    assert _lookup_query({"from": "users", "pipeline": [{"$match": {"score": 1}}], "as": "all"}, "001") is None
+
+
+@pytest.mark.live
+def test_device_users_cardinality(mongo_service):
+    users = [create_dummy_user(mongo_service, email=f"device{i}@example.com") for i in range(6)]
+    for user in users:
+        for _ in range(2):  # logging twice with a device must not count twice
+            mongo_service.log_device(
+                DeviceLog(user_id=user.user_id, mac_address="dd:dd:dd:dd:dd:00", ip_address="1.1.1.1", location="Paris")
+            )
+    mongo_service.log_device(
+        DeviceLog(user_id=users[0].user_id, mac_address="dd:dd:dd:dd:dd:01", ip_address="1.1.1.1", location="Paris")
+    )
+
+    assert mongo_service.count_devices_by_user(users[0].user_id) == 2
+    assert mongo_service.count_devices_by_user(users[1].user_id) == 1
+    assert mongo_service.has_shared_device(users[1].user_id) is True
+    assert mongo_service.has_shared_device(users[1].user_id, max_users=6) is False
+
+    # the backfill rebuilds the same index from the device logs
+    mongo_service.device_users_model.collection.delete_many({})
+    assert mongo_service.rebuild_device_users() == 2
+    assert mongo_service.count_devices_by_user(users[0].user_id) == 2
+    assert mongo_service.has_shared_device(users[1].user_id) is True
+
+
+@pytest.mark.live
+def test_id_block_allocator(mongo_service):
+    allocator = IdBlockAllocator("test_id", block_size=10)
+    ids = [allocator.next_id() for _ in range(25)]
+
+    assert ids[:3] == ["001", "002", "003"]
+    assert ids == sorted(ids) and len(set(ids)) == 25
+    # one counter update per block, the next one reserved ahead
+    assert test_db.counters.find_one({"_id": "test_id"})["seq"] == 30
+
+# Test: ids should keep increasing when a block runs out during a slow refill
+def test_id_block_allocator_slow_refill():
+    counter = {"seq": 0}
+    counter_lock = threading.Lock()
+
+    def reserve_range(name, count):
+        with counter_lock:
+            counter["seq"] += count
+            block = range(counter["seq"] - count + 1, counter["seq"] + 1)
+        if threading.current_thread().name.startswith("id-refill"):
+            time.sleep(0.05)  # the current block runs out before the refill returns
+        return block
+
+    with patch("app.models.mongo_model._reserve_range", side_effect=reserve_range):
+        allocator = IdBlockAllocator("test_id", block_size=4, refill_ratio=0.25)
+        ids = [int(allocator.next_id()) for _ in range(20)]
+
+    assert ids == list(range(1, 21))
@@ -12,6 +12,9 @@ from app.models.neo4j_model import (
 from app.services.neo4j_service import Neo4jService
 from app.models.mongo_model import TransactionStatus
 
+# the Cypher queries of the models, on the live database
+pytestmark = pytest.mark.live
+
 
 @pytest.fixture
 def user_model():
@@ -166,6 +169,35 @@ def test_user_user_connection(neo4j_service, txn_model, user_model, test_user, t
     assert any(conn["receiver_id"] == test_receiver.user_id for conn in connections)
 
 
+def test_record_transaction(neo4j_service, txn_model, user_model, test_user, test_receiver, test_transaction):
+    user_model.create(test_user)
+    user_model.create(test_receiver)
+
+    result = neo4j_service.record_transaction(test_transaction, test_user.user_id, test_receiver.user_id)
+    assert result["txn"]["transaction_id"] == test_transaction.transaction_id
+    assert txn_model.read(test_transaction.transaction_id) is not None
+
+    connections = neo4j_service.get_user_user_connections({"user_id": test_user.user_id})
+    assert any(conn["receiver_id"] == test_receiver.user_id for conn in connections)
+
+    # unknown users are skipped
+    assert neo4j_service.record_transaction(test_transaction, test_user.user_id, "unknown") is None
+
+def test_record_transactions_batch(neo4j_service, user_model, test_user, test_receiver):
+    user_model.create(test_user)
+    user_model.create(test_receiver)
+    rows = [
+        dict(TransactionSchema(transaction_id=f"10{i}", amount=10 * i, timestamp=datetime.utcnow().isoformat()).dict(),
+             sender_id=test_user.user_id, receiver_id=test_receiver.user_id)
+        for i in range(1, 4)
+    ]
+
+    records = neo4j_service.record_transactions(rows)
+    assert [r["txn"]["transaction_id"] for r in records] == ["101", "102", "103"]
+    connections = neo4j_service.get_user_transactions_connections({"user_id": test_user.user_id})
+    assert len(connections) == 3
+
+
 def test_user_device_connection(neo4j_service, device_model, user_model, test_user, test_device):
     user_model.create(test_user)
     device_model.create(test_device)
@@ -239,4 +271,46 @@ def test_detect_circular_transaction(neo4j_service, user_model, txn_model):
     assert "005" in path_ids
     
     assert path_ids[0] == "001"
-    assert path_ids[-1] == "001"
\ No newline at end of file
+    assert path_ids[-1] == "001"
+
+def test_detect_circular_transaction_from_new_edge(neo4j_service, user_model, txn_model):
+    now = datetime.utcnow()
+    for i in range(1, 4):
+        user_model.create(UserSchema(user_id=f"{i:03d}", fname="U", lname=str(i), score=100))
+
+    # 001 -> 002 -> 003 -> 001, the last one closing the cycle
+    edges = [("001", "002", "101", 0), ("002", "003", "102", 5), ("003", "001", "103", 10)]
+    for sender, receiver, transaction_id, minutes in edges:
+        txn_model.create(TransactionSchema(
+            transaction_id=transaction_id,
+            amount=100,
+            timestamp=(now + timedelta(minutes=minutes)).isoformat()
+        ))
+        neo4j_service.connect_user_transaction_user({
+            "sender_id": sender,
+            "receiver_id": receiver,
+            "transaction_id": transaction_id
+        })
+
+    path = neo4j_service.detect_circular_transaction({
+        "user_id": "003",
+        "transaction_id": "103",
+        "max_diff_minutes": 30
+    })
+    assert path is not None
+    assert path["path_ids"] == ["003", "103", "001", "101", "002", "102", "003"]
+    assert path["num_transactions"] == 3
+
+    # the cycle does not fit in the time window
+    assert neo4j_service.detect_circular_transaction({
+        "user_id": "003",
+        "transaction_id": "103",
+        "max_diff_minutes": 8
+    }) is None
+
+    # the cycle is longer than the depth limit
+    assert neo4j_service.detect_circular_transaction({
+        "user_id": "003",
+        "transaction_id": "103",
+        "max_depth": 2
+    }) is None
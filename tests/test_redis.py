@@ -1,5 +1,7 @@
-from unittest.mock import patch
-from app.models.redis_model import RedisTrustScoreModel
+import pytest
+from unittest.mock import MagicMock, patch
+from app.db.backend import RedisTrustScoreModel
+from app.db.redis import redis_client
 
 
 # Test: get_score should return integer value when valid data exists
@@ -57,22 +59,219 @@ def test_update_score_no_existing(redis_service, caplog):
 
 # Test: get_or_load_score should return cached score if it exists
 def test_get_or_load_score_existing(redis_service):
-    with patch.object(RedisTrustScoreModel, 'get', return_value=b'15'):
+    with patch.object(RedisTrustScoreModel, 'read', return_value=(b'15', 3600000, 1)):
         result = redis_service.get_or_load_score('user_1', lambda x: 100)
         assert result == 15
 
 # Test: get_or_load_score should call loader and set value if cache is empty
 def test_get_or_load_score_load_and_set(redis_service):
-    with patch.object(RedisTrustScoreModel, 'get', return_value=None), \
-        patch.object(RedisTrustScoreModel, 'set', return_value=True) as mock_set:
+    with patch.object(RedisTrustScoreModel, 'read', return_value=(None, -2, 1)), \
+        patch.object(RedisTrustScoreModel, 'lock'), \
+        patch.object(RedisTrustScoreModel, 'set_if_missing', return_value=True) as mock_set:
         loader = lambda user_id: 200
         result = redis_service.get_or_load_score('user_1', loader)
-        mock_set.assert_called_once_with('user_1', '200', 3600)
+        mock_set.assert_called_once_with('user_1', '200', 660)
         assert result == 200
 
 # Test: get_or_load_score should return 0 if neither cache nor loader returns value
 def test_get_or_load_score_load_none(redis_service):
-    with patch.object(RedisTrustScoreModel, 'get', return_value=None):
+    with patch.object(RedisTrustScoreModel, 'read', return_value=(None, -2, 1)), \
+        patch.object(RedisTrustScoreModel, 'lock'):
         loader = lambda user_id: None
         result = redis_service.get_or_load_score('user_1', loader)
         assert result == 0
+
+# Test: a miss should wait for the request already loading the score instead of loading it again
+def test_get_or_load_score_waits_for_lock(redis_service):
+    with patch.object(RedisTrustScoreModel, 'read', return_value=(None, -2, 1)), \
+        patch.object(RedisTrustScoreModel, 'lock') as mock_lock, \
+        patch.object(RedisTrustScoreModel, 'get', side_effect=[None, b'70']):
+        mock_lock.return_value.acquire.return_value = False
+        loader = MagicMock(return_value=100)
+        assert redis_service.get_or_load_score('user_1', loader) == 70
+        loader.assert_not_called()
+
+# Test: a stale score should be served while it is refreshed in the background
+def test_get_or_load_score_stale_while_revalidate(redis_service):
+    with patch.object(RedisTrustScoreModel, 'read', return_value=(b'15', 30000, 1)), \
+        patch.object(redis_service, '_refresh_in_background') as mock_refresh:
+        loader = lambda user_id: 100
+        assert redis_service.get_or_load_score('user_1', loader) == 15
+        mock_refresh.assert_called_once_with('user_1', b'15', 30000, 600, loader)
+
+# Test: a refresh should only be queued by the read holding the user's lock
+def test_refresh_in_background_single_flight(redis_service):
+    with patch.object(RedisTrustScoreModel, 'lock') as mock_lock, \
+        patch('app.services.redis_service.get_refresh_executor') as mock_executor:
+        mock_lock.return_value.acquire.return_value = False
+        redis_service._refresh_in_background('user_1', b'15', 30000, 600, lambda user_id: 100)
+        mock_executor.assert_not_called()
+
+        mock_lock.return_value.acquire.return_value = True
+        redis_service._refresh_in_background('user_1', b'15', 30000, 600, lambda user_id: 100)
+        mock_executor.return_value.submit.assert_called_once()
+
+# Test: the synchronous MongoDB write should persist the dirty score, then clear it
+def test_update_score_mongo_clears_dirty():
+    from app.services import score_service
+
+    with patch.object(score_service.Config, 'SCORE_WRITE_BEHIND', False), \
+        patch.object(score_service.redis, 'get_dirty_score', return_value=80), \
+        patch.object(score_service.redis, 'clear_dirty_scores') as mock_clear, \
+        patch.object(score_service.mongo, 'update_score') as mock_update:
+        score_service.update_score_mongo('user_1', old_score=100)
+
+    mock_update.assert_called_once_with('user_1', 80)
+    mock_clear.assert_called_once_with({'user_1': 80})
+
+# Test: the cache TTL should grow with the reads of the user
+def test_adaptive_ttl(redis_service):
+    assert redis_service._adaptive_ttl(1) == 600
+    assert 600 < redis_service._adaptive_ttl(10) < 14400
+    assert redis_service._adaptive_ttl(20) == redis_service._adaptive_ttl(500) == 14400
+
+# Test: apply_deductions should run the script once when the score is cached
+def test_apply_deductions(redis_service):
+    with patch.object(RedisTrustScoreModel, 'deduct', return_value=(80, ['new_account'])) as mock_deduct:
+        loader = lambda user_id: (100, [])
+        result = redis_service.apply_deductions('user_1', [('new_account', -5, False), ('circular_transaction_detected', -30, True)], loader)
+        key, rules_key, args, dirty_key = mock_deduct.call_args[0]
+        assert (key, rules_key, dirty_key) == ('user_1', 'score_rules:user_1', None)
+        assert args == [3600, '', 'new_account', -5, 0, 'circular_transaction_detected', -30, 1]
+        assert result == (80, ['new_account'])
+
+# Test: the deduction script should keep the TTL of the cached score
+@pytest.mark.live
+def test_apply_deductions_keeps_ttl(redis_service):
+    redis_service.set_score('user_1', 100, expire_seconds=14400)
+    redis_service.model.load_rules('score_rules:user_1', [], 3600)
+    assert redis_service.apply_deductions('user_1', [('new_account', -5, False)], lambda user_id: None) == (95, ['new_account'])
+    assert redis_client.pttl('user_1') > 3600 * 1000
+
+# Test: apply_deductions should load the score and rules when missing, then retry
+def test_apply_deductions_loads_missing_state(redis_service):
+    with patch.object(RedisTrustScoreModel, 'deduct', side_effect=[(None, []), (95, [])]) as mock_deduct, \
+        patch.object(RedisTrustScoreModel, 'set_if_missing', return_value=True) as mock_set, \
+        patch.object(RedisTrustScoreModel, 'load_rules', return_value=True) as mock_load:
+        loader = lambda user_id: (100, ['new_account'])
+        result = redis_service.apply_deductions('user_1', [('new_account', -5, False)], loader)
+        mock_set.assert_called_once_with('user_1', '100', 3600)
+        mock_load.assert_called_once_with('score_rules:user_1', ['new_account'], 3600)
+        assert mock_deduct.call_count == 2
+        assert result == (95, [])
+
+# Test: apply_deductions should not touch redis for an unknown user
+def test_apply_deductions_unknown_user(redis_service):
+    with patch.object(RedisTrustScoreModel, 'deduct', return_value=(None, [])), \
+        patch.object(RedisTrustScoreModel, 'set_if_missing') as mock_set:
+        assert redis_service.apply_deductions('user_1', [], lambda user_id: None) == (None, [])
+        mock_set.assert_not_called()
+
+# Test: get_scores should read all the scores with one MGET
+def test_get_scores_mget(redis_service):
+    with patch.object(RedisTrustScoreModel, 'get_many', return_value=[b'42', None, b'bad']) as mock_mget:
+        scores = redis_service.get_scores(['u1', 'u2', 'u3'])
+        mock_mget.assert_called_once_with(['u1', 'u2', 'u3'])
+        assert scores == {'u1': 42, 'u2': None, 'u3': None}
+
+# Test: batch lookup should fill the cache misses from one MongoDB query and cache them
+def test_score_service_get_scores():
+    from app.services import score_service
+
+    def mongo_scores(user_ids=(), emails=()):
+        users = [{"user_id": "u2", "email": "u2@example.com", "score": 70},
+                 {"user_id": "u3", "email": "u3@example.com", "score": 30}]
+        return [u for u in users if u["user_id"] in user_ids or u["email"] in emails]
+
+    with patch.object(score_service.mongo, 'get_scores', side_effect=mongo_scores) as mock_mongo, \
+        patch.object(score_service.redis, 'get_scores', return_value={'u1': 90, 'u2': None, 'u4': None, 'u3': 35}), \
+        patch.object(score_service.redis, 'get_dirty_score', return_value=None), \
+        patch.object(score_service.redis, 'set_scores') as mock_set:
+        results = score_service.get_scores(user_ids=['u1', 'u2', 'u4'], emails=['u3@example.com'])
+
+    assert mock_mongo.call_count == 2
+    assert mock_mongo.call_args.kwargs == {"user_ids": ['u2', 'u4']}
+    mock_set.assert_called_once_with({'u2': 70})
+    assert results == {
+        'u1': {"user_id": 'u1', "email": None, "score": 90},
+        'u2': {"user_id": 'u2', "email": 'u2@example.com', "score": 70},
+        'u3': {"user_id": 'u3', "email": 'u3@example.com', "score": 35},
+    }
+
+# Test: batch lookup should prefer a score waiting for the write-behind flush to MongoDB's
+def test_score_service_get_scores_dirty():
+    from app.services import score_service
+
+    with patch.object(score_service.mongo, 'get_scores', return_value=[{"user_id": "u1", "email": "u1@example.com", "score": 100}]), \
+        patch.object(score_service.redis, 'get_scores', return_value={'u1': None}), \
+        patch.object(score_service.redis, 'get_dirty_score', return_value=80), \
+        patch.object(score_service.redis, 'set_scores') as mock_set:
+        results = score_service.get_scores(user_ids=['u1'])
+
+    mock_set.assert_called_once_with({'u1': 80})
+    assert results['u1']["score"] == 80
+
+# Test: set_scores should not overwrite a score cached meanwhile
+def test_set_scores_keeps_cached(redis_service):
+    redis_service.set_score('user_1', 95)
+    redis_service.set_scores({'user_1': 100, 'user_2': 70})
+    assert redis_service.get_score('user_1') == 95
+    assert redis_service.get_score('user_2') == 70
+
+# Test: a scoring event failing once after its deduction should deduct it once
+def test_scoring_event_retry_deducts_once():
+    from app.services import score_service
+    from app.services.scoring_pipeline import ScoringWorker, streams
+
+    attempts = []
+
+    def handler(event):
+        attempts.append(score_service.calculate_score(event["u"], event["x"])[0])
+        if len(attempts) == 1:
+            raise RuntimeError("failed after the deduction")
+
+    worker = ScoringWorker(worker_id="worker-1", handlers={"txn": handler}, partitions=1)
+    with patch.object(score_service, 'log_suspicious_actions', return_value={'circular_transaction_detected'}), \
+        patch.object(score_service.mongo_user, 'read', return_value={"user_id": "u1", "score": 100}), \
+        patch.object(score_service.mongo_user, 'append_deductions'), \
+        patch.object(streams, 'ack'):
+        worker._process("scoring:0", "1-0", {"t": "txn", "u": "u1", "x": "010"})
+
+    assert attempts == [70, 70]
+    assert worker.stats == {"processed": 1, "retried": 1, "dead": 0}
+
+# Test: deductions marked dirty should pass the dirty hash to the script
+def test_apply_deductions_mark_dirty(redis_service):
+    with patch.object(RedisTrustScoreModel, 'deduct', return_value=(95, ['new_account'])) as mock_deduct:
+        redis_service.apply_deductions('user_1', [('new_account', -5, False)], lambda user_id: (100, []), mark_dirty=True)
+        assert mock_deduct.call_args[0][3] == 'score_dirty'
+
+# Test: flush should persist the dirty scores batch by batch, then clear them
+def test_score_flusher_flush():
+    from app.services.score_flusher import ScoreFlusher
+    from app.db.backend import MongoService
+    from app.services.redis_service import RedisTrustScoreService
+
+    batches = [{'u1': 70, 'u2': 40}, {'u3': 95}]
+    with patch.object(RedisTrustScoreService, 'get_dirty_scores', side_effect=batches + [{}]) as mock_dirty, \
+        patch.object(RedisTrustScoreService, 'clear_dirty_scores') as mock_clear, \
+        patch.object(MongoService, 'update_scores') as mock_update:
+        flushed = ScoreFlusher(interval=60, batch_size=2).flush()
+
+    assert flushed == 3
+    mock_dirty.assert_called_with(2)
+    assert [c.args[0] for c in mock_update.call_args_list] == batches
+    assert [c.args[0] for c in mock_clear.call_args_list] == batches
+
+# Test: a failed MongoDB write should leave the scores dirty
+def test_score_flusher_keeps_scores_on_failure():
+    from app.services.score_flusher import ScoreFlusher
+    from app.db.backend import MongoService
+    from app.services.redis_service import RedisTrustScoreService
+
+    with patch.object(RedisTrustScoreService, 'get_dirty_scores', return_value={'u1': 70}), \
+        patch.object(RedisTrustScoreService, 'clear_dirty_scores') as mock_clear, \
+        patch.object(MongoService, 'update_scores', side_effect=RuntimeError("down")):
+        with pytest.raises(RuntimeError):
+            ScoreFlusher(interval=60, batch_size=10).flush()
+    mock_clear.assert_not_called()
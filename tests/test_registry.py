@@ -0,0 +1,34 @@
+import os
+from unittest.mock import MagicMock, patch
+
+from app.db.registry import ConnectionRegistry, LazyClient
+
+
+# Test: clients should be created on first use, once per process
+def test_registry_creates_clients_lazily():
+    registry = ConnectionRegistry()
+    factory = MagicMock(side_effect=lambda: MagicMock())
+    registry.register("db", factory)
+    factory.assert_not_called()
+
+    client = registry.get("db")
+    assert registry.get("db") is client
+    assert factory.call_count == 1
+
+    # in a forked child the parent's client is dropped, not closed
+    with patch.object(os, "getpid", return_value=os.getpid() + 1):
+        assert registry.get("db") is not client
+    client.close.assert_not_called()
+    assert factory.call_count == 2
+
+# Test: close should close the clients of the process
+def test_registry_close():
+    registry = ConnectionRegistry()
+    client = MagicMock()
+    registry.register("db", lambda: client)
+    lazy = LazyClient(lambda: registry.get("db"))
+
+    lazy.ping()
+    registry.close()
+    client.ping.assert_called_once()
+    client.close.assert_called_once()
@@ -0,0 +1,91 @@
+import pytest
+from unittest.mock import patch
+from app.utils.config import Config
+from app.services.scoring_pipeline import (
+    ScoringWorker,
+    DEAD_LETTER_STREAM,
+    GROUP,
+    partition_of,
+    publish,
+    stream_key,
+    streams,
+)
+
+# the Redis Streams have no in-memory stand-in
+pytestmark = pytest.mark.live
+
+
+def make_worker(handlers, worker_id="worker-1", **kwargs):
+    kwargs.setdefault("partitions", 4)
+    return ScoringWorker(worker_id=worker_id, handlers=handlers, block_ms=10, **kwargs)
+
+
+# Test: the events of a user should be handled in publication order and acknowledged
+@patch.object(Config, 'SCORING_PARTITIONS', 4)
+def test_worker_handles_user_events_in_order():
+    handled = []
+    worker = make_worker({"txn": lambda event: handled.append((event["u"], event["x"]))})
+    for i in range(5):
+        publish("txn", "001", x=str(i))
+        publish("txn", "002", x=str(i))
+    while worker.poll():
+        pass
+
+    assert [x for u, x in handled if u == "001"] == ["0", "1", "2", "3", "4"]
+    assert [x for u, x in handled if u == "002"] == ["0", "1", "2", "3", "4"]
+    pending = streams.read({stream_key(partition_of("001", 4)): "0"}, GROUP, worker.worker_id, 10, 10)
+    assert all(not entries for _, entries in pending)
+    worker.release_all()
+
+# Test: a failing event should be retried, then dead-lettered without blocking the partition
+@patch.object(Config, 'SCORING_PARTITIONS', 4)
+def test_worker_retries_then_dead_letters():
+    attempts = []
+
+    def handler(event):
+        attempts.append(event["x"])
+        if event["x"] == "bad" or (event["x"] == "flaky" and attempts.count("flaky") < 2):
+            raise RuntimeError("boom")
+
+    worker = make_worker({"txn": handler}, max_attempts=3)
+    for x in ("bad", "flaky", "ok"):
+        publish("txn", "001", x=x)
+    while worker.poll():
+        pass
+
+    assert attempts == ["bad", "bad", "bad", "flaky", "flaky", "ok"]
+    assert worker.stats == {"processed": 2, "retried": 3, "dead": 1}
+    assert streams.length(DEAD_LETTER_STREAM) == 1
+    worker.release_all()
+
+# Test: partitions should be shared out between the live workers
+def test_workers_share_partitions():
+    first = make_worker({}, worker_id="worker-1")
+    first.poll()
+    assert first.owned == {0, 1, 2, 3}
+
+    second = make_worker({}, worker_id="worker-2")
+    second.poll()  # heartbeat seen by the first worker on its next rebalance
+    first._rebalance()
+    second._rebalance()
+    assert len(first.owned) == len(second.owned) == 2
+    assert not first.owned & second.owned
+    first.release_all()
+    second.release_all()
+
+# Test: the pending events of a dead worker should be processed by the next owner of the partition
+@patch.object(Config, 'SCORING_PARTITIONS', 4)
+def test_worker_recovers_pending_events():
+    crashed = make_worker({"txn": lambda event: (_ for _ in ()).throw(SystemExit)}, worker_id="crashed")
+    publish("txn", "001", x="1")
+    try:
+        crashed.poll()
+    except SystemExit:
+        pass
+    crashed.release_all()  # its lease expires, the event stays pending
+
+    handled = []
+    worker = make_worker({"txn": lambda event: handled.append(event["x"])}, worker_id="worker-2")
+    worker.poll()
+    assert handled == ["1"]
+    worker.release_all()
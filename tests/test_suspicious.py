@@ -0,0 +1,177 @@
+import time
+from datetime import datetime
+from unittest.mock import patch
+from app.services import suspicious_service
+from app.db.backend import MongoService, Neo4jService
+from app.utils.config import Config
+from app.services.suspicious_service import (
+    run_detectors,
+    log_suspicious_actions,
+    check_suspicious_monthly_spent,
+    is_new_account,
+    has_multiple_devices,
+    has_shared_device_count,
+    has_circular_transactions,
+    has_suspicious_connections,
+)
+from app.services.detector_registry import COST_CHEAP, COST_EXPENSIVE, DETECTORS, INPUTS, DetectionContext, Detector, plan_detectors
+
+
+# Test: run_detectors should merge the rules of every triggered detector
+def test_run_detectors_merges_results():
+    detectors = [
+        ('rule_a', lambda: True, ()),
+        ('rule_b', lambda: False, ()),
+        ('rule_c', lambda x: x == 1, (1,)),
+    ]
+    assert run_detectors(detectors) == {'rule_a', 'rule_c'}
+
+# Test: run_detectors should run detectors concurrently
+def test_run_detectors_concurrently():
+    detectors = [(f'rule_{i}', time.sleep, (0.2,)) for i in range(5)]
+    start = time.monotonic()
+    run_detectors(detectors)
+    assert time.monotonic() - start < 0.8
+
+# Test: a detector exceeding its timeout should be skipped and logged
+def test_run_detectors_timeout(caplog):
+    detectors = [
+        ('slow', lambda: time.sleep(1) or True, ()),
+        ('fast', lambda: True, ()),
+    ]
+    with caplog.at_level('WARNING'):
+        assert run_detectors(detectors, timeout=0.1) == {'fast'}
+        assert "Detector slow timed out" in caplog.text
+
+# Test: a query aborted by its driver timeout should count as not triggered, and free its thread
+def test_run_detectors_driver_timeout(caplog):
+    from pymongo.errors import ExecutionTimeout
+
+    def aborted():
+        raise ExecutionTimeout("operation exceeded time limit", code=50)
+
+    detectors = [('aborted', aborted, ()), ('fast', lambda: True, ())]
+    with caplog.at_level('WARNING'):
+        assert run_detectors(detectors, timeout=0.5) == {'fast'}
+        assert "Detector aborted aborted by the database" in caplog.text
+    # the threads of the previous tests' timed out detectors return too
+    deadline = time.monotonic() + 2
+    while suspicious_service.detector_pool_busy() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert suspicious_service.detector_pool_busy() == 0
+
+# Test: the Neo4j detectors should pass the detector timeout to the server
+def test_graph_detectors_query_timeout():
+    with patch.object(Neo4jService, 'detect_circular_transaction', return_value=None) as mock_detect, \
+        patch.object(Neo4jService, 'get_user_user_connections', return_value=[]) as mock_connections:
+        assert has_circular_transactions("001", "t1") is False
+        assert has_suspicious_connections("001") is False
+    assert mock_detect.call_args.kwargs == {"timeout": Config.DETECTOR_TIMEOUT}
+    assert mock_connections.call_args.kwargs == {"timeout": Config.DETECTOR_TIMEOUT}
+
+def make_features(**overrides):
+    features = {
+        "user_id": "001",
+        "new_user": False,
+        "monthly_spending": {},
+        "txn_count": 0,
+        "devices": {},
+    }
+    features.update(overrides)
+    return features
+
+# Test: current month spending over twice the past average is suspicious
+def test_check_suspicious_monthly_spent():
+    now = datetime(2025, 3, 15)
+    features = make_features(monthly_spending={(2025, 1): 250, (2025, 2): 200, (2025, 3): 500})
+    assert check_suspicious_monthly_spent(features, now=now) is True
+
+    features = make_features(monthly_spending={(2025, 1): 250, (2025, 2): 200, (2025, 3): 400})
+    assert check_suspicious_monthly_spent(features, now=now) is False
+
+    # no history to compare with
+    features = make_features(monthly_spending={(2025, 3): 5000})
+    assert check_suspicious_monthly_spent(features, now=now) is False
+
+# Test: only existing new users with less than 3 transactions are new accounts
+def test_is_new_account():
+    assert is_new_account(make_features(new_user=True, txn_count=2)) is True
+    assert is_new_account(make_features(new_user=True, txn_count=3)) is False
+    assert is_new_account(make_features(new_user=False)) is False
+    assert is_new_account(make_features(new_user=None)) is False
+
+# Test: device predicates on the per-device user cardinality
+def test_device_predicates():
+    devices = {f"DEVICE{i}": 1 for i in range(6)}
+    assert has_multiple_devices(make_features(devices=devices)) is True
+    assert has_multiple_devices(make_features(devices={"DEVICE0": 6})) is False
+
+    assert has_shared_device_count(make_features(devices={"DEVICE0": 6})) is True
+    assert has_shared_device_count(make_features(devices={"DEVICE0": 5, "DEVICE1": 1})) is False
+
+# Test: the account_features input should mark a new user with 3+ transactions as not new
+def test_account_features_input_settles_new_user():
+    features = make_features(new_user=True, txn_count=3, devices={"DEVICE0": 6})
+    with patch.object(MongoService, 'get_detection_features', return_value=features) as mock_features, \
+        patch.object(MongoService, 'mark_user_not_new', return_value=True) as mock_mark:
+        context = DetectionContext("001")
+        triggered = {
+            registered.rule
+            for registered in DETECTORS.values()
+            if registered.requires == ("account_features",) and registered(context)
+        }
+        assert triggered == {"shared_device_count"}
+        # one feature query shared by the account detectors
+        mock_features.assert_called_once_with("001")
+        mock_mark.assert_called_once_with("001")
+
+def fake_detectors(results, cost=COST_CHEAP, requires=('user_id',)):
+    return {
+        rule: Detector(rule, lambda *args, result=result: result, cost, requires)
+        for rule, result in results.items()
+    }
+
+# Test: log_suspicious_actions should merge the rules of all registered detectors
+def test_log_suspicious_actions_rules():
+    detectors = fake_detectors({'high_txn_amount': True, 'new_account': True, 'shared_device_count': True})
+    detectors.update(fake_detectors(
+        {'suspicious_connections': False, 'circular_transaction_detected': True}, cost=COST_EXPENSIVE
+    ))
+    with patch.dict(DETECTORS, detectors, clear=True):
+        assert log_suspicious_actions('001', '001') == {
+            'high_txn_amount',
+            'new_account',
+            'shared_device_count',
+            'circular_transaction_detected',
+        }
+
+# Test: an input should be loaded once for all the detectors needing it
+def test_detector_inputs_loaded_once():
+    calls = []
+    loader = lambda context: calls.append(context.user_id) or {"user_id": context.user_id}
+    detectors = {
+        'a': Detector('a', lambda user: True, COST_CHEAP, ('user',)),
+        'b': Detector('b', lambda user, txn_id: False, COST_CHEAP, ('user', 'transaction_id')),
+        'c': Detector('c', lambda user: True, COST_EXPENSIVE, ('user',)),
+    }
+    with patch.dict(DETECTORS, detectors, clear=True), patch.dict(INPUTS, {'user': loader}):
+        assert log_suspicious_actions('001', '002') == {'a', 'c'}
+    assert calls == ['001']
+
+# Test: cheap detectors with the same inputs should share a task, expensive ones run alone
+def test_plan_detectors_groups():
+    detectors = {
+        'a': Detector('a', None, COST_CHEAP, ('account_features',)),
+        'b': Detector('b', None, COST_CHEAP, ('account_features',)),
+        'c': Detector('c', None, COST_EXPENSIVE, ('user_id',)),
+        'd': Detector('d', None, COST_CHEAP, ('user',)),
+    }
+    with patch.dict(DETECTORS, detectors, clear=True):
+        plan = {name: [d.rule for d in group] for name, group in plan_detectors()}
+        assert plan == {'c': ['c'], 'a+b': ['a', 'b'], 'd': ['d']}
+        assert [name for name, _ in plan_detectors({'b', 'c'})] == ['c', 'b']
+
+# Test: every rule should have a registered detector
+def test_registered_detectors_cover_rules():
+    from app.utils.trust_rules import RULES
+    assert set(DETECTORS) == set(RULES)
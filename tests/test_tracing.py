@@ -0,0 +1,84 @@
+import json
+import logging
+from unittest.mock import MagicMock, patch
+from app.db.instrumentation import InstrumentedDriver, MongoCommandListener, instrument_redis
+from app.utils.config import Config
+from app.utils.tracing import start_trace, end_trace, current_trace
+
+
+def mongo_event(command_name, command, duration_micros=1500):
+    event = MagicMock(command_name=command_name, command=command, duration_micros=duration_micros)
+    return event
+
+
+# Test: the round trips of a request should be recorded as spans of its trace
+def test_trace_spans():
+    client = MagicMock()
+    instrument_redis(client)
+    listener = MongoCommandListener()
+
+    token = start_trace("request-1")
+    try:
+        client.execute_command("GET", "score:001")
+        client.execute_command("GET", "score:002")
+        listener.started(mongo_event("find", {"find": "users", "filter": {"user_id": "001"}}))
+        listener.succeeded(mongo_event("find", None))
+        trace = current_trace()
+    finally:
+        end_trace(token)
+
+    assert trace.trace_id == "request-1"
+    assert [f"{span.datastore}.{span.operation}" for span in trace.spans] == ["redis.GET", "redis.GET", "mongodb.find"]
+    assert trace.breakdown()["redis.GET"][0] == 2
+    assert 'mongodb.find;desc="1x";dur=1.500' in trace.server_timing()
+    assert current_trace() is None
+
+# Test: an invalid caller trace id should be replaced by a generated one
+def test_trace_id_validation():
+    token = start_trace("bad id\r\nSet-Cookie: x")
+    try:
+        assert current_trace().trace_id.isalnum()
+    finally:
+        end_trace(token)
+
+# Test: a round trip slower than SLOW_QUERY_MS should be logged with its statement and parameters
+@patch.object(Config, 'SLOW_QUERY_MS', 1.0)
+def test_slow_query_log(caplog):
+    listener = MongoCommandListener()
+    with caplog.at_level(logging.WARNING, logger="app.slow_queries"):
+        listener.started(mongo_event("aggregate", {"aggregate": "transactions", "pipeline": [{"$match": {}}], "lsid": {}}))
+        listener.succeeded(mongo_event("aggregate", None, duration_micros=2500))
+        listener.started(mongo_event("find", {"find": "users"}))
+        listener.succeeded(mongo_event("find", None, duration_micros=500))
+
+    assert len(caplog.records) == 1
+    entry = json.loads(caplog.records[0].getMessage())
+    assert entry["operation"] == "aggregate"
+    assert entry["duration_ms"] == 2.5
+    assert entry["statement"] == "aggregate transactions"
+    assert entry["parameters"] == {"pipeline": "[{'$match': {}}]"}
+
+# Test: a profiled Neo4j query span should carry the db hits and rows of its summary
+@patch.object(Config, 'NEO4J_PROFILE', True)
+def test_neo4j_query_summary():
+    neo4j_driver = MagicMock()
+    neo4j_session = neo4j_driver.session.return_value
+    summary = neo4j_session.run.return_value.consume.return_value
+    summary.result_available_after, summary.result_consumed_after = 3, 4
+    summary.profile = {"dbHits": 2, "rows": 5, "children": [{"dbHits": 10, "rows": 20}]}
+    driver = InstrumentedDriver(neo4j_driver)
+
+    token = start_trace()
+    try:
+        def detect_circular_transaction():
+            with driver.session() as session:
+                session.run("MATCH (u:User {user_id: $user_id}) RETURN u", user_id="001")
+        detect_circular_transaction()
+        trace = current_trace()
+    finally:
+        end_trace(token)
+
+    assert neo4j_session.run.call_args.args[0].startswith("PROFILE MATCH")
+    span = trace.spans[0].to_dict()
+    assert span["name"] == "neo4j.detect_circular_transaction"
+    assert (span["db_hits"], span["rows"], span["available_after_ms"]) == (12, 5, 3)
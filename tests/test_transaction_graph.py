@@ -0,0 +1,113 @@
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+
+from app.services.transaction_graph import SYNC_MARGIN_SECONDS, TransactionGraph
+
+
+def add(graph, sender, receiver, txn_id, minutes, amount=100.0):
+    start = datetime(2025, 1, 1, 12, 0)
+    graph.add_transaction(sender, receiver, txn_id, start + timedelta(minutes=minutes), amount)
+
+
+# Test: connections should include the users sent to and received from
+def test_user_user_connections():
+    graph = TransactionGraph(max_edges=10)
+    graph.add_user("003", 40)
+    add(graph, "001", "002", "t1", 0)
+    add(graph, "003", "001", "t2", 1)
+
+    connections = graph.get_user_user_connections("001")
+    assert sorted(c["receiver_id"] for c in connections) == ["002", "003"]
+    assert {"receiver_id": "003", "score": 40} in connections
+    assert graph.get_user_user_connections("unknown") == []
+
+# Test: a cycle closed by the new transaction should be detected within the time window
+def test_detect_circular_transaction_from_new_edge():
+    graph = TransactionGraph(max_edges=10)
+    add(graph, "002", "003", "t1", 0)
+    add(graph, "003", "001", "t2", 5)
+    add(graph, "001", "002", "t3", 10)
+
+    result = graph.detect_circular_transaction({"user_id": "001", "transaction_id": "t3", "max_depth": 4})
+    assert result["path_ids"] == ["001", "t3", "002", "t1", "003", "t2", "001"]
+    assert result["num_transactions"] == 3
+    assert result["time_diff"] == 10
+
+    # too long for the window
+    assert graph.detect_circular_transaction(
+        {"user_id": "001", "transaction_id": "t3", "max_diff_minutes": 5}
+    ) is None
+    # too deep
+    assert graph.detect_circular_transaction(
+        {"user_id": "001", "transaction_id": "t3", "max_depth": 2}
+    ) is None
+    # full search through the user
+    assert graph.detect_circular_transaction({"user_id": "002"})["num_transactions"] == 3
+
+# Test: the oldest edges should be evicted once the ring buffer is full
+def test_ring_buffer_eviction():
+    graph = TransactionGraph(max_edges=2)
+    add(graph, "001", "002", "t1", 0)
+    add(graph, "002", "001", "t2", 1)
+    assert graph.detect_circular_transaction({"user_id": "001"}) is not None
+
+    add(graph, "003", "004", "t3", 2)
+    assert graph.detect_circular_transaction({"user_id": "001"}) is None
+    assert graph.get_user_user_connections("001") == [{"receiver_id": "002", "score": None}]
+    assert graph.stats()["edges"] == 2
+
+# Test: an unknown user should raise KeyError, for the caller to query Neo4j
+def test_detect_circular_transaction_unknown_user():
+    graph = TransactionGraph(max_edges=10)
+    add(graph, "001", "002", "t1", 0)
+    with pytest.raises(KeyError):
+        graph.detect_circular_transaction({"user_id": "003"})
+
+# Test: the edges written by other processes should be read by a sync
+def test_sync_from_neo4j():
+    graph = TransactionGraph(max_edges=10)
+    add(graph, "002", "003", "t1", 0)
+    add(graph, "003", "001", "t2", 5)
+    graph._synced_from = 1_000_000
+    driver = MagicMock()
+    driver.session.return_value.__enter__.return_value.run.return_value = [{
+        "sender_id": "001", "receiver_id": "002", "sender_score": 90, "receiver_score": 80,
+        "transaction_id": "t3", "timestamp": "2025-01-01T12:10:00", "amount": 100.0,
+        "created_at": 1_050_000,
+    }]
+
+    graph.sync_from_neo4j(driver)
+
+    run = driver.session.return_value.__enter__.return_value.run
+    assert run.call_args.kwargs == {"since": 1_000_000}
+    assert graph._synced_from == 1_050_000 - SYNC_MARGIN_SECONDS * 1000
+    assert graph.detect_circular_transaction({"user_id": "001", "transaction_id": "t3"})["num_transactions"] == 3
+
+    # no new edge: the next sync reads from the same point
+    run.return_value = []
+    graph.sync_from_neo4j(driver)
+    assert graph._synced_from == 1_050_000 - SYNC_MARGIN_SECONDS * 1000
+
+# Test: the edges added to a graph being replaced should reach its successor
+def test_retire_replays_edges():
+    previous = TransactionGraph(max_edges=10)
+    add(previous, "001", "002", "t1", 0)
+    since_seq = previous.stats()["next_seq"]
+    add(previous, "002", "001", "t2", 1)
+
+    graph = TransactionGraph(max_edges=10)
+    add(graph, "001", "002", "t1", 0)
+    previous.retire(graph, since_seq)
+    add(previous, "001", "003", "t3", 2)
+
+    assert graph.stats()["edges"] == 3
+    assert graph.detect_circular_transaction({"user_id": "001", "transaction_id": "t1"}) is not None
+
+# Test: the size should count the transaction ids, not only the arrays
+def test_stats_count_objects():
+    graph = TransactionGraph(max_edges=10)
+    add(graph, "001", "002", "t1", 0)
+    stats = graph.stats()
+    assert stats["object_bytes"] > 0
+    assert stats["total_bytes"] == stats["array_bytes"] + stats["object_bytes"]
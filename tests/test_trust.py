@@ -0,0 +1,83 @@
+import pytest
+from datetime import datetime
+from unittest.mock import patch
+from app.db.backend import MongoService, RedisTrustWindowModel
+from app.services.trust_service import (
+    reserve_trust_window,
+    release_trust_window,
+    enforce_trust_policy,
+    TrustPolicyError,
+    WINDOW_MISSING,
+    WINDOW_RESERVED,
+    TOTAL_AMOUNT_EXCEEDED,
+    MONTHLY_TXNS_EXCEEDED,
+)
+
+NORMAL = {"total_amount_limit": 5000, "window_months": 3}
+FRAUD_PRONE = {"max_txns_per_month": 10, "max_txn_amount": 100}
+
+
+# Test: a missing window should be rebuilt from MongoDB before reserving
+def test_reserve_rebuilds_missing_window():
+    now = datetime.now()
+    days = [{"day": now.strftime("%Y-%m-%d"), "amount": 4800.0, "count": 2, "high": {1000: 2}}]
+    with patch.object(RedisTrustWindowModel, 'reserve', side_effect=[(WINDOW_MISSING, 0), (WINDOW_RESERVED, 0)]) as mock_reserve, \
+        patch.object(RedisTrustWindowModel, 'load', return_value=True) as mock_load, \
+        patch.object(MongoService, 'get_verified_spending_by_day', return_value=days):
+        reservation = reserve_trust_window('001', 100, now, NORMAL)
+
+    assert mock_reserve.call_count == 2
+    key, fields, _ = mock_load.call_args[0]
+    assert key == 'trust_window:001'
+    assert fields[f"a:{now.toordinal()}"] == 4800.0
+    assert fields[f"h1000:{now.toordinal()}"] == 2
+    assert reservation == {"user_id": '001', "day": now.toordinal(), "amount": 100}
+
+# Test: without restrictions a missing window is not rebuilt
+def test_reserve_without_restrictions_skips_rebuild():
+    with patch.object(RedisTrustWindowModel, 'reserve', return_value=(WINDOW_MISSING, 0)), \
+        patch.object(RedisTrustWindowModel, 'load') as mock_load:
+        assert reserve_trust_window('001', 99999, datetime.now()) is None
+        mock_load.assert_not_called()
+
+# Test: violated limits should be reported with the policy messages
+@pytest.mark.parametrize("code, restrictions, message", [
+    (TOTAL_AMOUNT_EXCEEDED, NORMAL, "Limit exceeded: Max €5000 in 3 months"),
+    (MONTHLY_TXNS_EXCEEDED, FRAUD_PRONE, "Limit exceeded: Max 10 transactions per month"),
+])
+def test_reserve_limit_exceeded(code, restrictions, message):
+    with patch.object(RedisTrustWindowModel, 'reserve', return_value=(code, 0)):
+        with pytest.raises(TrustPolicyError) as e:
+            reserve_trust_window('001', 50, datetime.now(), restrictions)
+    assert str(e.value) == message
+
+# Test: login should not touch the transaction window
+def test_enforce_trust_policy_login():
+    with patch.object(RedisTrustWindowModel, 'reserve') as mock_reserve:
+        assert enforce_trust_policy('001', action="login", score=80) is None
+        mock_reserve.assert_not_called()
+
+# Test: release should remove the reserved amount from the window
+def test_release_trust_window():
+    with patch.object(RedisTrustWindowModel, 'release', return_value=True) as mock_release:
+        assert release_trust_window({"user_id": '001', "day": 739000, "amount": 1200}) is True
+        key, args = mock_release.call_args[0]
+        assert key == 'trust_window:001'
+        assert args[:2] == [739000, 1200]
+    assert release_trust_window(None) is False
+
+# Test: the compiled band tables should match a scan of the bands
+def test_score_bands_lookup():
+    from app.utils.trust_policies import TRUST_POLICY, TRUST_POLICY_BANDS
+    from app.utils.trust_score import SCORE, SCORE_BANDS
+
+    for bands, compiled in ((SCORE, SCORE_BANDS), (TRUST_POLICY, TRUST_POLICY_BANDS)):
+        for score in [-10, 0, 29, 29.5, 30, 49, 50, 74, 75, 89, 90, 100, 101]:
+            scanned = next((band for band in bands if band["min"] <= score <= band["max"]), None)
+            assert compiled.lookup(score) is scanned
+
+
+# Test: a locked account should be refused outside of a request too (scoring workers)
+def test_enforce_trust_policy_locked():
+    with pytest.raises(TrustPolicyError, match="Account is locked"):
+        enforce_trust_policy('001', action="transaction", amount=10, score=10)